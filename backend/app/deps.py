@@ -1,15 +1,48 @@
 # backend/app/deps.py
 from __future__ import annotations
 import os
-from typing import Generator
+from typing import AsyncGenerator, Generator
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 import redis
+import redis.asyncio as aioredis
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+psycopg2://postgres:postgres@db:5432/antiscam")
 engine = create_engine(DATABASE_URL, pool_pre_ping=True, future=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
 
+def _async_url(url: str) -> str:
+    # același DB, driver async (asyncpg) pentru calea fierbinte
+    if url.startswith("postgresql+psycopg2://"):
+        return url.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# Scripturile din seed/ rulează doar la inițializarea unui volum pgdata gol; cele idempotente
+# (ALTER ... IF NOT EXISTS) se reaplică la pornire, ca bazele existente să primească coloanele noi
+SEED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "seed")
+MIGRATIONS = ("003_training_labels.sql",)
+MIGRATION_LOCK_ID = 7301  # pg_advisory_xact_lock: un singur worker aplică, ceilalți așteaptă
+
+def migrate() -> list[str]:
+    """Aplică MIGRATIONS pe `engine` (într-o tranzacție, sub advisory lock). Întoarce fișierele aplicate."""
+    if engine.dialect.name != "postgresql":
+        return []
+    applied = []
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_ID})")
+        for name in MIGRATIONS:
+            with open(os.path.join(SEED_DIR, name), encoding="utf-8") as f:
+                conn.exec_driver_sql(f.read())
+            applied.append(name)
+    return applied
+
 def get_db() -> Generator[Session, None, None]:
     db: Session = SessionLocal()
     try:
@@ -17,6 +50,27 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def get_redis():
     url = os.getenv("REDIS_URL", "redis://redis:6379/0")
     return redis.Redis.from_url(url, decode_responses=True)
+
+_async_redis: aioredis.Redis | None = None
+
+def get_async_redis() -> aioredis.Redis:
+    # un singur client (și pool de conexiuni) per worker, refolosit între request-uri
+    global _async_redis
+    if _async_redis is None:
+        url = os.getenv("REDIS_URL", "redis://redis:6379/0")
+        _async_redis = aioredis.Redis.from_url(url, decode_responses=True)
+    return _async_redis
+
+async def close_async() -> None:
+    global _async_redis
+    if _async_redis is not None:
+        await _async_redis.aclose()
+        _async_redis = None
+    await async_engine.dispose()
@@ -2,15 +2,17 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 from fastapi import Body
 
+import asyncio
 import csv
 import io
 from fastapi import FastAPI, Depends, HTTPException, Query, Body
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 # ---- AI services ----
@@ -21,38 +23,46 @@ from app.services.ai_quiz import generate_quiz, score_quiz_llm
 
 
 # ---- ML (status, train, predict) ----
-from app.ml.model import train_and_save, try_load, predict_proba_one, status as ml_status
+from app.ml import jobs as ml_jobs
+from app.ml.batcher import MicroBatcher
+from app.ml.model import try_load, predict_proba_one, predict_proba_many, status as ml_status
 
 # ---- Payment scoring / rules ----
 from app.schemas import PaymentIn, ScoreOut, AlertOut, QuizIn, QuizOut
 from app.services.quiz import score_quiz
-from app.services.watchlist import add_iban, remove_iban, list_ibans, is_watchlisted
-from app.services.scoring import score_payment
+from app.services.watchlist import add_iban, remove_iban, list_ibans
+from app.services import text_signals
+from app.services.scoring import decide
+from app.services import iban_ids, state_store
+from app.services.persistence import persist_transactions_async, set_label
+from app.services.account_cache import account_cache
+from app.services.write_behind import WriteBehind, WRITE_BEHIND
+from app.services.orchestrator import run_stages, unavailable_reasons, SCORING_BATCH_BUDGET_MS
 from app.services.cop_check import confirmation_of_payee
 
-# ---- Mule Radar (Redis) ----
-from app.services.mule import record_payment, stats_for_iban, top_suspects
+# ---- Mule Radar (state store) ----
+from app.services import mule, mule_graph
+from app.services.mule import stats_for_iban, stats_for_ibans, top_suspects
+from app.services.mule_decay import MuleDecay
 
 # ---- DB models / deps ----
-from app.models import Account, Transaction, Customer
-
-# get_db + get_redis (fallback simplu dacă lipsesc)
-try:
-    from app.deps import get_db, get_redis
-except Exception:  # pragma: no cover
-    from app.deps import get_db  # type: ignore
-    import os, redis
-    def get_redis():
-        return redis.Redis.from_url(
-            os.getenv("REDIS_URL", "redis://redis:6379/0"),
-            decode_responses=True
-        )
+from app.models import Transaction
+
+from app.deps import get_async_db, get_db, close_async, AsyncSessionLocal, migrate
 
 # ------------------------------------------------------------------------------
 # App
 # ------------------------------------------------------------------------------
 app = FastAPI(title="Anti-Scam API")
 
+# Migrările idempotente din seed/ (volumul pgdata nu rerulează initdb); înaintea oricărui acces la DB
+@app.on_event("startup")
+async def _migrate_db():
+    try:
+        await asyncio.to_thread(migrate)
+    except Exception:
+        pass  # DB indisponibil: pornim oricum, ca la celelalte hook-uri
+
 # ML auto-load la pornire (nu blocăm în caz de eroare)
 @app.on_event("startup")
 async def _load_ml():
@@ -61,6 +71,48 @@ async def _load_ml():
     except Exception:
         pass
 
+# Cache IBAN <-> account_id încălzit din `accounts` (nu blocăm pornirea dacă DB lipsește)
+@app.on_event("startup")
+async def _warm_account_cache():
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.run_sync(account_cache.warm)
+    except Exception:
+        pass
+
+# State store-ul (STATE_BACKEND): în Redis, scriptul Lua de stare încărcat o dată per worker
+@app.on_event("startup")
+async def _load_state_store():
+    try:
+        await state_store.get().load()
+    except Exception:
+        pass  # se încarcă la primul NOSCRIPT
+
+# Cererile concurente /scorePayment împart un singur predict pe batch (ML_BATCH_WINDOW_MS)
+ml_batcher = MicroBatcher(predict_proba_many, predict_proba_one)
+
+# Write-behind pentru `transactions` (WRITE_BEHIND=1): decizia nu așteaptă Postgres
+writer = WriteBehind(AsyncSessionLocal)
+
+@app.on_event("startup")
+async def _start_writer():
+    if WRITE_BEHIND:
+        await writer.start()
+
+# Decay pentru leaderboard-ul mule (MULE_DECAY_SEC) + compactarea cheilor (MULE_COMPACT_SEC)
+mule_decay = MuleDecay()
+
+@app.on_event("startup")
+async def _start_mule_decay():
+    await mule_decay.start()
+
+@app.on_event("shutdown")
+async def _close_async_clients():
+    await writer.stop()  # drenează coada înainte de a închide engine-ul
+    await mule_decay.stop()
+    await close_async()
+    ml_jobs.shutdown()
+
 # CORS (pentru Angular dev)
 app.add_middleware(
     CORSMiddleware,
@@ -85,38 +137,33 @@ def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "ts": datetime.utcnow().isoformat()}
+    return {
+        "status": "ok",
+        "ts": datetime.utcnow().isoformat(),
+        "write_behind": writer.stats(),
+        "account_cache": account_cache.stats(),
+        "ml_batcher": ml_batcher.stats(),
+        "desc_memo": {"text_signals": text_signals.info()["memo"], "ml": ml_status().get("text_memo")},
+        "state": state_store.get().stats(),
+        "iban_ids": iban_ids.stats(),
+        "mule_decay": mule_decay.stats(),
+        "mule_graph": mule_graph.G.stats() if mule_graph.MULE_GRAPH else {"enabled": False},
+    }
 
 # ------------------------------------------------------------------------------
 # Score Payment (rules + ML + Mule Radar)
 # ------------------------------------------------------------------------------
-@app.post("/scorePayment", response_model=ScoreOut)
-async def score_payment_endpoint(
-    p: PaymentIn,
-    db: Session = Depends(get_db),
-    r = Depends(get_redis),
-):
-    # 1) CoP (confirmation of payee)
-    provided_name = None
-    if p.description and "payee:" in p.description.lower():
-        provided_name = p.description.split(":", 1)[1].strip()
-    cop_ok, cop_msg = await confirmation_of_payee(p.dst_account_iban, provided_name)
+MAX_BATCH = 1000  # plăți / request pe /scorePayments
+# starea neutră când scriptul Redis nu răspunde în buget
+NO_STATE = {"mule_score": 0, "watchlisted": False, "velocity": (0, []), "velocity_windows": {}}
 
-    # 2) Mule Radar: înregistrare + scor
-    try:
-        record_payment(r, ts_iso=p.ts, src_iban=p.src_account_iban, dst_iban=p.dst_account_iban)
-    except Exception:
-        pass
-    mule_r = 0
-    try:
-        mule_stats = stats_for_iban(r, p.dst_account_iban, hours=24)
-        mule_r = int(mule_stats.get("mule_score", 0))
-    except Exception:
-        mule_r = 0
-    on_watchlist = is_watchlisted(p.dst_account_iban) or mule_r >= 80
+def _provided_name(p: PaymentIn) -> Optional[str]:
+    if p.description and "payee:" in p.description.lower():
+        return p.description.split(":", 1)[1].strip()
+    return None
 
-    # 3) Feature set
-    features: Dict = {
+def _features(p: PaymentIn) -> Dict:
+    return {
         "amount": p.amount,
         "channel": p.channel,
         "is_first_to_payee": p.is_first_to_payee,
@@ -125,71 +172,111 @@ async def score_payment_endpoint(
         "dst_iban": p.dst_account_iban,
     }
 
-    # 4) Reguli + semnale
-    score, action, reasons, cooloff = score_payment(features, cop_ok, on_watchlist)
-    if not cop_ok:
-        reasons.append(f"CoP: {cop_msg}")
-    if mule_r >= 60:
-        reasons.append(f"MuleRadar risk={mule_r}")
-    if on_watchlist and "Beneficiary on watchlist" not in reasons:
-        reasons.append("Beneficiary on watchlist")
+def _ml_row(features: Dict) -> Dict:
+    # doar câmpurile plății: stagiul ML nu așteaptă starea (velocity / mule intră prin reguli,
+    # agregatele pe ferestre se întorc în ScoreOut.velocity_windows)
+    return {
+        "amount": features.get("amount", 0.0),
+        "is_first_to_payee": bool(features.get("is_first_to_payee")),
+        "channel": features.get("channel", "web"),
+        "description": features.get("description") or "",
+    }
 
-    # 5) ML (dacă este model)
-    try:
-        ml_row = {
-            "amount": features.get("amount", 0.0),
-            "is_first_to_payee": bool(features.get("is_first_to_payee")),
-            "channel": features.get("channel", "web"),
-            "description": features.get("description") or "",
-        }
-        ml_p = predict_proba_one(ml_row)  # None dacă modelul nu e încărcat
-        if ml_p is not None:
-            reasons.append(f"ML: p_scam={ml_p:.2f}")
-            rule_norm = min(float(score) / 100.0, 1.0)
-            final = 100.0 * (0.6 * rule_norm + 0.4 * ml_p)
-            score = float(final)
-            if score >= 60:
-                action, cooloff = "hold", 30
-            elif score >= 30:
-                action, cooloff = "warn", 15
-            else:
-                action, cooloff = "allow", 0
-    except NameError:
-        pass
+def _graph_signals(p: PaymentIn) -> Optional[Tuple[int, List[str]]]:
+    # semnalele grafului în proces (MULE_GRAPH=1), din plățile de dinaintea celei curente
+    if not mule_graph.MULE_GRAPH:
+        return None
+    return mule_graph.payment_signals(p.src_account_iban, p.dst_account_iban, mule.to_epoch(p.ts))
+
+def _feed_graph(payments: List[PaymentIn]) -> None:
+    # graful de tranzacții în proces (MULE_GRAPH=1), cu ts-ul plății
+    if mule_graph.MULE_GRAPH:
+        for p in payments:
+            mule_graph.update_graph(p.src_account_iban, p.dst_account_iban, p.amount, ts=mule.to_epoch(p.ts))
+
+async def _persist(db: AsyncSession, payments: List[PaymentIn], decisions: List) -> None:
+    if writer.running:
+        await writer.submit_many(payments, decisions)
+    else:
+        await persist_transactions_async(db, payments, decisions)
 
-    # 6) Persistență minimă (demo)
-    src_acct = db.query(Account).filter(Account.iban == p.src_account_iban).one_or_none()
-    if not src_acct:
-        cust = db.query(Customer).filter(Customer.external_id == "demo").one_or_none()
-        if not cust:
-            cust = Customer(external_id="demo", name="Demo User")
-            db.add(cust)
-            db.flush()
-        src_acct = Account(customer_id=cust.id, iban=p.src_account_iban)
-        db.add(src_acct)
-        db.flush()
-
-    dst_acct = db.query(Account).filter(Account.iban == p.dst_account_iban).one_or_none()
-    dst_account_id = dst_acct.id if dst_acct else None
-
-    txn = Transaction(
-        ts=p.ts,
-        src_account_id=src_acct.id,
-        dst_account_id=dst_account_id,
-        dst_iban=p.dst_account_iban,
-        amount_cents=int(round(p.amount * 100)),
-        currency=p.currency,
-        channel=p.channel,
-        is_first_to_payee=p.is_first_to_payee,
-        device_fp=p.device_fp,
-        risk_score=score,
-        risk_reasons=reasons,
-        action=action,
+@app.post("/scorePayment", response_model=ScoreOut)
+async def score_payment_endpoint(
+    p: PaymentIn,
+    db: AsyncSession = Depends(get_async_db),
+):
+    features = _features(p)
+
+    # 1) Semnale independente, concurent, sub bugetul de latență (SCORING_BUDGET_MS).
+    #    Mule + velocity + watchlist = un singur apel la state store (în Redis, un EVALSHA).
+    res, unavailable = await run_stages({
+        "cop": confirmation_of_payee(p.dst_account_iban, _provided_name(p)),
+        "state": state_store.get().record_and_fetch(p, mule.DEFAULT_HOURS),
+        "ml": ml_batcher.predict(_ml_row(features)),  # None dacă modelul nu e încărcat
+    })
+    cop_ok, cop_msg = res.get("cop", (True, "unavailable"))
+    state = res.get("state") or NO_STATE
+
+    # 2) Reguli + semnale + ML (stagiile lipsă contribuie neutru)
+    score, action, reasons, cooloff = decide(
+        features, cop_ok=cop_ok, cop_msg=cop_msg, mule_r=state["mule_score"],
+        watchlisted=state["watchlisted"], ml_p=res.get("ml"), velocity=state["velocity"],
+        graph=_graph_signals(p),
     )
-    db.add(txn)
-    db.commit()
+    reasons.extend(unavailable_reasons(unavailable))
+
+    # 3) Persistență minimă (demo) – în coada write-behind dacă e activă
+    await _persist(db, [p], [(score, action, reasons)])
+    _feed_graph([p])
+
+    return ScoreOut(risk_score=score, action=action, reasons=reasons, cooloff_minutes=cooloff,
+                    velocity_windows=state["velocity_windows"])
+
+@app.post("/scorePayments", response_model=List[ScoreOut])
+async def score_payments_endpoint(
+    payments: List[PaymentIn] = Body(...),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Scorare în lot (burst-uri din core banking): aceleași reguli ca /scorePayment, dar
+    watchlist/mule/velocity într-un singur apel la state store (în Redis, un pipeline cu un
+    EVALSHA per plată), ML o
+    singură dată pe matricea întregului lot și un singur INSERT bulk + commit.
+    """
+    if len(payments) > MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"max {MAX_BATCH} payments per batch")
+    if not payments:
+        return []
+
+    features = [_features(p) for p in payments]
+    res, unavailable = await run_stages({
+        "cop": asyncio.gather(*(confirmation_of_payee(p.dst_account_iban, _provided_name(p)) for p in payments)),
+        "state": state_store.get().record_and_fetch_many(payments, mule.DEFAULT_HOURS),
+        "ml": asyncio.to_thread(predict_proba_many, [_ml_row(f) for f in features]),
+    }, budget_ms=SCORING_BATCH_BUDGET_MS)
+    missing = unavailable_reasons(unavailable)
+
+    n = len(payments)
+    cops = res.get("cop") or [(True, "unavailable")] * n
+    signals = res.get("state") or [NO_STATE] * n
+    ml_ps = res.get("ml") or [None] * n
+
+    out: List[ScoreOut] = []
+    decisions = []
+    for p, f, (cop_ok, cop_msg), sig, ml_p in zip(payments, features, cops, signals, ml_ps):
+        score, action, reasons, cooloff = decide(
+            f, cop_ok=cop_ok, cop_msg=cop_msg, mule_r=sig["mule_score"],
+            watchlisted=sig["watchlisted"], ml_p=ml_p, velocity=sig["velocity"],
+            graph=_graph_signals(p),
+        )
+        reasons.extend(missing)
+        decisions.append((score, action, reasons))
+        out.append(ScoreOut(risk_score=score, action=action, reasons=reasons, cooloff_minutes=cooloff,
+                            velocity_windows=sig["velocity_windows"]))
 
-    return ScoreOut(risk_score=score, action=action, reasons=reasons, cooloff_minutes=cooloff)
+    await _persist(db, payments, decisions)
+    _feed_graph(payments)
+    return out
 
 # ------------------------------------------------------------------------------
 # Alerts (list + decision)
@@ -219,10 +306,7 @@ def list_alerts(
     rows = db.execute(q).scalars().all()
 
     account_ids = {r.src_account_id for r in rows if r.src_account_id} | {r.dst_account_id for r in rows if r.dst_account_id}
-    id_to_iban: Dict[int, str] = {}
-    if account_ids:
-        accts = db.query(Account).filter(Account.id.in_(account_ids)).all()
-        id_to_iban = {a.id: a.iban for a in accts}
+    id_to_iban = account_cache.ibans_for(db, account_ids)
 
     out: List[AlertOut] = []
     for r in rows:
@@ -247,6 +331,7 @@ def decide_alert(alert_id: int, decision: str, db: Session = Depends(get_db)):
     if not txn:
         raise HTTPException(status_code=404, detail="alert not found")
     txn.action = "allow" if decision == "release" else "hold"
+    set_label(txn, 0 if decision == "release" else 1, "analyst")
     db.commit()
     return {"ok": True, "id": alert_id, "new_action": txn.action}
 
@@ -279,10 +364,12 @@ def quiz_decision(alert_id: int, q: QuizIn, db: Session = Depends(get_db)):
     score, decision, reasons = score_quiz(q)
     if decision == "release":
         txn.action = "allow"
+        set_label(txn, 0, "quiz")
     elif decision == "warn":
-        txn.action = "warn"
+        txn.action = "warn"  # rezultat nesigur -> fără etichetă
     else:
         txn.action = "hold"
+        set_label(txn, 1, "quiz")
 
     db.commit()
     return QuizOut(id=int(txn.id), previous_action=prev, new_action=txn.action, score=score, reasons=reasons)
@@ -304,6 +391,22 @@ def remove_watchlist(iban: str):
     remove_iban(iban)
     return {"ok": True, "ibans": list_ibans()}
 
+# ------------------------------------------------------------------------------
+# Text signals (liste de cuvinte-cheie)
+# ------------------------------------------------------------------------------
+@app.get("/signals")
+def get_signals():
+    return text_signals.info()
+
+@app.post("/signals/reload")
+def reload_signals():
+    # reîncarcă din TEXT_SIGNALS_PATH doar în workerul care primește cererea;
+    # ceilalți preiau fișierul la următorul check de mtime (TEXT_SIGNALS_CHECK_SEC)
+    try:
+        return text_signals.reload()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"cannot load text signals: {e}")
+
 # ------------------------------------------------------------------------------
 # Alerts export CSV
 # ------------------------------------------------------------------------------
@@ -326,10 +429,7 @@ def export_alerts_csv(
     rows = db.execute(q).scalars().all()
 
     account_ids = {r.src_account_id for r in rows if r.src_account_id} | {r.dst_account_id for r in rows if r.dst_account_id}
-    id_to_iban: Dict[int, str] = {}
-    if account_ids:
-        accts = db.query(Account).filter(Account.id.in_(account_ids)).all()
-        id_to_iban = {a.id: a.iban for a in accts}
+    id_to_iban = account_cache.ibans_for(db, account_ids)
 
     buf = io.StringIO()
     w = csv.writer(buf)
@@ -354,25 +454,84 @@ def export_alerts_csv(
 # ------------------------------------------------------------------------------
 # ML endpoints
 # ------------------------------------------------------------------------------
-@app.post("/ml/train")
-def ml_train(n: int = Query(3000, ge=500, le=50000), scam_ratio: float = Query(0.5, ge=0.1, le=0.9), seed: int = 42):
-    meta = train_and_save(n=n, scam_ratio=scam_ratio, seed=seed)
-    return {"ok": True, "meta": meta}
+# până la model.ML_TRAIN_FULL_MAX_ROWS antrenare pe toată matricea (CSR), peste pe bucăți
+# (SGD + hashing), deci memoria jobului nu crește cu n
+ML_TRAIN_MAX_ROWS = 5_000_000
+
+# antrenarea rulează într-un proces separat; aici doar punem jobul în coadă
+@app.post("/ml/train", status_code=202)
+def ml_train(n: int = Query(3000, ge=500, le=ML_TRAIN_MAX_ROWS), scam_ratio: float = Query(0.5, ge=0.1, le=0.9), seed: int = 42,
+             feature_mode: str = Query("tfidf", pattern="^(tfidf|hashing)$"),
+             dataset: Optional[str] = Query(None, pattern=r"^[A-Za-z0-9_][A-Za-z0-9_.-]*$")):
+    # dataset: set pre-generat din ML_DATASETS_DIR (doar nume, fără căi)
+    job = ml_jobs.submit(n=n, scam_ratio=scam_ratio, seed=seed, feature_mode=feature_mode, dataset=dataset)
+    return {"ok": True, "job_id": job["id"], "job": job}
+
+# antrenare incrementală din tranzacțiile etichetate (decizii analist + quiz)
+@app.post("/ml/train/transactions", status_code=202)
+def ml_train_transactions(continue_current: bool = Query(False, alias="continue"),
+                          chunk_rows: int = Query(20000, ge=1000, le=500_000),
+                          epochs: int = Query(1, ge=1, le=20), seed: int = 42):
+    job = ml_jobs.submit(source="transactions", continue_current=continue_current,
+                         chunk_rows=chunk_rows, epochs=epochs, seed=seed)
+    return {"ok": True, "job_id": job["id"], "job": job}
+
+@app.get("/ml/jobs")
+def ml_jobs_list(limit: int = Query(20, ge=1, le=200)):
+    return ml_jobs.list_jobs(limit=limit)
+
+@app.get("/ml/jobs/{job_id}")
+def ml_job(job_id: str):
+    job = ml_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
 
 @app.get("/ml/status")
 def ml_status_route():
     return ml_status()
 
+@app.get("/ml/batcher")
+async def ml_batcher_stats():
+    return ml_batcher.stats()
+
 # ------------------------------------------------------------------------------
 # Mule Radar endpoints
 # ------------------------------------------------------------------------------
-@app.get("/mule/{iban}")
-def mule_one(iban: str, hours: int = Query(24, ge=1, le=168), r = Depends(get_redis)):
-    return stats_for_iban(r, iban, hours=hours)
+MAX_MULE_BULK = 1000  # IBAN-uri / request pe /mule/stats
+
+@app.post("/mule/stats")
+def mule_stats_bulk(ibans: List[str] = Body(..., embed=True), hours: int = Query(24, ge=1, le=mule.MAX_HOURS)):
+    """Statisticile mule pentru mai multe IBAN-uri (aceleași câmpuri ca /mule/{iban}), un singur pipeline."""
+    if len(ibans) > MAX_MULE_BULK:
+        raise HTTPException(status_code=413, detail=f"max {MAX_MULE_BULK} ibans per request")
+    return stats_for_ibans(ibans, hours=hours)
+
+@app.get("/mule/graph/{iban}")
+def mule_graph_one(iban: str, hops: int = Query(3, ge=2, le=4), within_min: int = Query(60, ge=1, le=24 * 60)):
+    """Semnale multi-hop din graful în proces: pass-through, lanțuri de layering, cicluri scurte."""
+    if not mule_graph.MULE_GRAPH:
+        raise HTTPException(status_code=404, detail="transaction graph disabled (MULE_GRAPH=0)")
+    return mule_graph.analyze(iban, hops=hops, within_sec=within_min * 60)
+
+# rutele fixe (/mule/usage, /mule/top) înaintea lui /mule/{iban} (altfel sunt luate drept IBAN)
+@app.get("/mule/usage")
+def mule_usage(sample: int = Query(200, ge=1, le=10000)):
+    """Chei / membri / memorie per familie de chei mule (capacity planning)."""
+    return {"key_ttl_sec": mule.MULE_KEY_TTL_SEC, "families": mule.usage(sample), "iban_ids": iban_ids.stats(),
+            "maintenance": mule_decay.stats()}
 
 @app.get("/mule/top")
-def mule_top(hours: int = Query(24, ge=1, le=168), limit: int = Query(10, ge=1, le=50), r = Depends(get_redis)):
-    return top_suspects(r, hours=hours, limit=limit)
+def mule_top(hours: int = Query(mule.DEFAULT_HOURS, ge=1, le=mule.MAX_HOURS), limit: int = Query(10, ge=1, le=50)):
+    """Top suspecți din leaderboard; doar pentru fereastra de scoring (DEFAULT_HOURS), altfel 400."""
+    try:
+        return top_suspects(hours=hours, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/mule/{iban}")
+def mule_one(iban: str, hours: int = Query(24, ge=1, le=mule.MAX_HOURS)):
+    return stats_for_iban(iban, hours=hours)
 
 # ------------------------------------------------------------------------------
 # AI endpoints (EXPLAIN / CLASSIFY) – robuste, cu fallback JSON
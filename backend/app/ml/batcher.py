@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-batching pentru inferența ML în calea /scorePayment.
+
+Cererile concurente nu mai fac fiecare câte un asyncio.to_thread(predict_proba_one):
+rândurile se adună în event loop și pleacă împreună într-un singur predict_proba_many,
+rulat într-un thread. Fiecare apelant își primește probabilitatea prin propriul Future.
+
+Un batch pleacă atunci când:
+  - nu e niciun batch în lucru (la trafic mic nu așteptăm degeaba), sau
+  - batch-ul în lucru s-a terminat, sau
+  - s-au strâns ML_BATCH_MAX_ROWS rânduri, sau
+  - a trecut ML_BATCH_WINDOW_MS de la primul rând (limita de întârziere adăugată).
+
+ML_BATCH_WINDOW_MS=0 dezactivează batching-ul (un thread per cerere, ca înainte).
+"""
+from __future__ import annotations
+import asyncio
+import bisect
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+ML_BATCH_WINDOW_MS = float(os.getenv("ML_BATCH_WINDOW_MS", "2"))
+ML_BATCH_MAX_ROWS = int(os.getenv("ML_BATCH_MAX_ROWS", "64"))
+
+# limitele superioare ale bucket-urilor din histograme (ultimul bucket = restul)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+DELAY_BUCKETS_MS = (0.25, 0.5, 1, 2, 5, 10, 25)
+
+
+class _Histogram:
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.n += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def snapshot(self) -> Dict:
+        labels = [f"<={b:g}" for b in self.bounds] + [f">{self.bounds[-1]:g}"]
+        return {
+            "count": self.n,
+            "avg": round(self.total / self.n, 3) if self.n else 0.0,
+            "max": round(self.max, 3),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class MicroBatcher:
+    """
+    predict(row) -> probabilitate (sau None dacă modelul nu e încărcat).
+    Un singur event loop per worker, deci starea (listă + timer) nu are nevoie de lock.
+    """
+
+    def __init__(self, predict_many: Callable[[List[Dict]], Optional[List[float]]],
+                 predict_one: Callable[[Dict], Optional[float]],
+                 window_ms: float = ML_BATCH_WINDOW_MS, max_rows: int = ML_BATCH_MAX_ROWS):
+        self._predict_many = predict_many
+        self._predict_one = predict_one
+        self.window_ms = window_ms
+        self.max_rows = max(1, max_rows)
+        self._pending: List[Tuple[Dict, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: set = set()
+        self._sizes = _Histogram(SIZE_BUCKETS)
+        self._delays = _Histogram(DELAY_BUCKETS_MS)
+        self._errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_ms > 0
+
+    async def predict(self, row: Dict) -> Optional[float]:
+        if not self.enabled:
+            return await asyncio.to_thread(self._predict_one, row)
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((row, fut, loop.time()))
+        if len(self._pending) >= self.max_rows or not self._inflight:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_ms / 1000.0, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._inflight.discard(task)
+        # ce s-a strâns cât a rulat batch-ul anterior pleacă imediat
+        if self._pending and not self._inflight:
+            self._flush()
+
+    async def _run(self, batch: List[Tuple[Dict, asyncio.Future, float]]) -> None:
+        now = asyncio.get_running_loop().time()
+        # apelanții care au depășit deja bugetul de scoring (anulați) nu mai intră în batch
+        live = [(row, fut) for row, fut, _ in batch if not fut.done()]
+        for _, fut, t0 in batch:
+            self._delays.observe((now - t0) * 1000.0)
+        if not live:
+            return
+        self._sizes.observe(len(live))
+        try:
+            probs = await asyncio.to_thread(self._predict_many, [row for row, _ in live])
+        except Exception as e:
+            self._errors += 1
+            for _, fut in live:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        if probs is None:
+            probs = [None] * len(live)
+        for (_, fut), p in zip(live, probs):
+            if not fut.done():
+                fut.set_result(p)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window_ms,
+            "max_rows": self.max_rows,
+            "pending": len(self._pending),
+            "inflight_batches": len(self._inflight),
+            "errors": self._errors,
+            "batch_size": self._sizes.snapshot(),
+            "queue_delay_ms": self._delays.snapshot(),
+        }
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark-uri pentru calea de inferență (rulare din backend/):
+
+    python -m app.ml.bench --rows 2000
+
+Raportează µs/apel pentru predict_proba_one pe calea sklearn (prepare_xy + predict_proba)
+vs. scorerul compilat și diferența maximă dintre probabilități. Scorerul compilat e măsurat
+rece (fără text_memo: fiecare descriere e tokenizată) și cald (text_memo deja plin);
+speedup-ul e calculat pe cifra rece.
+
+Cu --concurrency N compară, pentru N cereri concurente în event loop, un
+asyncio.to_thread(predict_proba_one) per cerere vs. MicroBatcher.
+
+Cu --dataset DIR rândurile vin dintr-un set pre-generat (python -m app.ml.synthetic).
+
+Cu --text-terms N compară text_risk pe un dicționar de N termeni: bucla `term in desc`
+(implementarea veche) vs. automatul Aho-Corasick din KeywordMatcher.
+
+Cu --graph-edges N măsoară graful de tranzacții din mule_graph pe N plăți sintetice:
+inserare (µs/plată), interogări multi-hop (µs/IBAN) și memoria (tracemalloc); dacă
+networkx e instalat, raportează și inserarea / memoria unui nx.DiGraph echivalent.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import time
+from typing import Callable, Dict, List
+
+from app.ml import model
+from app.ml.batcher import MicroBatcher
+from app.ml.compiled import CompiledScorer, max_abs_diff, probe_rows
+from app.ml.features import prepare_xy
+from app.ml.synthetic import generate_samples, load_columns, rows_from_columns
+from app.services.keyword_matcher import KeywordMatcher
+from app.services.mule_graph import TxGraph
+from app.services.text_signals import KEYPHRASES, KEYWORDS
+
+
+def _us_per_call(fn: Callable[[Dict], object], rows: List[Dict], repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for r in rows:
+            fn(r)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(rows) * 1e6
+
+
+def _rows(n_rows: int, seed: int, dataset: str | None) -> List[Dict]:
+    if dataset:
+        return rows_from_columns(load_columns(dataset, limit=n_rows))
+    rows, _, _ = generate_samples(n=n_rows, seed=seed)
+    return rows
+
+
+def bench_predict_one(n_rows: int, dataset: str | None = None) -> Dict:
+    if not model.try_load():
+        print("no model artifacts found, training a small one (n=3000)...")
+        model.train_and_save(n=3000)
+    clf, vect = model.load_sklearn()
+    # scorerul servit de workeri (ponderi mmap) sau, pentru artefacte vechi, exportat acum
+    scorer = model.ml_state.scorer or CompiledScorer.from_sklearn(clf, vect)
+
+    rows = _rows(n_rows, 123, dataset)
+
+    def sklearn_one(row: Dict) -> float:
+        X, _, _ = prepare_xy([row], [0], vectorizer=vect)
+        return float(clf.predict_proba(X)[:, 1][0])
+
+    memo = scorer.text_memo
+    try:
+        scorer.text_memo = None  # rece: fără hit-uri din repetările anterioare
+        cold_us = _us_per_call(scorer.predict_proba, rows)
+    finally:
+        scorer.text_memo = memo
+    if memo is not None:
+        memo.clear()
+        for r in rows:  # cald: descrierile setului sunt deja în memo
+            scorer.predict_proba(r)
+
+    out = {
+        "rows": len(rows),
+        "sklearn_us": _us_per_call(sklearn_one, rows, repeat=1),
+        "compiled_cold_us": cold_us,
+        "compiled_warm_us": _us_per_call(scorer.predict_proba, rows) if memo is not None else None,
+        "max_abs_diff": max_abs_diff(scorer, clf, vect, rows + probe_rows()),
+    }
+    out["speedup"] = out["sklearn_us"] / out["compiled_cold_us"]
+    return out
+
+
+def bench_batcher(n_rows: int, concurrency: int, window_ms: float, max_rows: int,
+                  dataset: str | None = None) -> Dict:
+    if not model.try_load():
+        model.train_and_save(n=3000)
+    rows = _rows(n_rows, 321, dataset)
+
+    async def drive(predict) -> float:
+        it = iter(rows)
+
+        async def client():
+            for row in it:
+                await predict(row)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return time.perf_counter() - t0
+
+    async def run() -> Dict:
+        direct = await drive(lambda row: asyncio.to_thread(model.predict_proba_one, row))
+        batcher = MicroBatcher(model.predict_proba_many, model.predict_proba_one,
+                               window_ms=window_ms, max_rows=max_rows)
+        batched = await drive(batcher.predict)
+        return {"direct_rps": n_rows / direct, "batched_rps": n_rows / batched, "stats": batcher.stats()}
+
+    return asyncio.run(run())
+
+
+def bench_text(n_terms: int, n_rows: int, dataset: str | None = None) -> Dict:
+    import random
+    rnd = random.Random(7)
+    letters = "abcdefghijklmnopqrstuvwxyzăîșț"
+    entries = list(KEYPHRASES.items()) + list(KEYWORDS.items())
+    while len(entries) < n_terms:
+        term = "".join(rnd.choice(letters) for _ in range(rnd.randint(4, 12)))
+        entries.append((term, rnd.randint(1, 10)))
+    descs = [r["description"].lower() for r in _rows(n_rows, 99, dataset)]
+
+    def naive(desc: str) -> int:
+        return sum(w for term, w in entries if term in desc)
+
+    t0 = time.perf_counter()
+    matcher = KeywordMatcher(entries)
+    build_ms = (time.perf_counter() - t0) * 1000.0
+
+    def compiled(desc: str) -> int:
+        return sum(entries[i][1] for i in matcher.find(desc))
+
+    out = {
+        "terms": len(entries),
+        "states": matcher.states,
+        "rows": len(descs),
+        "build_ms": build_ms,
+        "naive_us": _us_per_call(naive, descs, repeat=1),
+        "compiled_us": _us_per_call(compiled, descs),
+    }
+    out["speedup"] = out["naive_us"] / out["compiled_us"]
+    return out
+
+
+def _payments(n_edges: int, seed: int = 11) -> List[tuple]:
+    """Plăți (src, dst, amount, ts) pe 24h: conturi obișnuite + câteva lanțuri de mule."""
+    import random
+    rnd = random.Random(seed)
+    n_acc = max(10, n_edges // 4)
+    acc = [f"RO{i:02d}BANK{i:016d}" for i in range(n_acc)]
+    t0 = time.time() - 86400
+    out = []
+    for i in range(n_edges):
+        ts = t0 + 86400 * i / n_edges
+        if i % 50 == 0:
+            # layering: a -> m1 -> m2 -> m3, câte câteva minute între hop-uri
+            a, *m = rnd.sample(acc, 4)
+            for hop, (s, d) in enumerate(zip([a] + m, m)):
+                out.append((s, d, 900.0 - hop * 10, ts + hop * 120))
+        else:
+            s, d = rnd.sample(acc, 2)
+            out.append((s, d, round(rnd.uniform(5, 500), 2), ts))
+    return out[:n_edges]
+
+
+def bench_graph(n_edges: int, n_queries: int = 500) -> Dict:
+    import tracemalloc
+    pays = _payments(n_edges)
+    now = pays[-1][3] + 1
+
+    def build(graph, add) -> float:
+        t0 = time.perf_counter()
+        for s, d, a, ts in pays:
+            add(graph, s, d, a, ts)
+        return (time.perf_counter() - t0) / len(pays) * 1e6
+
+    def traced(make, add) -> float:
+        tracemalloc.start()
+        graph = make()
+        build(graph, add)
+        mb = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+        return mb
+
+    tx_add = lambda g, s, d, a, ts: g.add(s, d, a, ts)
+    g = TxGraph()
+    insert_us = build(g, tx_add)
+    ibans = [d for _, d, _, _ in pays[:: max(1, len(pays) // n_queries)]][:n_queries]
+    out = {
+        "payments": len(pays), **g.stats(),
+        "insert_us": insert_us,
+        "graph_mb": traced(TxGraph, tx_add),
+        "degrees_us": _us_per_call(lambda i: g.degrees(i, now), ibans),
+        "pass_through_us": _us_per_call(lambda i: g.pass_through(i, 3600, now), ibans),
+        "chains_us": _us_per_call(lambda i: g.chains(i, 3, 3600, now), ibans),
+        "cycles_us": _us_per_call(lambda i: g.cycles(i, 4, now), ibans),
+    }
+    try:
+        import networkx as nx
+    except ImportError:
+        return out
+    nx_add = lambda g, s, d, a, ts: g.add_edge(s, d, amount=a, ts=ts)
+    out["nx_insert_us"] = build(nx.DiGraph(), nx_add)
+    out["nx_mb"] = traced(nx.DiGraph, nx_add)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=0)
+    ap.add_argument("--window-ms", type=float, default=2.0)
+    ap.add_argument("--max-rows", type=int, default=64)
+    ap.add_argument("--dataset", default=None)
+    ap.add_argument("--text-terms", type=int, default=0)
+    ap.add_argument("--graph-edges", type=int, default=0)
+    args = ap.parse_args()
+
+    if args.graph_edges:
+        g = bench_graph(args.graph_edges)
+        print(f"mule_graph  payments={g['payments']} nodes={g['nodes']} edges={g['edges']} "
+              f"compactions={g['compactions']}")
+        print(f"  insert        {g['insert_us']:9.1f} us/payment   memory {g['graph_mb']:.1f} MB")
+        for q in ("degrees", "pass_through", "chains", "cycles"):
+            print(f"  {q:<13} {g[q + '_us']:9.1f} us/iban")
+        if "nx_insert_us" in g:
+            print(f"  networkx      {g['nx_insert_us']:9.1f} us/payment   memory {g['nx_mb']:.1f} MB "
+                  f"(ultima muchie per pereche, fără fereastră)")
+        return
+
+    if args.text_terms:
+        t = bench_text(args.text_terms, args.rows, args.dataset)
+        print(f"text_risk  terms={t['terms']} states={t['states']} rows={t['rows']} "
+              f"build={t['build_ms']:.0f}ms")
+        print(f"  term in desc  {t['naive_us']:9.1f} us/call")
+        print(f"  aho-corasick  {t['compiled_us']:9.1f} us/call   ({t['speedup']:.1f}x)")
+        return
+
+    if args.concurrency:
+        b = bench_batcher(args.rows, args.concurrency, args.window_ms, args.max_rows, args.dataset)
+        st = b["stats"]
+        print(f"concurrent scoring  rows={args.rows} concurrency={args.concurrency} "
+              f"window={args.window_ms}ms max_rows={args.max_rows}")
+        print(f"  to_thread/request  {b['direct_rps']:9.0f} rows/s")
+        print(f"  micro-batched      {b['batched_rps']:9.0f} rows/s")
+        print(f"  batch size avg {st['batch_size']['avg']}  max {st['batch_size']['max']}")
+        print(f"  queue delay ms avg {st['queue_delay_ms']['avg']}  max {st['queue_delay_ms']['max']}")
+        return
+
+    r = bench_predict_one(args.rows, args.dataset)
+    print(f"predict_proba_one  rows={r['rows']}")
+    print(f"  sklearn   {r['sklearn_us']:9.1f} us/call")
+    print(f"  compiled  {r['compiled_cold_us']:9.1f} us/call   ({r['speedup']:.0f}x, cold: no text memo)")
+    if r["compiled_warm_us"] is not None:
+        print(f"  compiled  {r['compiled_warm_us']:9.1f} us/call   (warm: text memo hits)")
+    print(f"  max |p_sklearn - p_compiled| = {r['max_abs_diff']:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import json
+import math
+import os
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy.special import expit
+from sklearn.utils import murmurhash3_32
+
+from app.ml.features import CHANNELS, amount_column, feature_mode
+from app.services.desc_memo import make_memo, memo_key
+
+
+def _hash_column(term: str, n_features: int) -> int:
+    """Coloana dată de HashingVectorizer (murmurhash3_32 pe UTF-8, seed 0, cu semn)."""
+    h = murmurhash3_32(term, seed=0)
+    if h == -2147483648:  # abs(-2**31) nu încape în int32; sklearn folosește formula de mai jos
+        return (2147483647 - (n_features - 1)) % n_features
+    return abs(h) % n_features
+
+
+def _f32(x: float) -> float:
+    # prepare_xy lucrează în float32; rotunjim la fel ca să dăm aceleași probabilități
+    return float(np.float32(x))
+
+
+class CompiledScorer:
+    """
+    Inferență pentru un singur rând, fără sklearn, pentru modelul
+    [amount, is_first_to_payee | one-hot channel | text(description)] + LogisticRegression.
+
+    La încărcare exportăm din modelul antrenat:
+      - ponderile numerice și pe canal
+      - coef pe text și, în modul "tfidf", vocabularul (termen -> coloană) + idf
+    La predicție tokenizăm descrierea ca vectorizerul sklearn, găsim coloana fiecărui
+    termen (vocabular sau hash, în modul "hashing") și calculăm produsul scalar direct
+    pe termenii prezenți (vector rar), cu normalizarea L2, fără matrice densă.
+
+    save()/load() folosesc fișiere .npy; load() le deschide cu mmap_mode="r", deci
+    paginile cu ponderi sunt partajate între workerii uvicorn (doar vocabularul e per proces).
+
+    Pentru un model fix, vectorul rar de text al unei descrieri se reduce la un singur
+    număr (contribuția la logit), așa că text_memo păstrează direct acel număr. Cache-ul
+    aparține scorerului, deci un model nou pornește cu cache gol.
+    """
+
+    def __init__(self, intercept: float, w_num: List[float], w_channel: List[float],
+                 vocab: Dict[str, int] | None, idf: np.ndarray | None, w_text: np.ndarray, token_pattern: str,
+                 ngram_range: Tuple[int, int] = (1, 1), n_features: int | None = None,
+                 amount_transform: str = "raw"):
+        self.intercept = float(intercept)
+        self.w_amount, self.w_first = (float(w) for w in w_num)
+        self.w_channel = {c: float(w) for c, w in zip(CHANNELS, w_channel)}
+        # vocab=None + n_features -> modul hashing (fără vocabular, fără idf)
+        self.vocab = vocab
+        self.n_features = n_features
+        self.mode = "tfidf" if vocab is not None else "hashing"
+        # np.asarray: vedere ndarray simplă peste memmap (indexarea pe np.memmap e mai lentă)
+        self.idf = np.asarray(idf) if idf is not None else None
+        self.w_text = np.asarray(w_text)
+        self.amount_transform = amount_transform
+        self.token_pattern = token_pattern
+        self.token_re = re.compile(token_pattern)
+        self.min_n, self.max_n = ngram_range
+        self.text_memo = make_memo()
+
+    @classmethod
+    def from_sklearn(cls, clf, vect, amount_transform: str = "raw") -> "CompiledScorer":
+        if vect.norm != "l2" or vect.binary or vect.analyzer != "word" or not vect.lowercase:
+            raise ValueError("only lowercase word n-grams with l2 norm are supported")
+        hashing = feature_mode(vect) == "hashing"
+        if hashing and vect.alternate_sign:
+            raise ValueError("HashingVectorizer(alternate_sign=True) is not supported")
+        if not hashing and (vect.sublinear_tf or not vect.use_idf):
+            raise ValueError("only TfidfVectorizer(use_idf=True, sublinear_tf=False) is supported")
+        coef = np.asarray(clf.coef_, dtype=np.float64).ravel()
+        n_num, n_ch = 2, len(CHANNELS)
+        return cls(
+            intercept=float(np.ravel(clf.intercept_)[0]),
+            w_num=coef[:n_num].tolist(),
+            w_channel=coef[n_num:n_num + n_ch].tolist(),
+            vocab=None if hashing else dict(vect.vocabulary_),
+            idf=None if hashing else np.asarray(vect.idf_, dtype=np.float64),
+            w_text=coef[n_num + n_ch:].copy(),
+            token_pattern=vect.token_pattern,
+            ngram_range=tuple(vect.ngram_range),
+            n_features=vect.n_features if hashing else None,
+            amount_transform=amount_transform,
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Scrie scorerul în directorul `path`: coef.npy + scorer.json, plus idf.npy și
+        vocab.json doar în modul "tfidf" (modul hashing nu are vocabular).
+        """
+        coef = np.concatenate([[self.w_amount, self.w_first],
+                               [self.w_channel[c] for c in CHANNELS],
+                               self.w_text]).astype(np.float64)
+        np.save(os.path.join(path, "coef.npy"), coef)
+        if self.mode == "tfidf":
+            np.save(os.path.join(path, "idf.npy"), np.asarray(self.idf, dtype=np.float64))
+            terms = [""] * len(self.vocab)
+            for t, j in self.vocab.items():
+                terms[j] = t
+            with open(os.path.join(path, "vocab.json"), "w") as f:
+                json.dump(terms, f, ensure_ascii=False)
+        with open(os.path.join(path, "scorer.json"), "w") as f:
+            json.dump({
+                "intercept": self.intercept,
+                "channels": CHANNELS,
+                "feature_mode": self.mode,
+                "n_features": self.n_features,
+                "amount_transform": self.amount_transform,
+                "token_pattern": self.token_pattern,
+                "ngram_range": [self.min_n, self.max_n],
+            }, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "CompiledScorer":
+        with open(os.path.join(path, "scorer.json")) as f:
+            spec = json.load(f)
+        if spec["channels"] != CHANNELS:
+            raise ValueError(f"scorer built for channels {spec['channels']}, expected {CHANNELS}")
+        mode = "r" if mmap else None
+        coef = np.load(os.path.join(path, "coef.npy"), mmap_mode=mode)
+        idf, vocab = None, None
+        if spec.get("feature_mode", "tfidf") == "tfidf":
+            idf = np.load(os.path.join(path, "idf.npy"), mmap_mode=mode)
+            with open(os.path.join(path, "vocab.json")) as f:
+                vocab = {t: j for j, t in enumerate(json.load(f))}
+        n_num, n_ch = 2, len(CHANNELS)
+        return cls(
+            intercept=spec["intercept"],
+            w_num=[float(w) for w in coef[:n_num]],
+            w_channel=[float(w) for w in coef[n_num:n_num + n_ch]],
+            vocab=vocab,
+            idf=idf,
+            w_text=coef[n_num + n_ch:],
+            token_pattern=spec["token_pattern"],
+            ngram_range=tuple(spec["ngram_range"]),
+            n_features=spec.get("n_features"),
+            amount_transform=spec.get("amount_transform", "raw"),
+        )
+
+    def _ngrams(self, text: str) -> List[str]:
+        tokens = self.token_re.findall(text)
+        if self.max_n == 1:
+            return tokens
+        out = tokens[:] if self.min_n == 1 else []
+        n_tok = len(tokens)
+        for n in range(max(self.min_n, 2), min(self.max_n, n_tok) + 1):
+            for i in range(n_tok - n + 1):
+                out.append(" ".join(tokens[i:i + n]))
+        return out
+
+    def _term_counts(self, description: str) -> Dict[int, int]:
+        """coloană de text -> număr de apariții în descriere (coliziunile de hash se adună)."""
+        # prepare_xy + vectorizer(lowercase=True) -> text mic
+        text = (description or "").lower()
+        counts: Dict[int, int] = {}
+        vocab = self.vocab
+        if vocab is None:
+            n_features = self.n_features
+            for g in self._ngrams(text):
+                j = _hash_column(g, n_features)
+                counts[j] = counts.get(j, 0) + 1
+            return counts
+        for g in self._ngrams(text):
+            j = vocab.get(g)
+            if j is not None:
+                counts[j] = counts.get(j, 0) + 1
+        return counts
+
+    def text_margin(self, description: str) -> float:
+        """Contribuția textului la logit: sum(coef_t * tfidf_t) pe termenii prezenți."""
+        if not description:
+            return 0.0
+        memo = self.text_memo
+        key = memo_key(description) if memo is not None else None
+        if key is not None:
+            margin = memo.get(key)
+            if margin is not None:
+                return margin
+        margin = self._text_margin(description)
+        if key is not None:
+            memo.put(key, margin)
+        return margin
+
+    def _text_margin(self, description: str) -> float:
+        counts = self._term_counts(description)
+        if not counts:
+            return 0.0
+        idf, w_text = self.idf, self.w_text
+        if idf is None:
+            vals = [(float(count), float(w_text[j])) for j, count in counts.items()]
+        else:
+            vals = [(count * float(idf[j]), float(w_text[j])) for j, count in counts.items()]
+        norm = math.sqrt(sum(v * v for v, _ in vals))
+        return sum(_f32(v / norm) * w for v, w in vals)
+
+    def _amount(self, amount: float) -> float:
+        if self.amount_transform == "log1p":
+            return _f32(math.log1p(max(amount, 0.0)))
+        return _f32(amount)
+
+    def decision(self, row: Dict) -> float:
+        z = self.intercept
+        z += self._amount(float(row.get("amount", 0.0))) * self.w_amount
+        z += self.w_first if row.get("is_first_to_payee") else 0.0
+        z += self.w_channel.get(row.get("channel", "web"), self.w_channel[CHANNELS[0]])
+        z += self.text_margin(row.get("description") or "")
+        return z
+
+    def predict_proba(self, row: Dict) -> float:
+        z = self.decision(row)
+        # sigmoid stabil numeric (ca scipy.special.expit)
+        if z >= 0:
+            return 1.0 / (1.0 + math.exp(-z))
+        e = math.exp(z)
+        return e / (1.0 + e)
+
+    def predict_proba_many(self, rows: List[Dict]) -> List[float]:
+        """
+        Același calcul ca predict_proba, vectorizat pe batch: tokenizarea rămâne per rând,
+        dar idf/coef se citesc o singură dată (fancy indexing) și sumele pe rând se fac
+        cu np.bincount în loc de bucle Python.
+        """
+        n = len(rows)
+        if n == 0:
+            return []
+        f32 = np.float32
+        amount = amount_column(rows, self.amount_transform).astype(np.float64)
+        first = np.fromiter((bool(r.get("is_first_to_payee")) for r in rows), dtype=bool, count=n)
+        default_ch = self.w_channel[CHANNELS[0]]
+        z = np.fromiter((self.w_channel.get(r.get("channel", "web"), default_ch) for r in rows),
+                        dtype=np.float64, count=n)
+        z += self.intercept + amount * self.w_amount + np.where(first, self.w_first, 0.0)
+
+        margin = np.zeros(n, dtype=np.float64)
+        memo = self.text_memo
+        miss_rows: Dict[str, int] = {}   # descriere nouă -> primul rând care o calculează
+        dup_rows: List[Tuple[int, int]] = []  # (rând, rândul care a calculat-o) în același batch
+        row_ids: List[int] = []
+        cols: List[int] = []
+        counts: List[int] = []
+        for i, r in enumerate(rows):
+            desc = r.get("description") or ""
+            if not desc:
+                continue
+            key = memo_key(desc) if memo is not None else None
+            if key is not None:
+                if key in miss_rows:
+                    dup_rows.append((i, miss_rows[key]))
+                    continue
+                hit = memo.get(key)
+                if hit is not None:
+                    margin[i] = hit
+                    continue
+                miss_rows[key] = i
+            for j, c in self._term_counts(desc).items():
+                row_ids.append(i)
+                cols.append(j)
+                counts.append(c)
+        if cols:
+            rid = np.asarray(row_ids, dtype=np.intp)
+            col = np.asarray(cols, dtype=np.intp)
+            vals = np.asarray(counts, dtype=np.float64)
+            if self.idf is not None:
+                vals *= self.idf[col]
+            norm = np.sqrt(np.bincount(rid, weights=vals * vals, minlength=n))
+            tfidf = (vals / norm[rid]).astype(f32).astype(np.float64)
+            margin += np.bincount(rid, weights=tfidf * self.w_text[col], minlength=n)
+        for i, src in dup_rows:
+            margin[i] = margin[src]
+        for key, i in miss_rows.items():
+            memo.put(key, float(margin[i]))
+        return expit(z + margin).tolist()
+
+
+def probe_rows() -> List[Dict]:
+    """Rânduri deterministe (toate șabloanele × canale + cazuri-limită) pentru verificare."""
+    from app.ml.synthetic import SCAM_TYPES, LEGIT_TEMPLATES
+    descs = [d for tpl in SCAM_TYPES.values() for d in tpl] + list(LEGIT_TEMPLATES)
+    descs += ["", "URGENT urgent transfer transfer", "payee: Unknown Name 99", "x"]
+    rows: List[Dict] = []
+    for i, desc in enumerate(descs):
+        for j, ch in enumerate(CHANNELS + ["atm"]):
+            rows.append({
+                "amount": [50.0, 1234.56, 9000.0, 25000.0][(i + j) % 4],
+                "is_first_to_payee": (i + j) % 2 == 0,
+                "channel": ch,
+                "description": desc,
+            })
+    return rows
+
+
+def max_abs_diff(scorer: CompiledScorer, clf, vect, rows: List[Dict]) -> float:
+    """Diferența maximă față de sklearn pe `rows` (verificare la încărcare / benchmark)."""
+    from app.ml.features import prepare_xy
+    if not rows:
+        return 0.0
+    X, _, _ = prepare_xy(rows, [0] * len(rows), vectorizer=vect, amount_transform=scorer.amount_transform)
+    ref = clf.predict_proba(X)[:, 1]
+    return float(max(abs(scorer.predict_proba(r) - float(p)) for r, p in zip(rows, ref)))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Sursa de antrenare din Postgres: rândurile etichetate din `transactions`
+(label setat de /alerts/{id}/decision și /quiz/{id}), citite în ordinea
+(labeled_at, id) cu un cursor server-side și livrate în bucăți de `chunk_rows`.
+Memoria rămâne constantă indiferent de cât istoric există.
+"""
+from __future__ import annotations
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, literal, select, tuple_
+from sqlalchemy.engine import Engine
+
+from app.models import Transaction
+
+ML_DB_CHUNK_ROWS = int(os.getenv("ML_DB_CHUNK_ROWS", "20000"))
+# rândurile etichetate în ultimele secunde pot fi încă în tranzacții necomise; le lăsăm
+# pentru rularea următoare ca să nu rămână în urma watermark-ului
+ML_WATERMARK_LAG_SEC = float(os.getenv("ML_WATERMARK_LAG_SEC", "5"))
+
+Watermark = Tuple[datetime, int]  # (labeled_at, id) al ultimului rând consumat
+
+
+def watermark_to_json(wm: Optional[Watermark]) -> Optional[Dict]:
+    if wm is None:
+        return None
+    return {"labeled_at": wm[0].isoformat(), "id": int(wm[1])}
+
+
+def watermark_from_json(data: Optional[Dict]) -> Optional[Watermark]:
+    if not data:
+        return None
+    return datetime.fromisoformat(data["labeled_at"]), int(data["id"])
+
+
+def _labelled(after: Optional[Watermark], until: datetime):
+    cond = [Transaction.label.is_not(None), Transaction.labeled_at <= until]
+    if after is not None:
+        cond.append(tuple_(Transaction.labeled_at, Transaction.id) > tuple_(literal(after[0]), literal(after[1])))
+    return cond
+
+
+def snapshot_until() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=ML_WATERMARK_LAG_SEC)
+
+
+def count_labelled(engine: Engine, after: Optional[Watermark], until: datetime) -> int:
+    with engine.connect() as conn:
+        return int(conn.execute(select(func.count()).where(*_labelled(after, until))).scalar_one())
+
+
+def iter_chunks(engine: Engine, after: Optional[Watermark], until: datetime,
+                chunk_rows: int = ML_DB_CHUNK_ROWS) -> Iterator[Tuple[List[Dict], List[int], Watermark]]:
+    """(rows, labels, watermark) pe bucăți; rows au aceleași chei ca generate_samples."""
+    stmt = (
+        select(Transaction.id, Transaction.labeled_at, Transaction.amount_cents, Transaction.channel,
+               Transaction.is_first_to_payee, Transaction.description, Transaction.label)
+        .where(*_labelled(after, until))
+        .order_by(Transaction.labeled_at, Transaction.id)
+    )
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows).execute(stmt)
+        for part in result.partitions(chunk_rows):
+            rows = [{
+                "amount": r.amount_cents / 100.0,
+                "channel": r.channel,
+                "is_first_to_payee": bool(r.is_first_to_payee),
+                "description": r.description or "",
+            } for r in part]
+            labels = [int(r.label) for r in part]
+            yield rows, labels, (part[-1].labeled_at, part[-1].id)
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
+import os
 from typing import List, Dict, Tuple
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
 
 NUMERIC = ["amount", "is_first_to_payee"]
 CATEGORICAL = ["channel"]
@@ -10,40 +12,93 @@ TEXT = "description"
 
 CHANNELS = ["web", "mobile", "branch"]
 
-def prepare_xy(rows: List[Dict], labels: List[int], vectorizer: TfidfVectorizer | None = None
-              ) -> Tuple[np.ndarray, np.ndarray, TfidfVectorizer]:
-    """
-    Transformă listă de tranzacții în X (features) + y (labels).
-    - Numeric: amount, is_first_to_payee
-    - Categorical: channel (one-hot)
-    - Text: description (TF-IDF)
-    Returnează (X, y, vectorizer) unde X = [num | onehot | tfidf]
-    """
-    import numpy as np
+# "tfidf": vocabular + idf învățate la fit; "hashing": fără stare, coloană = hash(termen)
+FEATURE_MODES = ("tfidf", "hashing")
+HASH_FEATURES = int(os.getenv("ML_HASH_FEATURES", str(2 ** 18)))  # lățimea fixă a spațiului de hash
 
-    # numeric
-    num = np.array([[float(r.get("amount", 0.0)),
-                     1.0 if r.get("is_first_to_payee") else 0.0] for r in rows], dtype=np.float32)
+TextVectorizer = TfidfVectorizer | HashingVectorizer
 
-    # categorical one-hot (channel)
-    ch_idx = {c:i for i, c in enumerate(CHANNELS)}
-    onehot = np.zeros((len(rows), len(CHANNELS)), dtype=np.float32)
-    for i, r in enumerate(rows):
-        c = r.get("channel", "web")
-        j = ch_idx.get(c, 0)
-        onehot[i, j] = 1.0
+def make_vectorizer(mode: str = "tfidf", n_features: int = HASH_FEATURES) -> TextVectorizer:
+    if mode == "tfidf":
+        return TfidfVectorizer(min_df=2, max_df=0.9, ngram_range=(1,2))
+    if mode == "hashing":
+        # TF normalizat L2, fără idf; alternate_sign=False ca ponderile să rămână interpretabile
+        return HashingVectorizer(n_features=n_features, ngram_range=(1,2), alternate_sign=False, norm="l2")
+    raise ValueError(f"unknown feature mode {mode!r}, expected one of {FEATURE_MODES}")
+
+def feature_mode(vectorizer: TextVectorizer) -> str:
+    return "hashing" if isinstance(vectorizer, HashingVectorizer) else "tfidf"
+
+# transformarea lui amount: "raw" (LogisticRegression pe date sintetice) sau "log1p"
+# (learnerii SGD diverg pe sume brute de ordinul 1e4)
+AMOUNT_TRANSFORMS = ("raw", "log1p")
+
+def _transform_amount(amount: np.ndarray, amount_transform: str) -> np.ndarray:
+    amount = np.asarray(amount, dtype=np.float64)
+    if amount_transform == "log1p":
+        amount = np.log1p(np.maximum(amount, 0.0))
+    elif amount_transform != "raw":
+        raise ValueError(f"unknown amount transform {amount_transform!r}, expected one of {AMOUNT_TRANSFORMS}")
+    return amount.astype(np.float32)
+
+def amount_column(rows: List[Dict], amount_transform: str = "raw") -> np.ndarray:
+    amount = np.fromiter((float(r.get("amount", 0.0)) for r in rows), dtype=np.float64, count=len(rows))
+    return _transform_amount(amount, amount_transform)
+
+def _assemble(amount: np.ndarray, first: np.ndarray, ch_codes: np.ndarray, texts: List[str],
+              labels, vectorizer: TextVectorizer | None, mode: str
+              ) -> Tuple[sp.csr_matrix, np.ndarray, TextVectorizer]:
+    n = len(amount)
+    # numeric (2 coloane dense, dar stocate în CSR ca să putem face hstack rar)
+    num = np.empty((n, 2), dtype=np.float32)
+    num[:, 0] = amount
+    num[:, 1] = first
+
+    # categorical one-hot (channel): exact un 1 pe rând
+    onehot = sp.csr_matrix((np.ones(n, dtype=np.float32), ch_codes, np.arange(n + 1)), shape=(n, len(CHANNELS)))
 
     # text
-    texts = [(r.get("description") or "").lower() for r in rows]
     if vectorizer is None:
-        vectorizer = TfidfVectorizer(min_df=2, max_df=0.9, ngram_range=(1,2))
+        vectorizer = make_vectorizer(mode)
         tf = vectorizer.fit_transform(texts)
     else:
         tf = vectorizer.transform(texts)
 
-    # spars -> dens pentru concat simplu (date mici)
-    tf_dense = tf.toarray().astype(np.float32)
-
-    X = np.concatenate([num, onehot, tf_dense], axis=1)
-    y = np.array(labels, dtype=np.int32)
+    X = sp.hstack([sp.csr_matrix(num), onehot, tf.astype(np.float32)], format="csr", dtype=np.float32)
+    y = np.asarray(labels, dtype=np.int32)
     return X, y, vectorizer
+
+def prepare_xy(rows: List[Dict], labels: List[int], vectorizer: TextVectorizer | None = None,
+               mode: str = "tfidf", amount_transform: str = "raw") -> Tuple[sp.csr_matrix, np.ndarray, TextVectorizer]:
+    """
+    Transformă listă de tranzacții în X (features) + y (labels).
+    - Numeric: amount, is_first_to_payee
+    - Categorical: channel (one-hot)
+    - Text: description (TF-IDF sau hashing, vezi `mode`)
+    Returnează (X, y, vectorizer) unde X = [num | onehot | text], matrice CSR float32.
+    Totul rămâne rar: memoria crește cu nr. de termeni prezenți, nu cu rows × vocabular.
+    Un vectorizer dat are prioritate față de `mode`. În modul hashing nu există fit,
+    deci bucăți diferite de date se pot vectoriza independent (și în paralel).
+    """
+    n = len(rows)
+    first = np.fromiter((1.0 if r.get("is_first_to_payee") else 0.0 for r in rows), dtype=np.float32, count=n)
+    ch_idx = {c:i for i, c in enumerate(CHANNELS)}
+    ch_codes = np.fromiter((ch_idx.get(r.get("channel", "web"), 0) for r in rows), dtype=np.int32, count=n)
+    texts = [(r.get("description") or "").lower() for r in rows]
+    return _assemble(amount_column(rows, amount_transform), first, ch_codes, texts, labels, vectorizer, mode)
+
+def prepare_xy_columns(cols: Dict[str, np.ndarray], vectorizer: TextVectorizer | None = None,
+                       mode: str = "tfidf", amount_transform: str = "raw"
+                       ) -> Tuple[sp.csr_matrix, np.ndarray, TextVectorizer]:
+    """
+    Ca prepare_xy, dar pe date columnare (synthetic.generate_columns / shard-uri):
+    un array per câmp + "label", fără dict-uri per rând.
+    """
+    channel = np.asarray(cols["channel"])
+    ch_codes = np.zeros(len(channel), dtype=np.int32)  # canal necunoscut -> ca "web"
+    for i, c in enumerate(CHANNELS):
+        ch_codes[channel == c] = i
+    texts = np.char.lower(np.asarray(cols["description"], dtype=str)).tolist()
+    return _assemble(_transform_amount(cols["amount"], amount_transform),
+                     np.asarray(cols["is_first_to_payee"], dtype=np.float32),
+                     ch_codes, texts, cols["label"], vectorizer, mode)
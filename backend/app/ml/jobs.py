@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Joburi de antrenare în afara procesului de API.
+
+POST /ml/train pune jobul într-un ProcessPoolExecutor (context "spawn", proces cu
+prioritate redusă) și întoarce imediat id-ul. Copilul face generarea, feature-urile,
+fit-ul și evaluarea, apoi scrie artefactele; workerul API doar reîncarcă modelul
+(try_load construiește starea completă și o publică dintr-o singură atribuire).
+
+Starea jobului stă într-un JSON mic în ML_ART_DIR/jobs/<id>.json, scris atomic
+(tmp + rename) atât de copil (progres) cât și de părinte (rezultat final), deci
+/ml/jobs/{id} răspunde la fel indiferent de workerul uvicorn care primește cererea.
+"""
+from __future__ import annotations
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from app.ml import model
+
+log = logging.getLogger(__name__)
+
+ML_TRAIN_WORKERS = int(os.getenv("ML_TRAIN_WORKERS", "1"))
+ML_TRAIN_NICE = int(os.getenv("ML_TRAIN_NICE", "10"))  # CPU-ul rămâne întâi pentru scoring
+JOBS_DIR = os.path.join(model.ART_DIR, "jobs")
+JOBS_KEEP = int(os.getenv("ML_JOBS_KEEP", "50"))       # câte fișiere de job păstrăm
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _now() -> float:
+    return round(time.time(), 3)
+
+
+def _path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def _write(job: Dict) -> None:
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    path = _path(job["id"])
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp, path)
+
+
+def get(job_id: str) -> Optional[Dict]:
+    if not job_id.isalnum():  # id-urile sunt uuid4().hex; nu lăsăm căi arbitrare
+        return None
+    try:
+        with open(_path(job_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def list_jobs(limit: int = 20) -> List[Dict]:
+    try:
+        names = [n for n in os.listdir(JOBS_DIR) if n.endswith(".json")]
+    except FileNotFoundError:
+        return []
+    jobs = [j for j in (get(n[:-len(".json")]) for n in names) if j is not None]
+    jobs.sort(key=lambda j: j.get("submitted_at", 0), reverse=True)
+    return jobs[:limit]
+
+
+def _prune() -> None:
+    for job in list_jobs(limit=10**9)[JOBS_KEEP:]:
+        if job.get("status") in {"succeeded", "failed"}:
+            try:
+                os.remove(_path(job["id"]))
+            except FileNotFoundError:
+                pass
+
+
+# ---- proces copil ----
+def _lower_priority() -> None:
+    try:
+        os.nice(ML_TRAIN_NICE)
+    except (AttributeError, OSError):
+        pass
+
+
+def _run(job_id: str, params: Dict) -> Dict:
+    job = get(job_id) or {"id": job_id, "params": params}
+    job.update(status="running", started_at=_now(), pid=os.getpid())
+    _write(job)
+
+    def progress(stage: str, fraction: float) -> None:
+        job["progress"] = {"stage": stage, "fraction": fraction}
+        _write(job)
+
+    params = dict(params)
+    if params.pop("source", "synthetic") == "transactions":
+        return model.train_from_db(progress=progress, **params)
+    return model.train_and_save(progress=progress, **params)
+
+
+# ---- proces API ----
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, ML_TRAIN_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),  # fără fork dintr-un proces cu event loop/thread-uri
+                initializer=_lower_priority,
+            )
+        return _pool
+
+
+def _reset_broken() -> None:
+    # un copil omorât (OOM etc.) strică tot pool-ul; următorul submit pornește unul nou
+    global _pool
+    with _pool_lock:
+        if _pool is not None and getattr(_pool, "_broken", False):
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _finish(job_id: str, fut: Future) -> None:
+    """Rulează în thread-ul pool-ului din procesul API, nu în event loop."""
+    job = get(job_id) or {"id": job_id}
+    try:
+        meta = fut.result()
+        job["metrics"] = meta
+        # modelul nou devine activ doar acum, după ce artefactele sunt complete pe disc
+        job["swapped"] = model.try_load()
+        job["status"] = "succeeded"
+        job["progress"] = {"stage": "done", "fraction": 1.0}
+    except BaseException as e:  # include BrokenProcessPool / CancelledError
+        log.exception("training job %s failed", job_id)
+        if isinstance(e, BrokenProcessPool):
+            _reset_broken()
+        job["status"] = "failed"
+        job["error"] = f"{type(e).__name__}: {e}"
+    job["finished_at"] = _now()
+    if job.get("started_at"):
+        job["duration_sec"] = round(job["finished_at"] - job["started_at"], 3)
+    job["total_sec"] = round(job["finished_at"] - job.get("submitted_at", job["finished_at"]), 3)
+    _write(job)
+    _prune()
+
+
+def submit(source: str = "synthetic", **params) -> Dict:
+    """source="synthetic" -> train_and_save(**params); "transactions" -> train_from_db(**params)."""
+    params = {"source": source, **params}
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "queued",
+        "params": params,
+        "submitted_at": _now(),
+        "progress": {"stage": "queued", "fraction": 0.0},
+    }
+    _write(job)
+    fut = _executor().submit(_run, job["id"], params)
+    fut.add_done_callback(lambda f, job_id=job["id"]: _finish(job_id, f))
+    return job
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
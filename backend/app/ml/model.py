@@ -1,86 +1,456 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import os, json
+import os, json, time, shutil, threading, logging, uuid
 from dataclasses import dataclass
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Tuple
 import joblib
 import numpy as np
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.metrics import roc_auc_score, accuracy_score
 from sklearn.model_selection import train_test_split
 from sklearn.utils import shuffle
 
-from app.ml.synthetic import generate_samples
-from app.ml.features import prepare_xy
+from app.ml.synthetic import dataset_rows, generate_chunks, generate_columns, iter_chunks, load_columns
+from app.ml.features import FEATURE_MODES, make_vectorizer, prepare_xy, prepare_xy_columns, feature_mode as vect_mode
+from app.ml.compiled import CompiledScorer, max_abs_diff, probe_rows
+
+log = logging.getLogger(__name__)
 
 ART_DIR = os.getenv("ML_ART_DIR", "/app/app/ml/artifacts")
+# artefacte vechi (un singur model, pickle) - încă încărcabile dacă nu există CURRENT
 MODEL_PATH = os.path.join(ART_DIR, "model.pkl")
 VECT_PATH  = os.path.join(ART_DIR, "vectorizer.pkl")
 META_PATH  = os.path.join(ART_DIR, "meta.json")
+# versiuni: ART_DIR/versions/<v>/{coef.npy, idf.npy, vocab.json, scorer.json, meta.json, *.pkl}
+VERSIONS_DIR = os.path.join(ART_DIR, "versions")
+CURRENT_PATH = os.path.join(ART_DIR, "CURRENT")  # numele versiunii active, înlocuit cu os.replace
+# seturi sintetice pre-generate (python -m app.ml.synthetic --out ...), refolosite la antrenare
+DATASETS_DIR = os.getenv("ML_DATASETS_DIR", os.path.join(ART_DIR, "datasets"))
+
+# cât de des verifică fiecare worker dacă CURRENT s-a schimbat (un os.stat)
+ML_RELOAD_CHECK_SEC = float(os.getenv("ML_RELOAD_CHECK_SEC", "1.0"))
+ML_KEEP_VERSIONS = int(os.getenv("ML_KEEP_VERSIONS", "5"))
+
+# antrenare incrementală din `transactions` (SGD, partial_fit pe bucăți)
+ML_SGD_ALPHA = float(os.getenv("ML_SGD_ALPHA", "1e-5"))
+ML_EVAL_MAX_ROWS = int(os.getenv("ML_EVAL_MAX_ROWS", "1000000"))  # plafon pentru evaluarea prequential
+# train_and_save: până la ML_TRAIN_FULL_MAX_ROWS rânduri LogisticRegression pe toată matricea
+# (200k măsurat: ~4 s, ~360 MB RSS); peste, SGD cu hashing pe bucăți de ML_TRAIN_CHUNK_ROWS,
+# cu memoria mărginită de o bucată (1M: ~15 s, ~340 MB RSS)
+ML_TRAIN_FULL_MAX_ROWS = int(os.getenv("ML_TRAIN_FULL_MAX_ROWS", "200000"))
+ML_TRAIN_CHUNK_ROWS = int(os.getenv("ML_TRAIN_CHUNK_ROWS", "100000"))
 
 os.makedirs(ART_DIR, exist_ok=True)
 
+# toleranța acceptată între scorerul compilat și sklearn (verificată la încărcare)
+COMPILED_TOL = 1e-6
+
 @dataclass
 class MLState:
     clf: LogisticRegression | None = None
     vect: any = None
     meta: Dict = None
+    scorer: CompiledScorer | None = None  # calea rapidă (ponderi mmap pentru versiunile noi)
+    version: str | None = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.scorer is not None or (self.clf is not None and self.vect is not None)
 
 ml_state = MLState(clf=None, vect=None, meta={})
 
-def train_and_save(n: int = 3000, scam_ratio: float = 0.5, seed: int = 42) -> Dict:
-    rows, labels, tags = generate_samples(n=n, scam_ratio=scam_ratio, seed=seed)
-    X, y, vect = prepare_xy(rows, labels, vectorizer=None)
+def _swap(state: MLState) -> None:
+    """Înlocuiește modelul curent dintr-o singură atribuire (cererile în curs păstrează vechiul obiect)."""
+    global ml_state
+    ml_state = state
+
+def _compile(clf, vect, amount_transform: str = "raw") -> CompiledScorer | None:
+    """
+    Exportă modelul în CompiledScorer și îl verifică pe rândurile de probă;
+    dacă nu se potrivește cu sklearn (ex. alt tip de vectorizer), rămânem pe sklearn.
+    """
+    try:
+        scorer = CompiledScorer.from_sklearn(clf, vect, amount_transform=amount_transform)
+        if max_abs_diff(scorer, clf, vect, probe_rows()) <= COMPILED_TOL:
+            return scorer
+    except Exception:
+        pass
+    return None
+
+# ---- versiuni ----
+def _version_dir(version: str) -> str:
+    return os.path.join(VERSIONS_DIR, version)
+
+def current_version() -> str | None:
+    try:
+        with open(CURRENT_PATH) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _publish(tmp_dir: str, version: str) -> None:
+    """Directorul complet e redenumit în versions/<v>, apoi CURRENT trece pe el (ambele atomice)."""
+    os.rename(tmp_dir, _version_dir(version))
+    tmp = f"{CURRENT_PATH}.tmp.{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write(version)
+    os.replace(tmp, CURRENT_PATH)
+    _prune_versions(keep=version)
+
+def _prune_versions(keep: str) -> None:
+    names = sorted(n for n in os.listdir(VERSIONS_DIR) if not n.startswith("."))
+    for name in names[:-ML_KEEP_VERSIONS] if ML_KEEP_VERSIONS > 0 else []:
+        if name != keep:
+            # workerii care au încă vechea versiune mapată o păstrează până la următorul swap
+            shutil.rmtree(_version_dir(name), ignore_errors=True)
 
+def _load_version(version: str) -> MLState:
+    vdir = _version_dir(version)
+    with open(os.path.join(vdir, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("compiled"):
+        return MLState(meta=meta, scorer=CompiledScorer.load(vdir, mmap=True), version=version)
+    # modelul nu a putut fi compilat la antrenare -> sklearn din pickle
+    clf = joblib.load(os.path.join(vdir, "model.pkl"))
+    vect = joblib.load(os.path.join(vdir, "vectorizer.pkl"))
+    return MLState(clf=clf, vect=vect, meta=meta, version=version)
+
+def load_sklearn() -> Tuple[LogisticRegression, any]:
+    """(clf, vectorizer) sklearn pentru versiunea curentă (benchmark / analiză offline)."""
+    version = current_version()
+    base = _version_dir(version) if version else ART_DIR
+    return joblib.load(os.path.join(base, "model.pkl")), joblib.load(os.path.join(base, "vectorizer.pkl"))
+
+def _save_version(clf, vect, meta: Dict, amount_transform: str = "raw") -> Dict:
+    """
+    Scrie o versiune completă într-un director temporar, o publică (CURRENT) și trece
+    procesul curent pe ea, pe aceeași cale ca ceilalți workeri. Completează `meta`.
+    """
+    version = time.strftime("%Y%m%dT%H%M%S", time.gmtime()) + "-" + uuid.uuid4().hex[:6]
+    scorer = _compile(clf, vect, amount_transform)
+    meta.update(feature_mode=vect_mode(vect), amount_transform=amount_transform,
+                version=version, compiled=scorer is not None)
+    if meta["feature_mode"] == "hashing":
+        meta["n_features"] = vect.n_features
+    os.makedirs(VERSIONS_DIR, exist_ok=True)
+    tmp_dir = os.path.join(VERSIONS_DIR, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+    if scorer is not None:
+        scorer.save(tmp_dir)
+    joblib.dump(clf, os.path.join(tmp_dir, "model.pkl"))
+    joblib.dump(vect, os.path.join(tmp_dir, "vectorizer.pkl"))
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    _publish(tmp_dir, version)
+    try_load()
+    return meta
+
+ProgressFn = Callable[[str, float], None]
+
+def train_and_save(n: int = 3000, scam_ratio: float = 0.5, seed: int = 42,
+                   progress: ProgressFn | None = None, feature_mode: str = "tfidf",
+                   dataset: str | None = None) -> Dict:
+    """
+    Antrenează, evaluează și salvează modelul. `progress(stage, fraction)` e apelat
+    între etape (folosit de joburile din app.ml.jobs pentru /ml/jobs/{id}).
+    `feature_mode` ("tfidf" | "hashing") alege vectorizarea textului; e salvat în meta.
+    `dataset` = numele unui set din DATASETS_DIR (sau cale); atunci n/scam_ratio vin din set.
+    Peste ML_TRAIN_FULL_MAX_ROWS rânduri (sau pentru un set fără manifest) antrenarea trece
+    pe bucăți (_train_chunked: SGD + hashing, indiferent de `feature_mode`).
+    """
+    if feature_mode not in FEATURE_MODES:
+        raise ValueError(f"unknown feature mode {feature_mode!r}, expected one of {FEATURE_MODES}")
+    path = os.path.join(DATASETS_DIR, dataset) if dataset else None
+    rows = dataset_rows(path) if path else n
+    if rows is None or rows > ML_TRAIN_FULL_MAX_ROWS:
+        return _train_chunked(n, scam_ratio, seed, progress, dataset)
+    report = progress or (lambda stage, fraction: None)
+    timings: Dict[str, float] = {}
+    t = time.perf_counter()
+
+    def lap(stage: str) -> None:
+        nonlocal t
+        now = time.perf_counter()
+        timings[stage] = round(now - t, 3)
+        t = now
+
+    report("generate", 0.0)
+    if dataset:
+        cols = load_columns(path)
+        n = len(cols["label"])
+        scam_ratio = round(float(cols["label"].mean()), 4)
+    else:
+        cols = generate_columns(n=n, scam_ratio=scam_ratio, seed=seed)
+    lap("generate")
+
+    report("features", 0.15)
+    X, y, vect = prepare_xy_columns(cols, vectorizer=None, mode=feature_mode)
+    del cols
     X, y = shuffle(X, y, random_state=seed)
     Xtr, Xte, ytr, yte = train_test_split(X, y, test_size=0.2, random_state=seed, stratify=y)
+    lap("features")
 
+    report("fit", 0.35)
     clf = LogisticRegression(max_iter=200, n_jobs=1)
     clf.fit(Xtr, ytr)
+    lap("fit")
 
+    report("evaluate", 0.8)
     proba = clf.predict_proba(Xte)[:,1]
     auc = float(roc_auc_score(yte, proba))
     acc = float(accuracy_score(yte, (proba>=0.5).astype(int)))
+    lap("evaluate")
 
-    # persist
-    joblib.dump(clf, MODEL_PATH)
-    joblib.dump(vect, VECT_PATH)
+    report("save", 0.9)
     meta = {"n": n, "scam_ratio": scam_ratio, "seed": seed, "auc": auc, "acc": acc}
-    with open(META_PATH, "w") as f:
-        json.dump(meta, f)
+    if dataset:
+        meta["dataset"] = dataset
+    _save_version(clf, vect, meta)
+    lap("save")
+    meta["timings_sec"] = timings
+    report("done", 1.0)
+    return meta
+
+def _prequential_metrics(eval_p: List[np.ndarray], eval_y: List[np.ndarray]) -> Tuple[float | None, float | None]:
+    """(auc, acc) pe scorurile strânse înainte de partial_fit (None fără date / o singură clasă)."""
+    if not eval_p:
+        return None, None
+    p, y = np.concatenate(eval_p), np.concatenate(eval_y)
+    acc = float(accuracy_score(y, (p >= 0.5).astype(int)))
+    auc = float(roc_auc_score(y, p)) if len(np.unique(y)) == 2 else None
+    return auc, acc
+
+def _train_chunked(n: int, scam_ratio: float, seed: int, progress: ProgressFn | None,
+                   dataset: str | None) -> Dict:
+    """
+    train_and_save pentru seturi mari: bucăți de ML_TRAIN_CHUNK_ROWS (din shard-uri sau
+    generate_chunks) -> prepare_xy_columns (hashing, log1p) -> SGDClassifier.partial_fit.
+    Ca în train_from_db, metricile sunt prequential (bucata e scorată înainte de fit).
+    """
+    report = progress or (lambda stage, fraction: None)
+    t0 = time.perf_counter()
+    report("generate", 0.0)
+    if dataset:
+        chunks = iter_chunks(os.path.join(DATASETS_DIR, dataset), ML_TRAIN_CHUNK_ROWS)
+        total = dataset_rows(os.path.join(DATASETS_DIR, dataset))
+    else:
+        chunks = generate_chunks(n, ML_TRAIN_CHUNK_ROWS, scam_ratio=scam_ratio, seed=seed)
+        total = n
 
-    # cache in memorie
-    ml_state.clf = clf
-    ml_state.vect = vect
-    ml_state.meta = meta
+    clf = SGDClassifier(loss="log_loss", alpha=ML_SGD_ALPHA, random_state=seed)
+    vect = make_vectorizer("hashing")
+    classes = np.array([0, 1])
+    rows_seen, n_chunks, n_scam, n_eval = 0, 0, 0, 0
+    eval_p: List[np.ndarray] = []
+    eval_y: List[np.ndarray] = []
+    for cols in chunks:
+        X, y, _ = prepare_xy_columns(cols, vectorizer=vect, amount_transform="log1p")
+        if hasattr(clf, "coef_") and n_eval < ML_EVAL_MAX_ROWS:
+            eval_p.append(clf.predict_proba(X)[:, 1].astype(np.float32))
+            eval_y.append(y.astype(np.int8))
+            n_eval += len(y)
+        clf.partial_fit(X, y, classes=classes)
+        n_chunks += 1
+        rows_seen += len(y)
+        n_scam += int(y.sum())
+        if total:
+            report("fit", round(0.05 + 0.85 * rows_seen / total, 3))
+    auc, acc = _prequential_metrics(eval_p, eval_y)
+
+    report("save", 0.9)
+    meta = {"n": rows_seen, "scam_ratio": round(n_scam / max(1, rows_seen), 4), "seed": seed,
+            "learner": "sgd", "chunks": n_chunks, "chunk_rows": ML_TRAIN_CHUNK_ROWS,
+            "auc": auc, "acc": acc, "eval_rows": n_eval}
+    if dataset:
+        meta["dataset"] = dataset
+    _save_version(clf, vect, meta, amount_transform="log1p")
+    meta["timings_sec"] = {"total": round(time.perf_counter() - t0, 3)}
+    report("done", 1.0)
     return meta
 
-def try_load() -> bool:
+def _current_meta() -> Dict:
+    version = current_version()
+    if not version:
+        return {}
+    with open(os.path.join(_version_dir(version), "meta.json")) as f:
+        return json.load(f)
+
+def train_from_db(progress: ProgressFn | None = None, continue_current: bool = False,
+                  chunk_rows: int | None = None, epochs: int = 1, seed: int = 42, engine=None) -> Dict:
+    """
+    Antrenare out-of-core din rândurile etichetate din `transactions`: fiecare bucată
+    citită cu cursorul server-side trece prin prepare_xy (hashing, fără fit) și apoi
+    prin SGDClassifier.partial_fit, deci memoria nu crește cu istoricul.
+
+    continue_current=True pornește de la modelul curent (trebuie să fie tot din
+    `transactions`) și consumă doar rândurile de după watermark-ul lui.
+    Metricile sunt prequential: fiecare bucată e scorată înainte de a fi învățată.
+    """
+    from app.ml import db_source
+    if engine is None:
+        from app.deps import engine
+    report = progress or (lambda stage, fraction: None)
+    chunk_rows = chunk_rows or db_source.ML_DB_CHUNK_ROWS
+    t0 = time.perf_counter()
+
+    report("prepare", 0.0)
+    after, base = None, {}
+    if continue_current:
+        base = _current_meta()
+        if base.get("source") != "transactions":
+            raise ValueError("current model was not trained from transactions; run a full training first")
+        clf, vect = load_sklearn()
+        after = db_source.watermark_from_json(base.get("watermark"))
+    else:
+        clf = SGDClassifier(loss="log_loss", alpha=ML_SGD_ALPHA, random_state=seed)
+        vect = make_vectorizer("hashing")
+
+    until = db_source.snapshot_until()
+    total = db_source.count_labelled(engine, after, until)
+    if total == 0:
+        if not continue_current:
+            raise ValueError("no labelled transactions to train on")
+        report("done", 1.0)
+        return {"source": "transactions", "rows": 0, "skipped": True, "version": base.get("version"),
+                "watermark": base.get("watermark")}
+
+    classes = np.array([0, 1])
+    rows_seen, chunks, wm = 0, 0, after
+    eval_p: List[np.ndarray] = []
+    eval_y: List[np.ndarray] = []
+    n_eval = 0
+    for epoch in range(epochs):
+        for rows, labels, chunk_wm in db_source.iter_chunks(engine, after, until, chunk_rows):
+            X, y, _ = prepare_xy(rows, labels, vectorizer=vect, amount_transform="log1p")
+            if epoch == 0 and hasattr(clf, "coef_") and n_eval < ML_EVAL_MAX_ROWS:
+                eval_p.append(clf.predict_proba(X)[:, 1].astype(np.float32))
+                eval_y.append(y.astype(np.int8))
+                n_eval += len(y)
+            clf.partial_fit(X, y, classes=classes)
+            chunks += 1
+            rows_seen += len(y)
+            wm = chunk_wm
+            report("fit", round(0.05 + 0.85 * rows_seen / (total * epochs), 3))
+
+    auc, acc = _prequential_metrics(eval_p, eval_y)
+
+    report("save", 0.9)
+    meta = {
+        "source": "transactions", "learner": "sgd", "seed": seed, "epochs": epochs,
+        "rows": total, "chunks": chunks, "chunk_rows": chunk_rows,
+        "total_rows": int(base.get("total_rows", 0)) + total,
+        "auc": auc, "acc": acc, "eval_rows": n_eval,
+        "watermark": db_source.watermark_to_json(wm),
+        "continued_from": base.get("version"),
+    }
+    _save_version(clf, vect, meta, amount_transform="log1p")
+    meta["timings_sec"] = {"total": round(time.perf_counter() - t0, 3)}
+    report("done", 1.0)
+    return meta
+
+_seen_current = None  # (st_ino, st_mtime_ns) al fișierului CURRENT deja încărcat
+_last_check = 0.0
+_reload_lock = threading.Lock()
+
+def _current_stat():
+    try:
+        st = os.stat(CURRENT_PATH)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)  # os.replace -> inode nou la fiecare publicare
+
+def _load_legacy() -> MLState | None:
     if not (os.path.exists(MODEL_PATH) and os.path.exists(VECT_PATH)):
-        return False
+        return None
+    clf = joblib.load(MODEL_PATH)
+    vect = joblib.load(VECT_PATH)
+    meta = {}
+    if os.path.exists(META_PATH):
+        with open(META_PATH) as f:
+            meta = json.load(f)
+    meta.setdefault("feature_mode", vect_mode(vect))
+    return MLState(clf=clf, vect=vect, meta=meta, scorer=_compile(clf, vect), version="legacy")
+
+def _load() -> bool:
+    global _seen_current
     try:
-        ml_state.clf = joblib.load(MODEL_PATH)
-        ml_state.vect = joblib.load(VECT_PATH)
-        if os.path.exists(META_PATH):
-            import json
-            with open(META_PATH) as f:
-                ml_state.meta = json.load(f)
-        else:
-            ml_state.meta = {}
+        seen = _current_stat()
+        version = current_version()
+        state = _load_version(version) if version else _load_legacy()
+        if state is None:
+            return False
+        # construim starea completă (inclusiv scorerul) și abia apoi o publicăm
+        _swap(state)
+        _seen_current = seen
         return True
     except Exception:
+        log.exception("ML model load failed")
         return False
 
+def try_load() -> bool:
+    """Încarcă versiunea din CURRENT (sau pickle-urile vechi dacă nu există versiuni)."""
+    with _reload_lock:
+        return _load()
+
+def maybe_reload() -> None:
+    """
+    Verificare ieftină pe calea de scoring: cel mult un os.stat la ML_RELOAD_CHECK_SEC.
+    Dacă alt proces a publicat o versiune nouă, un singur thread o încarcă; celelalte
+    cereri (și toate, dacă încărcarea eșuează) continuă pe modelul vechi.
+    """
+    global _last_check, _seen_current
+    now = time.monotonic()
+    if now - _last_check < ML_RELOAD_CHECK_SEC:
+        return
+    _last_check = now
+    seen = _current_stat()
+    if seen is None or seen == _seen_current:
+        return
+    if not _reload_lock.acquire(blocking=False):
+        return
+    try:
+        if current_version() == ml_state.version:
+            _seen_current = seen
+        else:
+            _load()
+    finally:
+        _reload_lock.release()
+
 def predict_proba_one(row: Dict) -> float | None:
-    if ml_state.clf is None or ml_state.vect is None:
+    maybe_reload()
+    st = ml_state  # o singură citire: un swap concurent nu amestecă clf/vect din modele diferite
+    if not st.loaded:
         return None
-    X, _, _ = prepare_xy([row], [0], vectorizer=ml_state.vect)
-    proba = float(ml_state.clf.predict_proba(X)[:,1][0])
+    if st.scorer is not None:
+        return st.scorer.predict_proba(row)
+    X, _, _ = prepare_xy([row], [0], vectorizer=st.vect, amount_transform=st.meta.get("amount_transform", "raw"))
+    proba = float(st.clf.predict_proba(X)[:,1][0])
     return proba
 
+def predict_proba_many(rows: List[Dict]) -> List[float] | None:
+    """Tot batch-ul pe același model: scorerul compilat sau un singur transform + predict_proba sklearn."""
+    maybe_reload()
+    st = ml_state
+    if not st.loaded:
+        return None
+    if not rows:
+        return []
+    if st.scorer is not None:
+        return st.scorer.predict_proba_many(rows)
+    X, _, _ = prepare_xy(rows, [0] * len(rows), vectorizer=st.vect,
+                         amount_transform=st.meta.get("amount_transform", "raw"))
+    return [float(p) for p in st.clf.predict_proba(X)[:, 1]]
+
 def status() -> Dict:
-    loaded = ml_state.clf is not None
+    maybe_reload()
+    st = ml_state
+    loaded = st.loaded
     info = {"loaded": loaded}
     if loaded:
-        info["meta"] = ml_state.meta or {}
+        info["meta"] = st.meta or {}
+        info["compiled"] = st.scorer is not None
+        info["version"] = st.version
+        info["current"] = current_version()
+        # cache-ul descriere -> contribuția textului; unul per scorer, deci per versiune de model
+        info["text_memo"] = st.scorer.text_memo.stats() if st.scorer is not None and st.scorer.text_memo else None
     return info
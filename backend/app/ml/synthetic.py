@@ -1,7 +1,28 @@
 # -*- coding: utf-8 -*-
+"""
+Date sintetice pentru antrenare / benchmark-uri.
+
+generate_columns() produce direct date columnare (un array NumPy per câmp + label
++ tag), vectorizat, reproductibil pentru același seed (și același `now`).
+generate_samples() păstrează forma veche (listă de payload-uri PaymentIn).
+
+Seturi mari se pot scrie o dată pe disc în shard-uri NPZ (sau Parquet, cu pyarrow)
+și refolosite la antrenare / benchmark:
+
+    python -m app.ml.synthetic --rows 5000000 --out /data/ml/datasets/synth5m
+
+Consumatorii mari citesc pe bucăți (iter_chunks / generate_chunks), deci memoria e
+mărginită de o bucată, nu de tot setul.
+"""
 from __future__ import annotations
-import random, datetime as dt
-from typing import List, Dict, Tuple
+import argparse
+import datetime as dt
+import glob
+import json
+import os
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
 
 CHANNELS = ["web", "mobile", "branch"]
 
@@ -42,16 +63,72 @@ SCAM_TYPES = {
     "impersonation": IMPERSONATION_TEMPLATES,
 }
 
-def _rand_iban(prefix="RO", bank="BANK", acc_len=16) -> str:
-    return f"{prefix}12{bank}{random.randint(10**(acc_len-1), 10**acc_len-1)}"
+SCAM_AMOUNTS = [3500, 5200, 9000, 15000, 25000]
+LEGIT_AMOUNTS = [50, 100, 250, 800, 1200, 3000]
+CHANNEL_WEIGHTS = [0.45, 0.45, 0.10]
+LEGIT_FIRST_TO_PAYEE = 0.2
+TS_SPREAD_MIN = 60 * 24  # ultimele 24h, la minut
+
+# câmpurile din generate_columns / shard-uri, în ordinea din payload
+FIELDS = ["ts", "src_account_iban", "dst_account_iban", "amount", "currency", "channel",
+          "is_first_to_payee", "description", "label", "tag"]
+
+def _ibans(rng: np.random.Generator, n: int, bank: str) -> np.ndarray:
+    # același format ca înainte: RO12 + bancă + 16 cifre
+    return np.char.add(f"RO12{bank}", rng.integers(10**15, 10**16, size=n).astype("U16"))
+
+def generate_columns(n: int = 2000, scam_ratio: float = 0.5, seed: int | None = 42,
+                     now: dt.datetime | None = None) -> Dict[str, np.ndarray]:
+    """
+    Aceleași scenarii ca generate_samples, dar columnar: {câmp: np.ndarray} cu
+    label (1=scam, 0=legit) și tag ("investment", "romance", ... sau "legit").
+    `now` fixează și timestamp-urile (altfel sunt relative la momentul apelului).
+    """
+    rng = np.random.default_rng(seed)
+    num_scam = int(n * scam_ratio)
+    num_leg = n - num_scam
+
+    # Scam: tip uniform, apoi șablon uniform în cadrul tipului
+    scam_types = list(SCAM_TYPES.keys())
+    lens = np.array([len(SCAM_TYPES[t]) for t in scam_types])
+    offsets = np.concatenate([[0], np.cumsum(lens)[:-1]])
+    pool = np.array([d for t in scam_types for d in SCAM_TYPES[t]])
+    t_idx = rng.integers(0, len(scam_types), size=num_scam)
+    scam_desc = pool[offsets[t_idx] + rng.integers(0, lens[t_idx])]
+    scam_amount = rng.choice(SCAM_AMOUNTS, size=num_scam)
+
+    # Legit
+    legit_desc = np.array(LEGIT_TEMPLATES)[rng.integers(0, len(LEGIT_TEMPLATES), size=num_leg)]
+    legit_amount = rng.choice(LEGIT_AMOUNTS, size=num_leg)
+    legit_first = rng.random(num_leg) < LEGIT_FIRST_TO_PAYEE
 
-def _rand_ts() -> str:
-    now = dt.datetime.utcnow()
-    skew = dt.timedelta(minutes=random.randint(-60*24, 0))
-    return (now + skew).replace(microsecond=0).isoformat() + "Z"
+    if now is None:
+        now = dt.datetime.utcnow()
+    now64 = np.datetime64(now.replace(microsecond=0, tzinfo=None), "s")
+    cols = {
+        "ts": now64 - rng.integers(0, TS_SPREAD_MIN + 1, size=n).astype("timedelta64[m]"),
+        "src_account_iban": _ibans(rng, n, "SRC"),
+        "dst_account_iban": _ibans(rng, n, "DST"),
+        "amount": np.concatenate([scam_amount, legit_amount]).astype(np.float64),
+        "currency": np.full(n, "RON"),
+        "channel": np.array(CHANNELS)[rng.choice(len(CHANNELS), size=n, p=CHANNEL_WEIGHTS)],
+        "is_first_to_payee": np.concatenate([np.ones(num_scam, dtype=bool), legit_first]),
+        "description": np.concatenate([scam_desc, legit_desc]),
+        "label": np.concatenate([np.ones(num_scam, dtype=np.int8), np.zeros(num_leg, dtype=np.int8)]),
+        "tag": np.concatenate([np.array(scam_types)[t_idx], np.full(num_leg, "legit")]),
+    }
+    # mic shuffle
+    perm = rng.permutation(n)
+    return {k: v[perm] for k, v in cols.items()}
 
-def _pick_channel() -> str:
-    return random.choices(CHANNELS, weights=[0.45, 0.45, 0.10])[0]
+def rows_from_columns(cols: Dict[str, np.ndarray], limit: int | None = None) -> List[Dict]:
+    """Payload-uri PaymentIn (dict) din date columnare; ts ca ISO + "Z", ca înainte."""
+    sl = slice(0, limit)
+    ts = np.char.add(np.datetime_as_string(cols["ts"][sl], unit="s"), "Z").tolist()
+    keys = ["src_account_iban", "dst_account_iban", "amount", "currency", "channel",
+            "is_first_to_payee", "description"]
+    values = [cols[k][sl].tolist() for k in keys]
+    return [dict(zip(["ts"] + keys, vals)) for vals in zip(ts, *values)]
 
 def generate_samples(n: int = 2000, scam_ratio: float = 0.5, seed: int | None = 42
                    ) -> Tuple[List[Dict], List[int], List[str]]:
@@ -61,58 +138,140 @@ def generate_samples(n: int = 2000, scam_ratio: float = 0.5, seed: int | None =
       labels: 1=scam, 0=legit
       tags: eticheta de scenariu ("investment", "romance", etc. sau "legit")
     """
-    if seed is not None:
-        random.seed(seed)
+    cols = generate_columns(n=n, scam_ratio=scam_ratio, seed=seed)
+    return rows_from_columns(cols), cols["label"].astype(int).tolist(), cols["tag"].tolist()
 
-    samples: List[Dict] = []
-    labels: List[int] = []
-    tags: List[str] = []
+# ------------------------------------------------------------------------------
+# Shard-uri pe disc
+# ------------------------------------------------------------------------------
+MANIFEST = "dataset.json"
 
-    num_scam = int(n * scam_ratio)
-    num_leg  = n - num_scam
+def _write_npz(path: str, cols: Dict[str, np.ndarray], compress: bool = False) -> str:
+    path += ".npz"
+    # fără pickle: doar array-uri numerice / unicode de lățime fixă (~500 B/rând necomprimat;
+    # comprimat ~16x mai mic, dar scrierea e ~30x mai lentă)
+    (np.savez_compressed if compress else np.savez)(path, **cols)
+    return path
 
-    # Scam
-    scam_types = list(SCAM_TYPES.keys())
-    for _ in range(num_scam):
-        t = random.choice(scam_types)
-        desc = random.choice(SCAM_TYPES[t])
-        amount = random.choice([3500, 5200, 9000, 15000, 25000])
-        payload = {
-            "ts": _rand_ts(),
-            "src_account_iban": _rand_iban(bank="SRC"),
-            "dst_account_iban": _rand_iban(bank="DST"),
-            "amount": float(amount),
-            "currency": "RON",
-            "channel": _pick_channel(),
-            "is_first_to_payee": True,
-            "description": desc
-        }
-        samples.append(payload)
-        labels.append(1)
-        tags.append(t)
+def _write_parquet(path: str, cols: Dict[str, np.ndarray], compress: bool = False) -> str:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("parquet shards need pyarrow (pip install pyarrow); use fmt='npz'") from e
+    path += ".parquet"
+    pq.write_table(pa.table({k: pa.array(v) for k, v in cols.items()}), path,
+                   compression="zstd" if compress else "snappy")
+    return path
 
-    # Legit
-    for _ in range(num_leg):
-        desc = random.choice(LEGIT_TEMPLATES)
-        amount = random.choice([50, 100, 250, 800, 1200, 3000])
-        payload = {
-            "ts": _rand_ts(),
-            "src_account_iban": _rand_iban(bank="SRC"),
-            "dst_account_iban": _rand_iban(bank="DST"),
-            "amount": float(amount),
-            "currency": "RON",
-            "channel": _pick_channel(),
-            "is_first_to_payee": random.random() < 0.2,
-            "description": desc
-        }
-        samples.append(payload)
-        labels.append(0)
-        tags.append("legit")
+def write_dataset(out_dir: str, n: int, scam_ratio: float = 0.5, seed: int = 42,
+                  shard_rows: int = 1_000_000, fmt: str = "npz", now: dt.datetime | None = None,
+                  compress: bool = False) -> Dict:
+    """
+    Generează `n` rânduri direct în shard-uri de `shard_rows` (memoria e mărginită de un shard).
+    Fiecare shard are propriul seed derivat din `seed` (SeedSequence), deci setul e reproductibil.
+    """
+    writers = {"npz": _write_npz, "parquet": _write_parquet}
+    if fmt not in writers:
+        raise ValueError(f"unknown shard format {fmt!r}, expected one of {sorted(writers)}")
+    os.makedirs(out_dir, exist_ok=True)
+    now = now or dt.datetime.utcnow().replace(microsecond=0)
+    n_shards = max(1, -(-n // shard_rows))
+    seeds = np.random.SeedSequence(seed).spawn(n_shards)
+    shards = []
+    for i, ss in enumerate(seeds):
+        rows = min(shard_rows, n - i * shard_rows)
+        cols = generate_columns(n=rows, scam_ratio=scam_ratio, seed=ss, now=now)
+        path = writers[fmt](os.path.join(out_dir, f"part-{i:05d}"), cols, compress)
+        shards.append({"file": os.path.basename(path), "rows": rows})
+    manifest = {"n": n, "scam_ratio": scam_ratio, "seed": seed, "now": now.isoformat(),
+                "format": fmt, "fields": FIELDS, "shards": shards}
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
 
-    # mic shuffle
-    idx = list(range(n))
-    random.shuffle(idx)
-    samples = [samples[i] for i in idx]
-    labels  = [labels[i]  for i in idx]
-    tags    = [tags[i]    for i in idx]
-    return samples, labels, tags
+def _read_shard(path: str) -> Dict[str, np.ndarray]:
+    if path.endswith(".npz"):
+        with np.load(path, allow_pickle=False) as z:
+            return {k: z[k] for k in z.files}
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError(f"reading {os.path.basename(path)} needs pyarrow (pip install pyarrow)") from e
+    table = pq.read_table(path)
+    out = {}
+    for name in table.column_names:
+        arr = table.column(name).to_numpy(zero_copy_only=False)
+        if arr.dtype == object:
+            arr = arr.astype(str)
+        elif np.issubdtype(arr.dtype, np.datetime64):
+            arr = arr.astype("datetime64[s]")  # parquet poate întoarce ms/us
+        out[name] = arr
+    return out
+
+def _manifest(path: str) -> Dict | None:
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def dataset_rows(path: str) -> int | None:
+    """Numărul de rânduri din manifest (None pentru un director fără dataset.json)."""
+    manifest = _manifest(path)
+    return int(manifest["n"]) if manifest else None
+
+def iter_shards(path: str) -> Iterator[Dict[str, np.ndarray]]:
+    """Shard-urile unui set (director cu dataset.json) pe rând, în ordine."""
+    manifest = _manifest(path)
+    if manifest:
+        files = [os.path.join(path, s["file"]) for s in manifest["shards"]]
+    else:
+        files = sorted(glob.glob(os.path.join(path, "part-*.npz")) + glob.glob(os.path.join(path, "part-*.parquet")))
+    if not files:
+        raise FileNotFoundError(f"no dataset shards in {path}")
+    for file in files:
+        yield _read_shard(file)
+
+def iter_chunks(path: str, chunk_rows: int) -> Iterator[Dict[str, np.ndarray]]:
+    """Rândurile setului în bucăți de cel mult `chunk_rows` (un shard în memorie la un moment dat)."""
+    for shard in iter_shards(path):
+        n = len(shard["label"])
+        for i in range(0, n, chunk_rows):
+            yield {k: v[i:i + chunk_rows] for k, v in shard.items()}
+
+def generate_chunks(n: int, chunk_rows: int, scam_ratio: float = 0.5, seed: int = 42,
+                    now: dt.datetime | None = None) -> Iterator[Dict[str, np.ndarray]]:
+    """generate_columns pe bucăți de `chunk_rows`, cu seed-uri derivate ca în write_dataset."""
+    now = now or dt.datetime.utcnow().replace(microsecond=0)
+    n_chunks = max(1, -(-n // chunk_rows))
+    for i, ss in enumerate(np.random.SeedSequence(seed).spawn(n_chunks)):
+        yield generate_columns(n=min(chunk_rows, n - i * chunk_rows), scam_ratio=scam_ratio, seed=ss, now=now)
+
+def load_columns(path: str, limit: int | None = None) -> Dict[str, np.ndarray]:
+    """Tot setul (sau primele `limit` rânduri, citind doar shard-urile necesare) într-un singur dict."""
+    parts, rows = [], 0
+    for shard in iter_shards(path):
+        parts.append(shard)
+        rows += len(shard["label"])
+        if limit is not None and rows >= limit:
+            break
+    cols = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+    return cols if limit is None else {k: v[:limit] for k, v in cols.items()}
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, required=True)
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--scam-ratio", type=float, default=0.5)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--shard-rows", type=int, default=1_000_000)
+    ap.add_argument("--format", choices=["npz", "parquet"], default="npz")
+    ap.add_argument("--compress", action="store_true")
+    args = ap.parse_args()
+    m = write_dataset(args.out, n=args.rows, scam_ratio=args.scam_ratio, seed=args.seed,
+                      shard_rows=args.shard_rows, fmt=args.format, compress=args.compress)
+    print(f"wrote {m['n']} rows in {len(m['shards'])} {m['format']} shard(s) to {args.out}")
+
+if __name__ == "__main__":
+    main()
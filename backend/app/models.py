@@ -9,6 +9,8 @@ from sqlalchemy import (
     Boolean,
     JSON,
     Float,
+    SmallInteger,
+    Text,
     text,
 )
 
@@ -45,3 +47,8 @@ class Transaction(Base):
     risk_score = Column(Float, default=0)
     risk_reasons = Column(JSON, default=list)
     action = Column(String(16), default="allow")
+    description = Column(Text, nullable=True)
+    # etichete pentru antrenare (decizia analistului / rezultatul quiz-ului)
+    label = Column(SmallInteger, nullable=True)  # 1 scam, 0 legit
+    label_source = Column(String(16), nullable=True)  # analyst|quiz
+    labeled_at = Column(TIMESTAMP, nullable=True)
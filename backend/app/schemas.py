@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 from typing import Any
 
@@ -19,6 +19,8 @@ class ScoreOut(BaseModel):
     action: str  # allow|warn|hold
     reasons: List[str] = []
     cooloff_minutes: int = 0
+    # agregatele velocity pe fereastră: {"5m": {"payees", "count", "total"}, "1h": {...}}
+    velocity_windows: Dict[str, Dict[str, float]] = {}
 
 class AlertOut(BaseModel):
     id: int
@@ -0,0 +1,176 @@
+# backend/app/services/account_cache.py
+from __future__ import annotations
+
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.models import Account, Customer
+from app.services.lru import LRUCache
+
+ACCOUNT_CACHE_SIZE = int(os.getenv("ACCOUNT_CACHE_SIZE", "200000"))
+# cât ținem minte că un IBAN NU are cont (destinații externe) înainte de a re-verifica în DB
+ACCOUNT_NEG_TTL_SEC = float(os.getenv("ACCOUNT_NEG_TTL_SEC", "60"))
+
+DEMO_CUSTOMER = "demo"  # clientul sub care creăm conturile sursă necunoscute (demo)
+
+
+class AccountCache:
+    """
+    Cache în proces IBAN <-> account_id, comun pentru scoring și citirile de alerte.
+      - ids_for(): doar lookup (cache, apoi un singur SELECT pentru ce lipsește)
+      - ensure_ids(): ca ids_for, dar creează conturile lipsă cu
+        INSERT ... ON CONFLICT (iban) DO NOTHING RETURNING id, iban
+      - ibans_for(): id -> IBAN pentru paginile de alerte / export CSV
+    Toate primesc o sesiune sync (în calea async se apelează prin AsyncSession.run_sync).
+    """
+
+    def __init__(self, maxsize: int = ACCOUNT_CACHE_SIZE, neg_ttl_sec: float = ACCOUNT_NEG_TTL_SEC):
+        self._by_iban = LRUCache(maxsize)
+        self._by_id = LRUCache(maxsize)
+        self._missing = LRUCache(maxsize)  # iban -> momentul în care am văzut că nu există
+        self.neg_ttl_sec = neg_ttl_sec
+        self._demo_customer_id: Optional[int] = None
+
+    # ---- cache ----
+    def _put(self, iban: str, acc_id: int) -> None:
+        self._by_iban.put(iban, acc_id)
+        self._by_id.put(acc_id, iban)
+        self._missing.pop(iban)
+
+    def forget(self, ibans: Iterable[str]) -> None:
+        for iban in ibans:
+            acc_id = self._by_iban.pop(iban)
+            if acc_id is not None:
+                self._by_id.pop(acc_id)
+
+    def discard_created(self, db: Session) -> None:
+        """Uită tot ce a creat ensure_ids în sesiunea `db` (apelat când tranzacția eșuează)."""
+        self.forget(db.info.pop("created_ibans", []))
+        if db.info.pop("created_demo_customer", False):
+            self._demo_customer_id = None
+
+    def clear(self) -> None:
+        self._by_iban.clear()
+        self._by_id.clear()
+        self._missing.clear()
+        self._demo_customer_id = None
+
+    def warm(self, db: Session) -> int:
+        """Încarcă cele mai recente conturi (până la capacitatea cache-ului) la startup."""
+        rows = db.execute(
+            select(Account.id, Account.iban)
+            .where(Account.iban.is_not(None))
+            .order_by(Account.id.desc())
+            .limit(self._by_iban.maxsize)
+        ).all()
+        for acc_id, iban in reversed(rows):  # cele mai noi ajung „cele mai recent folosite”
+            self._put(iban, acc_id)
+        return len(rows)
+
+    # ---- lookups ----
+    def ids_for(self, db: Session, ibans: Iterable[str]) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        unknown: List[str] = []
+        now = time.monotonic()
+        for iban in dict.fromkeys(ibans):
+            acc_id = self._by_iban.get(iban)
+            if acc_id is not None:
+                out[iban] = acc_id
+                continue
+            seen_missing = self._missing.get(iban)
+            if seen_missing is not None and now - seen_missing < self.neg_ttl_sec:
+                continue
+            unknown.append(iban)
+
+        if unknown:
+            rows = db.execute(select(Account.iban, Account.id).where(Account.iban.in_(unknown))).all()
+            for iban, acc_id in rows:
+                self._put(iban, acc_id)
+                out[iban] = acc_id
+            for iban in unknown:
+                if iban not in out:
+                    self._missing.put(iban, now)
+        return out
+
+    def ensure_ids(self, db: Session, ibans: Iterable[str]) -> Dict[str, int]:
+        """
+        IBAN -> account_id, creând conturile lipsă (sub clientul demo).
+        Ce am creat e notat în db.info ca să poată fi scos din cache (discard_created)
+        dacă tranzacția nu ajunge la commit.
+        """
+        wanted = list(dict.fromkeys(ibans))
+        out = self.ids_for(db, wanted)
+        # ids_for poate sări peste IBAN-uri din cache-ul negativ; aici le vrem create
+        missing = [iban for iban in wanted if iban not in out]
+        if not missing:
+            return out
+
+        cust_id = self._demo_customer(db)
+        stmt = (
+            pg_insert(Account)
+            .values([{"customer_id": cust_id, "iban": iban} for iban in missing])
+            .on_conflict_do_nothing(index_elements=[Account.iban])
+            .returning(Account.id, Account.iban)
+        )
+        created = {iban: acc_id for acc_id, iban in db.execute(stmt).all()}
+        db.info.setdefault("created_ibans", []).extend(created)
+
+        # conflicte = conturi create între timp de alt worker -> le citim
+        raced = [iban for iban in missing if iban not in created]
+        if raced:
+            created.update(dict(db.execute(select(Account.iban, Account.id).where(Account.iban.in_(raced))).all()))
+
+        for iban, acc_id in created.items():
+            self._put(iban, acc_id)
+        out.update(created)
+        return out
+
+    def ibans_for(self, db: Session, ids: Iterable[int]) -> Dict[int, str]:
+        out: Dict[int, str] = {}
+        unknown: List[int] = []
+        for acc_id in set(ids):
+            if acc_id is None:
+                continue
+            iban = self._by_id.get(acc_id)
+            if iban is not None:
+                out[acc_id] = iban
+            else:
+                unknown.append(acc_id)
+        if unknown:
+            for acc_id, iban in db.execute(select(Account.id, Account.iban).where(Account.id.in_(unknown))).all():
+                if iban is not None:
+                    self._put(iban, acc_id)
+                    out[acc_id] = iban
+        return out
+
+    def _demo_customer(self, db: Session) -> int:
+        if self._demo_customer_id is None:
+            cust_id = db.execute(
+                pg_insert(Customer)
+                .values(external_id=DEMO_CUSTOMER, name="Demo User")
+                .on_conflict_do_nothing(index_elements=[Customer.external_id])
+                .returning(Customer.id)
+            ).scalar_one_or_none()
+            if cust_id is not None:
+                db.info["created_demo_customer"] = True
+            else:
+                cust_id = db.execute(
+                    select(Customer.id).where(Customer.external_id == DEMO_CUSTOMER)
+                ).scalar_one()
+            self._demo_customer_id = cust_id
+        return self._demo_customer_id
+
+    def stats(self) -> Dict:
+        return {
+            "by_iban": self._by_iban.stats(),
+            "by_id": self._by_id.stats(),
+            "negative": self._missing.stats(),
+        }
+
+
+account_cache = AccountCache()
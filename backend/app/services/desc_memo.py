@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Memoizare pe descrierea plății. Descrierile se repetă mult ("rent payment",
+"utilities bill", șabloane de factură), iar text_risk și partea de text din
+scorerul ML depind doar de descriere și de listele / modelul curente.
+
+Cheia e descrierea cu litere mici (ambele consumatoare lucrează oricum pe lower()).
+Fiecare consumator își ține propriul cache și îl golește când i se schimbă
+sursa (listele de cuvinte-cheie, respectiv versiunea modelului).
+"""
+from __future__ import annotations
+import os
+from typing import Optional
+
+from app.services.lru import LRUCache
+
+DESC_MEMO_SIZE = int(os.getenv("DESC_MEMO_SIZE", "10000"))     # 0 = fără cache
+DESC_MEMO_TTL_SEC = float(os.getenv("DESC_MEMO_TTL_SEC", "3600"))
+DESC_MEMO_MAX_LEN = int(os.getenv("DESC_MEMO_MAX_LEN", "256"))  # textele lungi (unice) nu intră în cache
+
+
+def make_memo() -> Optional[LRUCache]:
+    if DESC_MEMO_SIZE <= 0:
+        return None
+    return LRUCache(DESC_MEMO_SIZE, ttl=DESC_MEMO_TTL_SEC)
+
+
+def memo_key(description: str) -> Optional[str]:
+    """Descrierea normalizată sau None dacă nu merită păstrată."""
+    if len(description) > DESC_MEMO_MAX_LEN:
+        return None
+    return description.lower()
@@ -0,0 +1,72 @@
+# backend/app/services/hll.py
+from __future__ import annotations
+
+import math
+import os
+from typing import List
+
+# Numărare distinctă aproximativă (opt-in), pentru fan-in / fan-out (mule) și beneficiarii
+# distincți (velocity). Implicit rămânem pe ZSET-uri exacte.
+#
+#   DISTINCT_COUNT_MODE=exact  ZSET member = IBAN (memorie ~ nr. de IBAN-uri distincte)
+#   DISTINCT_COUNT_MODE=hll    două HyperLogLog-uri Redis per fereastră (rolling): generația
+#                              curentă și cea precedentă, fiecare lungă cât fereastra,
+#                              <prefix>:<sec>:<g % 2> cu g = floor(ts / sec)
+#
+# Numărul pe [now - sec, now] = tot ce e în generația curentă + partea din cea precedentă
+# rămasă în fereastră, proporțional cu timpul:
+#   n = n_cur + (n_union - n_cur) * (1 - (now - g * sec) / sec)
+# (n_union = PFCOUNT peste ambele). Pe lângă eroarea standard a HLL-ului Redis (0.81%),
+# termenul pentru generația precedentă presupune sosiri uniforme în timp.
+#
+# Memorie: 2 HLL-uri per fereastră, indiferent de trafic. Un HLL mic e sparse (câțiva octeți
+# per element distinct, până la hll-sparse-max-bytes, 3 KB implicit) și devine dens (12 KB)
+# abia după câteva mii de elemente; deci cel mult 2 x 12 KB per fereastră, iar pentru un
+# fan-in / fan-out obișnuit (zeci-sute) câțiva KB per IBAN. O generație expiră singură
+# (EXPIREAT) la sfârșitul generației următoare, deci cheia cu aceeași paritate e goală
+# când e refolosită.
+#
+# Numele cheilor le calculează Python (window_keys) și intră în KEYS-ul scripturilor;
+# funcțiile Lua primesc cheile gata făcute.
+DISTINCT_COUNT_MODE = os.getenv("DISTINCT_COUNT_MODE", "exact")
+HLL_STD_ERROR = 1.04 / math.sqrt(2 ** 14)  # 0.81%, documentat de Redis
+
+
+def enabled() -> bool:
+    return DISTINCT_COUNT_MODE == "hll"
+
+
+def window_keys(prefix: str, sec: int, now: float) -> List[str]:
+    """[generația curentă, generația precedentă] pentru fereastra de `sec` secunde la `now`."""
+    g = int(now // sec)
+    return [f"{prefix}:{sec}:{g % 2}", f"{prefix}:{sec}:{(g - 1) % 2}"]
+
+
+def estimate(n_cur: int, n_union: int, now: float, sec: int) -> int:
+    """Aceeași estimare ca hll_count, din PFCOUNT(cur) și PFCOUNT(cur, prev) citite separat."""
+    elapsed = (now - (now // sec) * sec) / sec
+    return int(n_cur + math.floor((n_union - n_cur) * (1 - elapsed) + 0.5))
+
+
+# Funcții Lua partajate de scripturile mule, velocity și de scriptul de stare.
+# hll_add pune `member` în generația lui `ts` (curentă sau precedentă; mai vechi -> ignorat)
+# și îi setează expirarea; hll_count dă estimarea pe fereastra care se termină la `now`.
+# `cur` / `prev` vin din KEYS (window_keys calculat cu același `now`).
+HLL_LUA_FN = """
+local function hll_add(cur, prev, ts, member, now, sec)
+  local g, gts = math.floor(now / sec), math.floor(ts / sec)
+  local k = (gts == g) and cur or ((gts == g - 1) and prev or nil)
+  if k == nil then
+    return
+  end
+  redis.call('PFADD', k, member)
+  redis.call('EXPIREAT', k, (gts + 2) * sec)
+end
+
+local function hll_count(cur, prev, now, sec)
+  local n_cur = redis.call('PFCOUNT', cur)
+  local n_union = redis.call('PFCOUNT', cur, prev)
+  local elapsed = (now - math.floor(now / sec) * sec) / sec
+  return n_cur + math.floor((n_union - n_cur) * (1 - elapsed) + 0.5)
+end
+"""
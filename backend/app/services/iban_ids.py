@@ -0,0 +1,180 @@
+# backend/app/services/iban_ids.py
+from __future__ import annotations
+
+import os
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from app.services.lru import LRUCache
+
+# Dicționar IBAN <-> id întreg pentru membrii structurilor Redis (opt-in, IBAN_INTERN=1).
+#
+# Un IBAN are 24-34 de caractere și apare de mai multe ori per plată (surse / destinații,
+# evenimente "<ts>:<iban>", beneficiarii velocity). Cu IBAN_INTERN=1 membrii ZSET-urilor
+# mule și velocity și elementele HLL sunt id-uri: un întreg mic e stocat de Redis direct ca
+# întreg în listpack-ul ZSET-urilor mici și e comparat/hash-uit mai repede decât un șir lung.
+# Numele cheilor rămân pe IBAN (ex. mule:in_sources:<iban>), la fel leaderboard-ul și
+# watchlist-ul (mici, citite direct de API).
+#
+#   iban:ids    HASH iban -> "<id>:<gen>" (+ câmpul "#next", contorul de id-uri)
+#   iban:names  HASH id -> iban
+#
+# Id-urile se alocă în scripturile Lua (iban_id, atomic: HINCRBY pe "#next"; un id nu se
+# refolosește), deci scrierea nu costă un round trip în plus. gen = ziua (IBAN_ID_GEN_SEC) în
+# care IBAN-ul a fost văzut ultima dată; se rescrie o dată per generație. Compactarea mule
+# (sweep) șterge perechile nevăzute de mai mult decât cea mai lungă retenție a unei structuri
+# care poate conține id-ul (ZSET-uri mule / velocity, HLL-uri), deci dicționarul crește cu
+# IBAN-urile active, nu cu toate IBAN-urile văzute vreodată. Traducerea înapoi (recent_sources / recent_dests)
+# se face tot în script pe calea de scoring și cu HMGET + cache LRU în proces (IBAN_ID_CACHE_SIZE)
+# pe citirile /mule/*. Membrii scriși înainte de activare (IBAN-uri) rămân valizi: ce nu e în
+# dicționar e întors ca atare, iar datele vechi ies din ferestre / expiră singure.
+IBAN_INTERN = os.getenv("IBAN_INTERN", "0").lower() in {"1", "true", "yes"}
+IBAN_ID_CACHE_SIZE = int(os.getenv("IBAN_ID_CACHE_SIZE", "100000"))
+IBAN_ID_GEN_SEC = int(os.getenv("IBAN_ID_GEN_SEC", "86400"))
+IBAN_ID_SWEEP_CHUNK = 1000
+IDS = "iban:ids"
+NAMES = "iban:names"
+NEXT = "#next"
+
+# id -> IBAN e imuabil, deci fără TTL
+_names = LRUCache(IBAN_ID_CACHE_SIZE)
+
+
+def enabled() -> bool:
+    return IBAN_INTERN
+
+
+def keys() -> List[str]:
+    """KEYS pentru iban_id / iban_names (în ordinea din scripturi)."""
+    return [IDS, NAMES]
+
+
+def gen(now: float) -> int:
+    """Generația (argumentul `gen` al lui iban_id) pentru `now`."""
+    return int(now // IBAN_ID_GEN_SEC)
+
+
+# Funcții Lua partajate de scriptul de stare, scriptul velocity și scriptul mule.
+# iban_id întoarce id-ul (ca șir), îl alocă la prima apariție și marchează generația `gen`;
+# iban_names traduce o listă de membri înapoi în IBAN-uri (membrii care nu sunt în dicționar
+# rămân neschimbați). Valorile vechi fără generație ("<id>") primesc una la prima folosire;
+# "#next" lipsă pornește de la HLEN (id-urile alocate înainte erau 1..HLEN).
+IBAN_LUA_FN = """
+local function iban_id(ids, names, iban, gen)
+  local v = redis.call('HGET', ids, iban)
+  if v then
+    local id, g = string.match(v, '^(%d+):?(%d*)$')
+    if g ~= gen then
+      redis.call('HSET', ids, iban, id .. ':' .. gen)
+    end
+    return id
+  end
+  if redis.call('HEXISTS', ids, '#next') == 0 then
+    redis.call('HSET', ids, '#next', redis.call('HLEN', names))
+  end
+  local id = tostring(redis.call('HINCRBY', ids, '#next', 1))
+  redis.call('HSET', ids, iban, id .. ':' .. gen)
+  redis.call('HSET', names, id, iban)
+  return id
+end
+
+local function iban_names(names, members)
+  if #members == 0 then
+    return members
+  end
+  local out = redis.call('HMGET', names, unpack(members))
+  for i, v in ipairs(members) do
+    if not out[i] then
+      out[i] = v
+    end
+  end
+  return out
+end
+"""
+
+
+def _split(members: Iterable[str]) -> tuple:
+    out: Dict[str, Optional[str]] = {}
+    missing: List[str] = []
+    for m in members:
+        if m in out:
+            continue
+        name = _names.get(m)
+        out[m] = name
+        if name is None and m.isdigit():
+            missing.append(m)
+    return out, missing
+
+
+def _fill(out: Dict[str, Optional[str]], missing: Sequence[str], found: Sequence[Optional[str]]) -> None:
+    for m, name in zip(missing, found):
+        if name is not None:
+            _names.put(m, name)
+            out[m] = name
+
+
+def names(rds, members: Sequence[str]) -> List[str]:
+    """Membrii (id-uri sau IBAN-uri vechi) -> IBAN-uri; un singur HMGET pentru ce nu e în cache."""
+    if not IBAN_INTERN or not members:
+        return list(members)
+    out, missing = _split(members)
+    if missing:
+        _fill(out, missing, rds.hmget(NAMES, missing))
+    return [out[m] or m for m in members]
+
+
+async def names_async(ards, members: Sequence[str]) -> List[str]:
+    if not IBAN_INTERN or not members:
+        return list(members)
+    out, missing = _split(members)
+    if missing:
+        _fill(out, missing, await ards.hmget(NAMES, missing))
+    return [out[m] or m for m in members]
+
+
+# Șterge perechile cu generația < ARGV[1] (verificată din nou atomic: un IBAN folosit între
+# HSCAN și script rămâne). Valorile fără generație primesc generația curentă (ARGV[2]).
+# KEYS: 1 ids  2 names  ARGV: 1 min_gen  2 gen  3.. IBAN-uri  ->  nr. de IBAN-uri șterse
+IBAN_SWEEP_LUA = """
+local min_gen, removed = tonumber(ARGV[1]), 0
+for i = 3, #ARGV do
+  local v = redis.call('HGET', KEYS[1], ARGV[i])
+  if v then
+    local id, g = string.match(v, '^(%d+):?(%d*)$')
+    if g == '' then
+      redis.call('HSET', KEYS[1], ARGV[i], id .. ':' .. ARGV[2])
+    elseif tonumber(g) < min_gen then
+      redis.call('HDEL', KEYS[1], ARGV[i])
+      redis.call('HDEL', KEYS[2], id)
+      removed = removed + 1
+    end
+  end
+end
+return removed
+"""
+
+
+def sweep(rds, now: float, keep_sec: int) -> int:
+    """
+    Șterge IBAN-urile nevăzute de peste `keep_sec` (+ o generație de siguranță) din ambele
+    hash-uri. HSCAN + IBAN_SWEEP_LUA pe loturi; id-urile șterse nu se mai alocă.
+    """
+    cur = gen(now)
+    min_gen = cur - (keep_sec + IBAN_ID_GEN_SEC - 1) // IBAN_ID_GEN_SEC - 1
+    script = rds.register_script(IBAN_SWEEP_LUA)
+    removed, chunk = 0, []
+    for iban, v in rds.hscan_iter(IDS, count=IBAN_ID_SWEEP_CHUNK):
+        if iban == NEXT:
+            continue
+        g = v.partition(":")[2]
+        if not g or int(g) < min_gen:
+            chunk.append(iban)
+        if len(chunk) >= IBAN_ID_SWEEP_CHUNK:
+            removed += int(script(keys=keys(), args=[min_gen, cur, *chunk]))
+            chunk = []
+    if chunk:
+        removed += int(script(keys=keys(), args=[min_gen, cur, *chunk]))
+    return removed
+
+
+def stats() -> Dict:
+    return {"enabled": IBAN_INTERN, "gen_sec": IBAN_ID_GEN_SEC, "cache": _names.stats()}
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+
+class KeywordMatcher:
+    """
+    Automat Aho-Corasick peste o listă ordonată de termeni (term, weight).
+    find(text) întoarce indicii termenilor care apar ca subșir în `text`
+    (fiecare o singură dată, în ordinea din listă), într-o singură trecere
+    prin text, indiferent de câți termeni sunt.
+
+    Semantica e cea a lui `term in text`: potrivire pe subșir, fără limite de
+    cuvânt; același termen poate apărea de mai multe ori în listă (ex. și ca
+    frază, și ca cuvânt) și atunci fiecare intrare e raportată.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, int]]):
+        self.entries: List[Tuple[str, int]] = list(entries)
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[int]] = [[]]
+        always: List[int] = []  # "" in text e mereu adevărat
+        for idx, (term, _) in enumerate(self.entries):
+            if not term:
+                always.append(idx)
+                continue
+            s = 0
+            for ch in term:
+                nxt = goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[s][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                s = nxt
+            out[s].append(idx)
+
+        # BFS: fail[s] = cel mai lung sufix propriu al lui s care e și prefix în trie;
+        # link[s] = cea mai apropiată stare pe lanțul de fail care termină un termen
+        fail = [0] * len(goto)
+        link = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            s = queue.popleft()
+            for ch, t in goto[s].items():
+                queue.append(t)
+                f = fail[s]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                if s:  # copiii rădăcinii rămân cu fail = 0
+                    fail[t] = goto[f].get(ch, 0)
+                link[t] = fail[t] if out[fail[t]] else link[fail[t]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+        self._link = link
+        self._always = always
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def states(self) -> int:
+        return len(self._goto)
+
+    def find(self, text: str) -> List[int]:
+        goto, fail, out, link = self._goto, self._fail, self._out, self._link
+        found = set(self._always)
+        s = 0
+        for ch in text:
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            t = s if out[s] else link[s]
+            while t:
+                found.update(out[t])
+                t = link[t]
+        return sorted(found)
@@ -0,0 +1,382 @@
+# backend/app/services/memory_store.py
+from __future__ import annotations
+
+import math
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.schemas import PaymentIn
+from app.services import mule, state_script, velocity
+from app.services.state_store import StateStore
+
+# STATE_BACKEND=memory: starea de scoring în procesul curent, fără Redis.
+# Potrivit pentru un singur nod (un worker uvicorn; cu mai mulți, fiecare are starea lui),
+# benchmark-uri și teste. Semantica e aceeași ca în scriptul Lua de stare (aceleași ferestre,
+# aceleași bucket-uri velocity); numărarea distinctă e mereu exactă (DISTINCT_COUNT_MODE
+# e specific Redis).
+#
+# Datele sunt împărțite pe MEMORY_STATE_SHARDS shard-uri după IBAN, fiecare cu lock-ul lui;
+# o plată blochează cel mult shard-urile sursei și destinației (în ordinea indicilor).
+# Evicția: la fiecare scriere se taie ce a ieșit din MULE_KEY_TTL_SEC (citirile doar numără
+# pe fereastră, nu șterg nimic), iar la MEMORY_STATE_SWEEP_OPS
+# operații pe un shard se parcurge tot shard-ul și se șterg conturile inactive (echivalentul
+# EXPIRE din Redis).
+# IBAN-urile sunt internate (sys.intern): toate structurile țin referințe la același obiect
+# per IBAN, echivalentul în proces al dicționarului de id-uri din Redis (IBAN_INTERN).
+MEMORY_STATE_SHARDS = int(os.getenv("MEMORY_STATE_SHARDS", "16"))
+MEMORY_STATE_SWEEP_OPS = int(os.getenv("MEMORY_STATE_SWEEP_OPS", "4096"))
+
+
+def _score(item: Tuple[float, str]) -> float:
+    return item[0]
+
+
+class _ZSet:
+    """Subsetul de ZSET folosit aici: membru -> scor, ordonat după (scor, membru)."""
+
+    __slots__ = ("scores", "items")
+
+    def __init__(self):
+        self.scores: Dict[str, float] = {}
+        self.items: List[Tuple[float, str]] = []
+
+    def add(self, member: str, score: float) -> None:
+        old = self.scores.get(member)
+        if old is not None:
+            if old == score:
+                return
+            del self.items[bisect_left(self.items, (old, member))]
+        self.scores[member] = score
+        insort(self.items, (score, member))
+
+    def remove_upto(self, max_score: float, inclusive: bool = True) -> int:
+        """ZREMRANGEBYSCORE 0 max_score (sau '(max_score' cu inclusive=False)."""
+        cut = (bisect_right if inclusive else bisect_left)(self.items, max_score, key=_score)
+        for _, m in self.items[:cut]:
+            del self.scores[m]
+        del self.items[:cut]
+        return cut
+
+    def count(self, lo: float, hi: float = math.inf) -> int:
+        return bisect_right(self.items, hi, key=_score) - bisect_left(self.items, lo, key=_score)
+
+    def discard(self, member: str) -> None:
+        old = self.scores.pop(member, None)
+        if old is not None:
+            del self.items[bisect_left(self.items, (old, member))]
+
+    def top(self, n: int, lo: float = -math.inf) -> List[str]:
+        """ZREVRANGEBYSCORE +inf lo LIMIT 0 n."""
+        if n <= 0:
+            return []
+        first = max(len(self.items) - n, bisect_left(self.items, lo, key=_score))
+        return [m for _, m in reversed(self.items[first:])]
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+
+
+class _Account:
+    """Tot ce ținem pentru un IBAN (cheile vel:{iban}:* și mule:*:{iban} din Redis)."""
+
+    __slots__ = ("in_sources", "in_events", "out_dests", "out_events", "vel_buckets", "vel_payees", "vel_expires")
+
+    def __init__(self):
+        self.in_sources = _ZSet()
+        self.in_events = _ZSet()
+        self.out_dests = _ZSet()
+        self.out_events = _ZSet()
+        self.vel_buckets: Dict[Tuple[int, int], List[int]] = {}  # (bucket_sec, bucket) -> [n, bani]
+        self.vel_payees = _ZSet()
+        self.vel_expires = 0.0
+
+    def idle(self, now: float) -> bool:
+        if now >= self.vel_expires:
+            self.vel_buckets.clear()
+            self.vel_payees = _ZSet()
+        return not (self.in_sources or self.in_events or self.out_dests or self.out_events
+                    or self.vel_buckets or self.vel_payees)
+
+
+class _Shard:
+    __slots__ = ("lock", "accounts", "ops")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accounts: Dict[str, _Account] = {}
+        self.ops = 0
+
+
+class MemoryStateStore(StateStore):
+    name = "memory"
+
+    def __init__(self, shards: int = MEMORY_STATE_SHARDS, sweep_ops: int = MEMORY_STATE_SWEEP_OPS,
+                 mule_keep_sec: Optional[float] = None):
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self.sweep_ops = max(1, sweep_ops)
+        # ca TTL-ul cheilor mule din Redis (fereastra maximă de interogare)
+        self.mule_keep_sec = mule_keep_sec or mule.MULE_KEY_TTL_SEC
+        self._watchlist: set = set()
+        self._watch_lock = threading.Lock()
+        self._board = _ZSet()  # mule.LEADERBOARD; lock luat mereu după cel al shard-ului
+        self._board_lock = threading.Lock()
+        self.sweeps = 0
+        self.evicted = 0
+
+    # ---- shard-uri ----
+    def _shard(self, iban: str) -> _Shard:
+        return self._shards[hash(iban) % len(self._shards)]
+
+    def _locked(self, *ibans: str) -> List[_Shard]:
+        shards = sorted({id(s): s for s in map(self._shard, ibans)}.values(),
+                        key=self._shards.index)
+        for s in shards:
+            s.lock.acquire()
+        return shards
+
+    @staticmethod
+    def _release(shards: List[_Shard]) -> None:
+        for s in reversed(shards):
+            s.lock.release()
+
+    def _account(self, iban: str) -> _Account:
+        accounts = self._shard(iban).accounts
+        acc = accounts.get(iban)
+        if acc is None:
+            acc = accounts[iban] = _Account()
+        return acc
+
+    def _tick(self, shards: List[_Shard], now: float) -> None:
+        """Sub lock: numără operațiile și, din când în când, curăță shard-ul."""
+        for s in shards:
+            s.ops += 1
+            if s.ops % self.sweep_ops == 0:
+                self._sweep(s, now)
+
+    def _sweep(self, shard: _Shard, now: float) -> Tuple[int, int]:
+        """Sub lock: taie datele mule vechi și șterge conturile inactive -> (membri, conturi)."""
+        cutoff = now - self.mule_keep_sec
+        removed, dead = 0, []
+        for iban, acc in shard.accounts.items():
+            for z in (acc.in_sources, acc.in_events, acc.out_dests, acc.out_events):
+                removed += z.remove_upto(cutoff)
+            if acc.idle(now):
+                dead.append(iban)
+        for iban in dead:
+            del shard.accounts[iban]
+            self._rank(iban, 0, 0, 0)
+        self.sweeps += 1
+        self.evicted += len(dead)
+        return removed, len(dead)
+
+    # ---- logica din scripturile Lua ----
+    def _rank(self, iban: str, fan_in: int, tx_in: int, fan_out: int) -> None:
+        """mule_rank din mule.MULE_LUA_FN."""
+        score = mule.stats_dict(iban, 0, fan_in, tx_in, fan_out, 0, [], [])["mule_score"]
+        with self._board_lock:
+            if fan_in > 0 and score > 0:
+                self._board.add(iban, score)
+            else:
+                self._board.discard(iban)
+
+    def _refresh(self, iban: str, since: float, now: float) -> None:
+        """mule_refresh din mule.MULE_LUA_FN (sub lock-ul shard-ului lui `iban`)."""
+        acc = self._shard(iban).accounts.get(iban)
+        if acc is None:
+            self._rank(iban, 0, 0, 0)
+            return
+        self._rank(iban, acc.in_sources.count(since), acc.in_events.count(since, now), acc.out_dests.count(since))
+
+    def _velocity(self, acc: _Account, now: int, dst: str, cents: int) -> List[List[int]]:
+        """velocity_record din velocity.VELOCITY_LUA_FN, pe structurile din memorie."""
+        windows = velocity.WINDOWS
+        keep: Dict[int, int] = {}
+        los = []
+        for w in windows:
+            lo = (now - w.sec) // w.bucket_sec
+            los.append(lo)
+            keep[w.bucket_sec] = min(keep.get(w.bucket_sec, lo), lo)
+        max_sec = max(w.sec for w in windows)
+        ttl = max(w.sec + w.bucket_sec for w in windows)
+
+        if now >= acc.vel_expires:  # EXPIRE-ul cheilor vel:* a trecut
+            acc.vel_buckets.clear()
+            acc.vel_payees = _ZSet()
+        buckets = acc.vel_buckets
+        for res in keep:
+            slot = buckets.setdefault((res, now // res), [0, 0])
+            slot[0] += 1
+            slot[1] += cents
+        out = [[0, 0, 0] for _ in windows]
+        for key in [k for k in buckets if k[1] < keep[k[0]]]:
+            del buckets[key]
+        for (res, b), (n, s) in buckets.items():
+            for j, w in enumerate(windows):
+                if w.bucket_sec == res and b >= los[j]:
+                    out[j][1] += n
+                    out[j][2] += s
+
+        acc.vel_payees.add(dst, now)
+        acc.vel_payees.remove_upto(now - max_sec, inclusive=False)
+        for j, w in enumerate(windows):
+            out[j][0] = acc.vel_payees.count(now - w.sec)
+        acc.vel_expires = now + ttl
+        return out
+
+    def _record_one(self, p: PaymentIn, hours: int, now: float) -> List:
+        src, dst = sys.intern(p.src_account_iban), sys.intern(p.dst_account_iban)
+        ts = min(mule.to_epoch(p.ts), now)
+        since = now - hours * 3600
+        d, s = self._account(dst), self._account(src)
+
+        d.in_sources.add(src, ts)
+        eid = mule.event_id()
+        d.in_events.add(f"{ts}:{src}:{eid}", ts)
+        s.out_dests.add(dst, ts)
+        s.out_events.add(f"{ts}:{dst}:{eid}", ts)
+        cutoff = now - self.mule_keep_sec
+        for z in (d.in_sources, d.in_events, d.out_dests, d.out_events):
+            z.remove_upto(cutoff)
+
+        fan_in, tx_in, fan_out = d.in_sources.count(since), d.in_events.count(since, now), d.out_dests.count(since)
+        raw = [
+            fan_in, tx_in, fan_out, d.out_events.count(since, now),
+            d.in_sources.top(mule.RECENT, since), d.out_dests.top(mule.RECENT, since),
+        ]
+        self._rank(dst, fan_in, tx_in, fan_out)
+        self._refresh(src, since, now)
+        vel = self._velocity(s, int(now), dst, velocity.to_cents(p.amount))
+        return raw + [vel, int(dst.upper() in self._watchlist)]
+
+    # ---- StateStore ----
+    async def record_and_fetch_many(self, payments: Sequence[PaymentIn], hours: int) -> List[Dict]:
+        now = time.time()
+        out = []
+        for p in payments:  # secvențial, ca pipeline-ul de EVALSHA (plata i vede plățile 0..i-1)
+            shards = self._locked(p.src_account_iban, p.dst_account_iban)
+            try:
+                raw = self._record_one(p, hours, now)
+                self._tick(shards, now)
+            finally:
+                self._release(shards)
+            out.append(state_script.parse(p, hours, raw))
+        return out
+
+    def velocity_record(self, src_iban: str, dst_iban: str, amount: float, now: int) -> List:
+        shards = self._locked(src_iban)
+        try:
+            raw = self._velocity(self._account(src_iban), int(now), sys.intern(dst_iban), velocity.to_cents(amount))
+            self._tick(shards, now)
+            return raw
+        finally:
+            self._release(shards)
+
+    def mule_record(self, ts: float, src_iban: str, dst_iban: str) -> None:
+        src_iban, dst_iban = sys.intern(src_iban), sys.intern(dst_iban)
+        shards = self._locked(src_iban, dst_iban)
+        try:
+            d, s = self._account(dst_iban), self._account(src_iban)
+            d.in_sources.add(src_iban, ts)
+            eid = mule.event_id()
+            d.in_events.add(f"{ts}:{src_iban}:{eid}", ts)
+            s.out_dests.add(dst_iban, ts)
+            s.out_events.add(f"{ts}:{dst_iban}:{eid}", ts)
+            now = time.time()
+            since = now - mule.DEFAULT_HOURS * 3600
+            self._refresh(dst_iban, since, now)
+            self._refresh(src_iban, since, now)
+            self._tick(shards, now)
+        finally:
+            self._release(shards)
+
+    def mule_stats(self, iban: str, hours: int, now: float) -> Dict:
+        since = now - hours * 3600
+        shards = self._locked(iban)
+        try:
+            acc = self._shard(iban).accounts.get(iban) or _Account()
+            return mule.stats_dict(iban, hours, acc.in_sources.count(since), acc.in_events.count(since, now),
+                                   acc.out_dests.count(since), acc.out_events.count(since, now),
+                                   acc.in_sources.top(mule.RECENT, since), acc.out_dests.top(mule.RECENT, since))
+        finally:
+            self._release(shards)
+
+    def mule_ibans(self) -> Iterable[str]:
+        for s in self._shards:
+            with s.lock:
+                ibans = [iban for iban, acc in s.accounts.items() if acc.in_sources]
+            yield from ibans
+
+    def mule_top(self, limit: int) -> List[Tuple[str, float]]:
+        with self._board_lock:
+            return [(m, self._board.scores[m]) for m in self._board.top(limit)]
+
+    def mule_decay(self, hours: int, now: float, ibans: Optional[Iterable[str]] = None) -> int:
+        if ibans is None:
+            with self._board_lock:
+                ibans = list(self._board.scores)
+        since = now - hours * 3600
+        done = 0
+        for iban in ibans:
+            shards = self._locked(iban)
+            try:
+                self._refresh(iban, since, now)
+            finally:
+                self._release(shards)
+            done += 1
+        return done
+
+    def mule_compact(self, now: float) -> Dict:
+        out = {"keys": 0, "removed": 0, "deleted": 0, "ids": 0}  # fără dicționar de id-uri (sys.intern)
+        for s in self._shards:
+            with s.lock:
+                out["keys"] += len(s.accounts)
+                removed, deleted = self._sweep(s, now)
+            out["removed"] += removed
+            out["deleted"] += deleted
+        return out
+
+    def mule_usage(self, sample: int) -> Dict:
+        """Numărători exacte (fără HLL și fără măsurarea memoriei Python)."""
+        out = {f: {"keys": 0, "members": 0, "bytes": None} for f in (*mule.ZSET_FAMILIES, *mule.HLL_FAMILIES)}
+        for s in self._shards:
+            with s.lock:
+                for acc in s.accounts.values():
+                    for f in mule.ZSET_FAMILIES:
+                        n = len(getattr(acc, f))
+                        if n:
+                            out[f]["keys"] += 1
+                            out[f]["members"] += n
+        with self._board_lock:
+            out["leaderboard"] = {"keys": int(len(self._board) > 0), "members": len(self._board), "bytes": None}
+        out["iban_ids"] = {"keys": 0, "members": 0, "bytes": None}
+        return out
+
+    def watchlist_add(self, iban: str) -> None:
+        with self._watch_lock:
+            self._watchlist = self._watchlist | {iban.upper()}
+
+    def watchlist_remove(self, iban: str) -> None:
+        with self._watch_lock:
+            self._watchlist = self._watchlist - {iban.upper()}
+
+    def watchlist_list(self) -> List[str]:
+        return sorted(self._watchlist)
+
+    def watchlist_contains(self, iban: str) -> bool:
+        return iban.upper() in self._watchlist
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "shards": len(self._shards),
+            "accounts": sum(len(s.accounts) for s in self._shards),
+            "watchlist": len(self._watchlist),
+            "leaderboard": len(self._board),
+            "sweeps": self.sweeps,
+            "evicted": self.evicted,
+        }
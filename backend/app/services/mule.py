@@ -1,31 +1,63 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
+import itertools
+import os
 import time
-from typing import Dict, List, Tuple, Optional
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Sequence, Tuple, Optional
 
-# Redis client îl primim din deps (get_redis)
-# În velocity probabil îl folosești deja; dacă nu, poți face un Redis(host=..., port=...) aici.
+from app.services import hll, iban_ids
+
+# Stocarea e a state store-ului (STATE_BACKEND); funcțiile queue_* / parse_* de mai jos
+# sunt implementarea Redis (pipeline), folosită de RedisStateStore.
 
 PREFIX = "mule"  # cheie de prefix în Redis
+DEFAULT_HOURS = 24  # fereastra folosită la scoring
+MAX_HOURS = 168     # fereastra maximă de interogare (/mule/{iban}?hours=)
+# Cheile ZSET mule primesc EXPIRE la fiecare scriere (un IBAN inactiv dispare singur), iar
+# jobul de compactare (mule_decay.py) taie membrii mai vechi decât atât și pune TTL pe
+# cheile scrise fără el; aliniat la fereastra maximă de interogare.
+MULE_KEY_TTL_SEC = int(os.getenv("MULE_KEY_TTL_SEC", str(MAX_HOURS * 3600)))
+ZSET_FAMILIES = ("in_sources", "in_events", "out_dests", "out_events")
+HLL_FAMILIES = ("in_hll", "out_hll")
+RECENT = 5          # câte surse/destinații recente întoarcem
+# ZSET IBAN -> mule_score curent (fereastra DEFAULT_HOURS), actualizat la fiecare plată pentru
+# destinație și sursă; scorurile care scad doar prin trecerea timpului le recalculează jobul
+# de decay (mule_decay.py). /mule/top = un ZREVRANGE, indiferent câte IBAN-uri am văzut.
+LEADERBOARD = f"{PREFIX}:leaderboard"
+# DISTINCT_COUNT_MODE=hll: fan-in/fan-out din două HLL-uri rolling pe fereastra de scoring
+# (vezi hll.py), indiferent de `hours` cerut (tx_in / tx_out rămân exacte pe `hours`);
+# ZSET-urile in_sources/out_dests păstrează doar ultimele RECENT intrări
+HLL_WINDOW_SEC = DEFAULT_HOURS * 3600
 
 def _now() -> float:
     return time.time()
 
-def _to_epoch(ts_iso: str) -> float:
+def to_epoch(ts) -> float:
     """
-    Acceptă timestamp ISO8601 (ex: '2025-09-06T12:00:00Z') sau '' și întoarce epoch sec.
-    Dacă nu primește nimic, folosește time.time().
+    Acceptă datetime (naiv = UTC, ca PaymentIn.ts), timestamp ISO8601 (ex: '2025-09-06T12:00:00Z')
+    sau '' și întoarce epoch sec. Dacă nu primește nimic, folosește time.time().
     """
-    if not ts_iso:
+    if not ts:
         return _now()
+    if isinstance(ts, datetime):
+        return (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).timestamp()
     try:
         # format simplu: 'YYYY-MM-DDTHH:MM:SSZ'
-        from datetime import datetime, timezone
-        dt = datetime.strptime(ts_iso.replace("Z",""), "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+        dt = datetime.strptime(ts.replace("Z",""), "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
         return dt.timestamp()
     except Exception:
         return _now()
 
+# Membrii in_events / out_events sunt "<ts>:<iban>:<eid>": fără eid, plățile repetate
+# src -> dst cu același ts (ex. un burst pe /scorePayments) ar fi un singur membru ZSET și
+# tx_in / tx_out ar număra mai puțin. eid = prefix aleator per proces (worker) + contor.
+_EVENT_TAG = os.urandom(3).hex()
+_event_seq = itertools.count()
+
+def event_id() -> str:
+    return f"{_EVENT_TAG}{next(_event_seq):x}"
+
 def _k_in_sources(iban: str) -> str:
     return f"{PREFIX}:in_sources:{iban}"   # ZSET (member = src_iban, score = last_ts)
 
@@ -38,50 +70,197 @@ def _k_out_dests(iban: str) -> str:
 def _k_out_events(iban: str) -> str:
     return f"{PREFIX}:out_events:{iban}"   # ZSET (member = unique_id/ts, score = ts)
 
-def record_payment(rds, *, ts_iso: str, src_iban: str, dst_iban: str) -> None:
+def _k_in_hll(iban: str) -> str:
+    return f"{PREFIX}:in_hll:{iban}"       # prefix HLL-uri cu sursele (hll.window_keys)
+
+def _k_out_hll(iban: str) -> str:
+    return f"{PREFIX}:out_hll:{iban}"      # prefix HLL-uri cu destinațiile (hll.window_keys)
+
+def keys_for(iban: str) -> Dict[str, str]:
+    return {
+        "in_sources": _k_in_sources(iban),
+        "in_events": _k_in_events(iban),
+        "out_dests": _k_out_dests(iban),
+        "out_events": _k_out_events(iban),
+        "in_hll": _k_in_hll(iban),
+        "out_hll": _k_out_hll(iban),
+    }
+
+def hll_keys(iban: str, now: float) -> List[str]:
+    """in_hll cur/prev + out_hll cur/prev pe fereastra HLL_WINDOW_SEC la `now`."""
+    return [*hll.window_keys(_k_in_hll(iban), HLL_WINDOW_SEC, now),
+            *hll.window_keys(_k_out_hll(iban), HLL_WINDOW_SEC, now)]
+
+def key_list(iban: str, now: float) -> List[str]:
+    """Cheile unui IBAN în ordinea fixă folosită de scripturile Lua (KEYS[first..first+7])."""
+    k = keys_for(iban)
+    return [k["in_sources"], k["in_events"], k["out_dests"], k["out_events"], *hll_keys(iban, now)]
+
+# Funcții Lua partajate de scripturile mule (record / decay) și de scriptul de stare.
+# mule_rank pune IBAN-ul în leaderboard cu scorul curent (aceeași formulă ca stats_dict) sau
+# îl scoate dacă nu mai are fan-in în fereastră; mule_refresh face numărătorile pe fereastră
+# pentru KEYS[first..first+7] (key_list), cu ZCOUNT de la `since` (nu șterge nimic: datele
+# expiră doar prin compactare / TTL), și apoi mule_rank; mule_members dă membrii plății
+# (IBAN-uri sau id-uri cu intern=true) și evenimentele "<ts>:<membru>:<eid>".
+# Necesită hll.HLL_LUA_FN și iban_ids.IBAN_LUA_FN.
+MULE_LUA_FN = """
+local function mule_members(ids, names, ts, src, dst, intern, eid, gen)
+  if intern then
+    src, dst = iban_id(ids, names, src, gen), iban_id(ids, names, dst, gen)
+  end
+  return src, dst, ts .. ':' .. src .. ':' .. eid, ts .. ':' .. dst .. ':' .. eid
+end
+
+local function mule_rank(board, iban, fan_in, tx_in, fan_out)
+  local score = math.min(100, math.min(60, fan_in * 10) + math.min(30, tx_in * 2) + math.min(10, fan_out * 2))
+  if fan_in > 0 and score > 0 then
+    redis.call('ZADD', board, score, iban)
+  else
+    redis.call('ZREM', board, iban)
+  end
+  return score
+end
+
+local function mule_refresh(first, board, iban, since, now, use_hll, sec)
+  local fan_in, fan_out
+  if use_hll then
+    fan_in = hll_count(KEYS[first + 4], KEYS[first + 5], now, sec)
+    fan_out = hll_count(KEYS[first + 6], KEYS[first + 7], now, sec)
+  else
+    fan_in = redis.call('ZCOUNT', KEYS[first], since, '+inf')
+    fan_out = redis.call('ZCOUNT', KEYS[first + 2], since, '+inf')
+  end
+  return mule_rank(board, iban, fan_in, redis.call('ZCOUNT', KEYS[first + 1], since, now), fan_out)
+end
+"""
+
+# KEYS: 1 leaderboard  2-9 key_list(dst)  10-17 key_list(src)  18-19 iban_ids.keys()
+# ARGV: 1 ts  2 src_iban  3 dst_iban  4 now  5 since
+#       6 hll (0/1)  7 hll_window_sec  8 recent  9 key_ttl  10 intern (0/1)  11 event_id()
+#       12 iban_ids.gen(now)
+MULE_RECORD_LUA = hll.HLL_LUA_FN + iban_ids.IBAN_LUA_FN + MULE_LUA_FN + """
+local ts, now, since = tonumber(ARGV[1]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local use_hll, sec = ARGV[6] == '1', tonumber(ARGV[7])
+local src, dst, in_event, out_event = mule_members(KEYS[18], KEYS[19], ARGV[1], ARGV[2], ARGV[3], ARGV[10] == '1', ARGV[11], ARGV[12])
+redis.call('ZADD', KEYS[2], ts, src)
+redis.call('ZADD', KEYS[3], ts, in_event)
+redis.call('ZADD', KEYS[12], ts, dst)
+redis.call('ZADD', KEYS[13], ts, out_event)
+for _, i in ipairs({2, 3, 12, 13}) do
+  redis.call('EXPIRE', KEYS[i], ARGV[9])
+end
+if use_hll then
+  hll_add(KEYS[6], KEYS[7], ts, src, now, sec)
+  hll_add(KEYS[16], KEYS[17], ts, dst, now, sec)
+  redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -(tonumber(ARGV[8]) + 1))
+  redis.call('ZREMRANGEBYRANK', KEYS[12], 0, -(tonumber(ARGV[8]) + 1))
+end
+mule_refresh(2, KEYS[1], ARGV[3], since, now, use_hll, sec)
+mule_refresh(10, KEYS[1], ARGV[2], since, now, use_hll, sec)
+"""
+
+# KEYS: 1 leaderboard, apoi câte 8 chei (key_list) per IBAN
+# ARGV: 1 now  2 since  3 hll (0/1)  4 hll_window_sec  5.. IBAN-urile
+MULE_DECAY_LUA = hll.HLL_LUA_FN + iban_ids.IBAN_LUA_FN + MULE_LUA_FN + """
+local now, since, use_hll, sec = tonumber(ARGV[1]), tonumber(ARGV[2]), ARGV[3] == '1', tonumber(ARGV[4])
+for i = 5, #ARGV do
+  mule_refresh(2 + 8 * (i - 5), KEYS[1], ARGV[i], since, now, use_hll, sec)
+end
+return #ARGV - 4
+"""
+
+# Compactare: taie membrii cu scor <= cutoff; cheia goală dispare (Redis o șterge), iar
+# celor rămase fără TTL (scrise înainte de MULE_KEY_TTL_SEC) le punem unul.
+# KEYS: ZSET-uri mule  ARGV: 1 cutoff  2 key_ttl  ->  {membri șterși, chei șterse}
+MULE_COMPACT_LUA = """
+local removed, deleted = 0, 0
+for _, k in ipairs(KEYS) do
+  removed = removed + redis.call('ZREMRANGEBYSCORE', k, 0, ARGV[1])
+  if redis.call('EXISTS', k) == 0 then
+    deleted = deleted + 1
+  elseif redis.call('TTL', k) == -1 then
+    redis.call('EXPIRE', k, ARGV[2])
+  end
+end
+return {removed, deleted}
+"""
+
+def _store():
+    from app.services import state_store
+    return state_store.get()
+
+def record_payment(*, ts_iso: str, src_iban: str, dst_iban: str) -> None:
     """
     Înregistrează tranzacția în "radarul" de mule.
-    Folosește ZSET-uri pt. a păstra doar ultimele `window_sec` la citire (pruning la read).
+    Citirile numără doar fereastra cerută; datele vechi le taie compactarea (MULE_KEY_TTL_SEC).
     """
-    ts = _to_epoch(ts_iso)
-    # fan-in pentru destinație
-    rds.zadd(_k_in_sources(dst_iban), {src_iban: ts})           # last seen per sursă
-    rds.zadd(_k_in_events(dst_iban), {f"{ts}:{src_iban}": ts})  # evenimente brute
+    _store().mule_record(to_epoch(ts_iso), src_iban, dst_iban)
 
-    # fan-out pentru sursă
-    rds.zadd(_k_out_dests(src_iban), {dst_iban: ts})
-    rds.zadd(_k_out_events(src_iban), {f"{ts}:{dst_iban}": ts})
+def record_script_args(ts: float, src_iban: str, dst_iban: str, now: float) -> Tuple[List[str], List]:
+    """KEYS/ARGV pentru MULE_RECORD_LUA (plata + leaderboard pentru destinație și sursă)."""
+    return ([LEADERBOARD, *key_list(dst_iban, now), *key_list(src_iban, now), *iban_ids.keys()],
+            [ts, src_iban, dst_iban, now, now - DEFAULT_HOURS * 3600,
+             int(hll.enabled()), HLL_WINDOW_SEC, RECENT, MULE_KEY_TTL_SEC,
+             int(iban_ids.enabled()), event_id(), iban_ids.gen(now)])
 
-def _window_prune(rds, key: str, since_ts: float) -> None:
-    # șterge tot ce e mai vechi decât since_ts
-    rds.zremrangebyscore(key, 0, since_ts - 0.0001)
+def decay_script_args(ibans: List[str], hours: int, now: float) -> Tuple[List[str], List]:
+    """KEYS/ARGV pentru MULE_DECAY_LUA (recalculează scorurile din leaderboard pentru `ibans`)."""
+    keys = [LEADERBOARD]
+    for iban in ibans:
+        keys += key_list(iban, now)
+    return keys, [now, now - hours * 3600, int(hll.enabled()), HLL_WINDOW_SEC, *ibans]
 
-def _stats_for_iban(rds, iban: str, hours: int = 24) -> Dict:
+def queue_stats(pipe, iban: str, hours: int, now: float) -> None:
     """
-    Returnează statistici 'ultimele N ore' pentru un IBAN (ca destinație și ca sursă).
+    Pune în pipeline citirile pentru statisticile unui IBAN pe ultimele `hours` ore.
+    Doar citiri (ZCOUNT / ZREVRANGEBYSCORE de la `since`): o fereastră scurtă nu taie
+    evenimentele de care au nevoie leaderboard-ul (DEFAULT_HOURS) sau o fereastră mai lungă.
     """
-    now = _now()
-    window_sec = hours * 3600
-    since = now - window_sec
+    since = now - hours * 3600
+    if hll.enabled():
+        _queue_hll(pipe, _k_in_hll(iban), now)
+    else:
+        pipe.zcount(_k_in_sources(iban), since, "+inf")
+    pipe.zcount(_k_in_events(iban), since, now)
+    if hll.enabled():
+        _queue_hll(pipe, _k_out_hll(iban), now)
+    else:
+        pipe.zcount(_k_out_dests(iban), since, "+inf")
+    pipe.zcount(_k_out_events(iban), since, now)
+    pipe.zrevrangebyscore(_k_in_sources(iban), "+inf", since, start=0, num=RECENT)
+    pipe.zrevrangebyscore(_k_out_dests(iban), "+inf", since, start=0, num=RECENT)
+
+def _queue_hll(pipe, prefix: str, now: float) -> None:
+    cur, prev = hll.window_keys(prefix, HLL_WINDOW_SEC, now)
+    pipe.pfcount(cur)
+    pipe.pfcount(cur, prev)
 
-    # prune pe chei relevante
-    for key in (_k_in_sources(iban), _k_in_events(iban), _k_out_dests(iban), _k_out_events(iban)):
-        _window_prune(rds, key, since)
+def _distinct(results, now: float) -> int:
+    """ZCARD (exact) sau estimarea din cele două PFCOUNT puse de _queue_hll."""
+    if hll.enabled():
+        n_cur = next(results)
+        return hll.estimate(n_cur, next(results), now, HLL_WINDOW_SEC)
+    return next(results)
 
+def parse_stats(iban: str, hours: int, results, now: float) -> Dict:
+    """Construiește dict-ul de statistici din iteratorul de rezultate (ordinea din queue_stats)."""
     # fan-in (câte surse unice au trimis către acest iban)
-    fan_in_unique = rds.zcard(_k_in_sources(iban))
-    tx_in_count   = rds.zcount(_k_in_events(iban), since, now)
+    fan_in_unique = _distinct(results, now)
+    tx_in_count   = next(results)
 
     # fan-out (dacă acest iban a fost sursă către alți destinatari)
-    fan_out_unique = rds.zcard(_k_out_dests(iban))
-    tx_out_count   = rds.zcount(_k_out_events(iban), since, now)
+    fan_out_unique = _distinct(results, now)
+    tx_out_count   = next(results)
 
     # exemple (max 5) – cele mai recente surse/destinații
-    recent_sources = [m.decode() if isinstance(m, bytes) else m
-                      for m in rds.zrevrange(_k_in_sources(iban), 0, 4)]
-    recent_dests = [m.decode() if isinstance(m, bytes) else m
-                    for m in rds.zrevrange(_k_out_dests(iban), 0, 4)]
+    recent_sources = [m.decode() if isinstance(m, bytes) else m for m in next(results)]
+    recent_dests = [m.decode() if isinstance(m, bytes) else m for m in next(results)]
 
+    return stats_dict(iban, hours, fan_in_unique, tx_in_count, fan_out_unique, tx_out_count,
+                       recent_sources, recent_dests)
+
+def stats_dict(iban: str, hours: int, fan_in_unique: int, tx_in_count: int, fan_out_unique: int,
+                tx_out_count: int, recent_sources: List[str], recent_dests: List[str]) -> Dict:
     # scor simplu (tunable): fan-in unic + volum + fan-out
     score = 0
     score += min(60, fan_in_unique * 10)      # 0..60
@@ -101,30 +280,61 @@ def _stats_for_iban(rds, iban: str, hours: int = 24) -> Dict:
         "recent_dests": recent_dests,
     }
 
-def top_suspects(rds, *, hours: int = 24, limit: int = 10) -> List[Dict]:
+def top_suspects(*, hours: int = DEFAULT_HOURS, limit: int = 10) -> List[Dict]:
+    """
+    Cele mai mari scoruri mule pe fereastra de scoring (DEFAULT_HOURS): citim leaderboard-ul
+    (un ZREVRANGE) și calculăm statisticile doar pentru cele `limit` IBAN-uri. Leaderboard-ul
+    există doar pentru fereastra asta; altă fereastră ar însemna o parcurgere a tuturor
+    IBAN-urilor, deci e refuzată (ValueError).
+    """
+    if hours != DEFAULT_HOURS:
+        raise ValueError(f"top suspects are maintained only for hours={DEFAULT_HOURS}")
+    ibans = [iban for iban, _ in leaderboard(limit)]
+    stats = [s for s in _store().mule_stats_many(ibans, hours, _now()) if s["mule_score"] > 0]
+    stats.sort(key=lambda s: s["mule_score"], reverse=True)
+    return stats
+
+def leaderboard(limit: int = 10) -> List[Tuple[str, float]]:
+    """Primele `limit` (iban, scor) din leaderboard (fereastra DEFAULT_HOURS)."""
+    return _store().mule_top(limit)
+
+def decay(hours: int = DEFAULT_HOURS, ibans: Optional[Iterable[str]] = None) -> int:
+    """
+    Recalculează scorurile din leaderboard (numărători pe fereastră) pentru `ibans` sau, implicit,
+    pentru toți membrii lui; cine nu mai are fan-in în fereastră iese din leaderboard.
+    """
+    return _store().mule_decay(hours, _now(), ibans)
+
+def compact() -> Dict:
+    """O trecere de compactare peste toate cheile mule (vezi MULE_COMPACT_LUA)."""
+    return _store().mule_compact(_now())
+
+def job_lock(job: str, ttl_sec: float) -> bool:
+    """Lock între workeri pentru jobul periodic `job` ("decay" / "compact"), valabil `ttl_sec`."""
+    return _store().job_lock(job, max(1, int(ttl_sec * 1000)))
+
+def usage(sample: int = 200) -> Dict:
+    """Chei / membri / memorie per familie de chei mule (estimat din `sample` chei per familie)."""
+    return _store().mule_usage(sample)
+
+def rebuild_leaderboard(hours: int = DEFAULT_HOURS) -> int:
+    """Reface leaderboard-ul din toate IBAN-urile cu plăți primite (date scrise înainte de el)."""
+    store = _store()
+    return store.mule_decay(hours, _now(), store.mule_ibans())
+
+def stats_for_iban(iban: str, hours: int = 24) -> Dict:
+    """Statistici 'ultimele N ore' pentru un IBAN (ca destinație și ca sursă)."""
+    return _store().mule_stats(iban, hours, _now())
+
+def stats_for_ibans(ibans: Sequence[str], hours: int = 24) -> List[Dict]:
     """
-    Scanează toate cheile de tip in_sources și calculează scorul curent pentru fiecare IBAN.
-    Pentru demo este suficient (date moderate). Dacă devine mare, se poate menține un "leaderboard".
+    Ca stats_for_iban, pentru o listă (ex. toate contrapărțile de pe o pagină de alerte):
+    o singură trecere prin store (în Redis, un pipeline), rezultate în ordinea din `ibans`.
     """
-    pattern = f"{PREFIX}:in_sources:*"
-    cursor = 0
-    ibans = []
-    while True:
-        cursor, keys = rds.scan(cursor=cursor, match=pattern, count=200)
-        for k in keys:
-            k_str = k.decode() if isinstance(k, bytes) else k
-            ibans.append(k_str.split(":")[-1])
-        if cursor == 0:
-            break
-
-    # calculează scorul pentru fiecare și sortează
-    scored: List[Tuple[int, Dict]] = []
-    for iban in set(ibans):
-        stats = _stats_for_iban(rds, iban, hours=hours)
-        if stats["mule_score"] > 0:
-            scored.append((stats["mule_score"], stats))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [s for _, s in scored[:limit]]
-
-def stats_for_iban(rds, iban: str, hours: int = 24) -> Dict:
-    return _stats_for_iban(rds, iban, hours=hours)
+    unique = list(dict.fromkeys(ibans))
+    by_iban = dict(zip(unique, _store().mule_stats_many(unique, hours, _now())))
+    return [by_iban[iban] for iban in ibans]
+
+async def stats_for_iban_async(iban: str, hours: int = 24) -> Dict:
+    """Ca stats_for_iban, pe calea async a store-ului."""
+    return await _store().mule_stats_async(iban, hours, _now())
@@ -0,0 +1,135 @@
+# backend/app/services/mule_decay.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from app.services import mule
+
+log = logging.getLogger(__name__)
+
+# Întreținerea stării mule, pe măsură ce datele ies din ferestre:
+#  - decay (MULE_DECAY_SEC, 0 = dezactivat): leaderboard-ul se actualizează la fiecare plată,
+#    dar un scor scade și fără plăți noi. Jobul recalculează periodic membrii leaderboard-ului,
+#    în loturi de MULE_DECAY_CHUNK IBAN-uri per EVALSHA; costul e proporțional cu numărul de
+#    suspecți activi, nu cu toate IBAN-urile văzute. La pornire, dacă leaderboard-ul e gol
+#    (ex. date scrise înainte de el), îl reface o dată din toate IBAN-urile cu plăți primite.
+#  - compactare (MULE_COMPACT_SEC, 0 = dezactivat): SCAN peste cheile ZSET mule, taie membrii
+#    mai vechi decât MULE_KEY_TTL_SEC și pune TTL pe cheile fără expirare. EXPIRE-ul de la
+#    scriere acoperă IBAN-urile inactive; compactarea le acoperă pe cele scrise des, care
+#    altfel ar ține evenimente vechi până la următoarea citire. Tot aici se curăță dicționarul
+#    de id-uri IBAN (iban_ids.sweep) de IBAN-urile care nu mai pot apărea în nicio structură.
+# Fiecare worker uvicorn pornește buclele, dar o trecere rulează doar în workerul care ia
+# lock-ul jobului pe interval (mule.job_lock: în Redis SET NX PX); ceilalți o sar ("skipped").
+# Cu STATE_BACKEND=memory starea e per proces, deci fiecare worker își rulează joburile.
+MULE_DECAY_SEC = float(os.getenv("MULE_DECAY_SEC", "60"))
+MULE_COMPACT_SEC = float(os.getenv("MULE_COMPACT_SEC", "3600"))
+
+
+class MuleDecay:
+    def __init__(self, interval_sec: float = MULE_DECAY_SEC, compact_sec: float = MULE_COMPACT_SEC):
+        self.interval_sec = interval_sec
+        self.compact_sec = compact_sec
+        self._tasks: List[asyncio.Task] = []
+        self._counters = {"runs": 0, "ibans": 0, "errors": 0, "rebuilt": 0,
+                          "compactions": 0, "compacted_members": 0, "compacted_keys": 0,
+                          "compacted_ids": 0, "skipped": 0}
+        self._last_ms = 0.0
+        self._last_compact_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return any(not t.done() for t in self._tasks)
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        if self.interval_sec > 0:
+            self._tasks.append(asyncio.create_task(self._run(), name="mule-decay"))
+        if self.compact_sec > 0:
+            self._tasks.append(asyncio.create_task(self._run_compact(), name="mule-compact"))
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        for t in self._tasks:
+            try:
+                await t
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def run_once(self) -> int:
+        """O trecere de decay (blocant; jobul o rulează într-un thread)."""
+        t0 = time.perf_counter()
+        n = mule.decay()
+        self._last_ms = (time.perf_counter() - t0) * 1000
+        self._counters["runs"] += 1
+        self._counters["ibans"] += n
+        return n
+
+    def compact_once(self) -> Dict:
+        """O trecere de compactare (blocant)."""
+        t0 = time.perf_counter()
+        out = mule.compact()
+        self._last_compact_ms = (time.perf_counter() - t0) * 1000
+        self._counters["compactions"] += 1
+        self._counters["compacted_members"] += out["removed"]
+        self._counters["compacted_keys"] += out["deleted"]
+        self._counters["compacted_ids"] += out.get("ids", 0)
+        return out
+
+    def _locked(self, job: str, ttl_sec: float) -> bool:
+        if mule.job_lock(job, ttl_sec):
+            return True
+        self._counters["skipped"] += 1
+        return False
+
+    def decay_tick(self) -> Optional[int]:
+        """run_once dacă workerul ia lock-ul de decay pe interval; altfel None (rulează altul)."""
+        return self.run_once() if self._locked("decay", self.interval_sec) else None
+
+    def compact_tick(self) -> Optional[Dict]:
+        """compact_once dacă workerul ia lock-ul de compactare pe interval; altfel None."""
+        return self.compact_once() if self._locked("compact", self.compact_sec) else None
+
+    def _rebuild(self) -> None:
+        # refacerea ține locul unei treceri de decay (același lock)
+        if not mule.leaderboard(1) and self._locked("decay", self.interval_sec):
+            self._counters["rebuilt"] += mule.rebuild_leaderboard()
+
+    async def _run(self) -> None:
+        try:
+            await asyncio.to_thread(self._rebuild)
+        except Exception:
+            self._counters["errors"] += 1
+            log.exception("mule leaderboard rebuild failed")
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            try:
+                await asyncio.to_thread(self.decay_tick)
+            except Exception:
+                self._counters["errors"] += 1
+                log.exception("mule decay failed")
+
+    async def _run_compact(self) -> None:
+        while True:
+            await asyncio.sleep(self.compact_sec)
+            try:
+                await asyncio.to_thread(self.compact_tick)
+            except Exception:
+                self._counters["errors"] += 1
+                log.exception("mule compaction failed")
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.running,
+            "interval_sec": self.interval_sec,
+            "compact_sec": self.compact_sec,
+            "last_ms": round(self._last_ms, 2),
+            "last_compact_ms": round(self._last_compact_ms, 2),
+            **self._counters,
+        }
@@ -1,17 +1,343 @@
-import networkx as nx
+# backend/app/services/mule_graph.py
+from __future__ import annotations
 
-G = nx.DiGraph()
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+# Graful tranzacțiilor pe o fereastră de timp, în proces, pentru semnale mule de mai multe
+# hop-uri (mule.py vede doar fan-in / fan-out direct):
+#   - pass-through: bani intrați în X și ieșiți din X în cel mult N minute
+#   - lanțuri de layering X -> a -> b (-> c), fiecare hop în cel mult N minute după precedentul
+#   - cicluri scurte prin X
+#
+# Structura (fără networkx): IBAN-urile primesc id-uri întregi; muchiile sunt coloane
+# array (src, dst, bucket, count, amount, first_ts, last_ts), iar fiecare nod are câte un
+# array cu id-urile muchiilor de ieșire / intrare. Plățile aceleiași perechi în același bucket
+# de MULE_GRAPH_BUCKET_SEC se adună pe aceeași muchie. Muchiile mai vechi decât fereastra
+# (MULE_GRAPH_WINDOW_SEC) sunt ignorate la citire și eliminate periodic la o reconstruire a
+# coloanelor (amortizat O(1) per plată), odată cu nodurile rămase fără muchii.
+#
+# Graful e per proces (per worker uvicorn). MULE_GRAPH=1 îl alimentează din /scorePayment(s)
+# (cu ts-ul plății) și adaugă semnalele lui în decizie (payment_signals): pass-through la
+# beneficiar sau plătitor, lanțuri de layering și cicluri care pornesc din beneficiar.
+MULE_GRAPH = os.getenv("MULE_GRAPH", "0").lower() in {"1", "true", "yes"}
+MULE_GRAPH_WINDOW_SEC = int(os.getenv("MULE_GRAPH_WINDOW_SEC", "86400"))
+MULE_GRAPH_BUCKET_SEC = int(os.getenv("MULE_GRAPH_BUCKET_SEC", "300"))
+MULE_GRAPH_HOP_SEC = int(os.getenv("MULE_GRAPH_HOP_SEC", "3600"))  # "a ieșit în cel mult N"
+MULE_GRAPH_BRANCH = int(os.getenv("MULE_GRAPH_BRANCH", "32"))       # muchii urmate per nod (cele mai mari)
+MULE_GRAPH_PASS_MIN = float(os.getenv("MULE_GRAPH_PASS_MIN", "1000"))  # RON ieșiți ca să conteze
+MULE_GRAPH_MAX_PATHS = 20
+
+# bump-uri în scorul de reguli pentru payment_signals (plafonat la GRAPH_CAP)
+GRAPH_WEIGHTS = {"pass_through": 15, "chain": 10, "cycle": 10}
+GRAPH_CAP = 25
+
+
+class TxGraph:
+    def __init__(self, window_sec: int = MULE_GRAPH_WINDOW_SEC, bucket_sec: int = MULE_GRAPH_BUCKET_SEC):
+        self.window_sec = window_sec
+        self.bucket_sec = max(1, bucket_sec)
+        self._lock = threading.RLock()
+        self.compactions = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._out: List[array] = []
+        self._in: List[array] = []
+        self._src = array("q")
+        self._dst = array("q")
+        self._bucket = array("q")
+        self._count = array("q")
+        self._amount = array("d")
+        self._first = array("d")
+        self._last = array("d")
+        self._next_compact = 4096
+
+    # ---- scriere ----
+    def _node(self, iban: str) -> int:
+        n = self._ids.get(iban)
+        if n is None:
+            n = self._ids[iban] = len(self._names)
+            self._names.append(iban)
+            self._out.append(array("q"))
+            self._in.append(array("q"))
+        return n
+
+    def add(self, src: str, dst: str, amount: float, ts: Optional[float] = None) -> None:
+        ts = time.time() if ts is None else ts
+        b = int(ts // self.bucket_sec)
+        with self._lock:
+            s, d = self._node(src), self._node(dst)
+            bucket, out = self._bucket, self._out[s]
+            # muchiile bucket-ului curent sunt la coada listei nodului
+            for i in range(len(out) - 1, -1, -1):
+                e = out[i]
+                if bucket[e] != b:
+                    break
+                if self._dst[e] == d:
+                    self._count[e] += 1
+                    self._amount[e] += amount
+                    self._first[e] = min(self._first[e], ts)
+                    self._last[e] = max(self._last[e], ts)
+                    return
+            e = len(self._src)
+            self._src.append(s)
+            self._dst.append(d)
+            self._bucket.append(b)
+            self._count.append(1)
+            self._amount.append(amount)
+            self._first.append(ts)
+            self._last.append(ts)
+            out.append(e)
+            self._in[d].append(e)
+            if e + 1 >= self._next_compact:
+                self._compact(ts)
+
+    def _cutoff(self, now: float) -> int:
+        return int((now - self.window_sec) // self.bucket_sec)
+
+    def _compact(self, now: float) -> None:
+        """Reconstruiește coloanele doar cu muchiile din fereastră (și nodurile lor)."""
+        cut = self._cutoff(now)
+        old = (self._names, self._src, self._dst, self._bucket, self._count, self._amount, self._first, self._last)
+        names, src, dst, bucket, count, amount, first, last = old
+        live = [e for e in range(len(src)) if bucket[e] >= cut]
+        self._reset()
+        for e in live:
+            s, d = self._node(names[src[e]]), self._node(names[dst[e]])
+            n = len(self._src)
+            self._src.append(s)
+            self._dst.append(d)
+            self._bucket.append(bucket[e])
+            self._count.append(count[e])
+            self._amount.append(amount[e])
+            self._first.append(first[e])
+            self._last.append(last[e])
+            self._out[s].append(n)
+            self._in[d].append(n)
+        self._next_compact = max(4096, 2 * len(live))
+        self.compactions += 1
+
+    # ---- citire ----
+    def _live(self, edges: array, cut: int) -> List[int]:
+        bucket = self._bucket
+        return [e for e in edges if bucket[e] >= cut]
+
+    def degrees(self, iban: str, now: Optional[float] = None) -> Dict:
+        """Fan-in / fan-out (contrapărți distincte), nr. plăți și sume în fereastră."""
+        now = time.time() if now is None else now
+        with self._lock:
+            n = self._ids.get(iban)
+            if n is None:
+                return {"fan_in": 0, "fan_out": 0, "tx_in": 0, "tx_out": 0, "amount_in": 0.0, "amount_out": 0.0}
+            cut = self._cutoff(now)
+            ins, outs = self._live(self._in[n], cut), self._live(self._out[n], cut)
+            return {
+                "fan_in": len({self._src[e] for e in ins}),
+                "fan_out": len({self._dst[e] for e in outs}),
+                "tx_in": sum(self._count[e] for e in ins),
+                "tx_out": sum(self._count[e] for e in outs),
+                "amount_in": round(sum((self._amount[e] for e in ins), 0.0), 2),
+                "amount_out": round(sum((self._amount[e] for e in outs), 0.0), 2),
+            }
+
+    def pass_through(self, iban: str, within_sec: float = MULE_GRAPH_HOP_SEC, now: Optional[float] = None) -> Dict:
+        """
+        Banii intrați în `iban` care au o ieșire în cel mult `within_sec` (și ieșirile respective).
+        Cu timpii agregați pe muchie, intrarea i și ieșirea o se potrivesc dacă există
+        t_in în [first_i, last_i] și t_out în [first_o, last_o] cu 0 <= t_out - t_in <= within_sec.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            n = self._ids.get(iban)
+            if n is None:
+                return {"amount_in": 0.0, "amount_out": 0.0, "sources": [], "dests": []}
+            cut = self._cutoff(now)
+            first, last, amount = self._first, self._last, self._amount
+            ins, outs = self._live(self._in[n], cut), self._live(self._out[n], cut)
+            # intrarea i are o ieșire potrivită <=> max(last_o, first_o <= last_i + within) >= first_i
+            outs.sort(key=first.__getitem__)
+            out_first = [first[e] for e in outs]
+            out_max_last = _running_max(last[e] for e in outs)
+            ins_hit = [e for e in ins if _any_upto(out_first, out_max_last, last[e] + within_sec, first[e])]
+            # simetric: ieșirea o are o intrare cu first_i <= last_o și last_i >= first_o - within
+            ins.sort(key=first.__getitem__)
+            in_first = [first[e] for e in ins]
+            in_max_last = _running_max(last[e] for e in ins)
+            outs_hit = [e for e in outs if _any_upto(in_first, in_max_last, last[e], first[e] - within_sec)]
+            return {
+                "amount_in": round(sum((amount[e] for e in ins_hit), 0.0), 2),
+                "amount_out": round(sum((amount[e] for e in outs_hit), 0.0), 2),
+                "sources": self._top(ins_hit, self._src),
+                "dests": self._top(outs_hit, self._dst),
+            }
+
+    def _top(self, edges: List[int], ends: array, limit: int = 5) -> List[str]:
+        by_node: Dict[int, float] = {}
+        for e in edges:
+            by_node[ends[e]] = by_node.get(ends[e], 0.0) + self._amount[e]
+        top = sorted(by_node.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        return [self._names[node] for node, _ in top]
+
+    def _branches(self, node: int, cut: int) -> List[int]:
+        edges = self._live(self._out[node], cut)
+        if len(edges) > MULE_GRAPH_BRANCH:
+            edges = sorted(edges, key=self._amount.__getitem__, reverse=True)[:MULE_GRAPH_BRANCH]
+        return edges
+
+    def chains(self, iban: str, hops: int = 3, within_sec: float = MULE_GRAPH_HOP_SEC,
+               now: Optional[float] = None, limit: int = MULE_GRAPH_MAX_PATHS) -> List[Dict]:
+        """
+        Lanțuri X -> a -> b (...) de 2..hops muchii în care fiecare hop pleacă în cel mult
+        `within_sec` după ce banii au ajuns în nod (layering). `amount` = minimul pe lanț.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            start = self._ids.get(iban)
+            if start is None:
+                return []
+            cut = self._cutoff(now)
+            first, last, amount, dst = self._first, self._last, self._amount, self._dst
+            found: List[Tuple[float, List[int], float, float]] = []
+
+            def walk(node: int, path: List[int], lo: float, hi: float, flow: float, t0: float) -> None:
+                for e in self._branches(node, cut):
+                    nxt = dst[e]
+                    if nxt in path or last[e] < lo or first[e] > hi + within_sec:
+                        continue
+                    f = min(flow, amount[e])
+                    if len(path) >= 2:
+                        found.append((f, path + [nxt], t0, last[e]))
+                    if len(path) < hops:
+                        walk(nxt, path + [nxt], max(lo, first[e]), last[e], f, t0)
+                    if len(found) >= limit * 4:
+                        return
+
+            for e in self._branches(start, cut):
+                if dst[e] != start and len(found) < limit * 4:
+                    walk(dst[e], [start, dst[e]], first[e], last[e], amount[e], first[e])
+            found.sort(key=lambda x: (len(x[1]), x[0]), reverse=True)
+            return [{"path": [self._names[n] for n in p], "amount": round(f, 2), "span_sec": round(max(0.0, t1 - t0), 1)}
+                    for f, p, t0, t1 in found[:limit]]
+
+    def cycles(self, iban: str, max_len: int = 4, now: Optional[float] = None,
+               limit: int = MULE_GRAPH_MAX_PATHS) -> List[Dict]:
+        """Cicluri simple X -> ... -> X de 2..max_len muchii în fereastră (fără ordine în timp)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            start = self._ids.get(iban)
+            if start is None:
+                return []
+            cut = self._cutoff(now)
+            amount, src, dst = self._amount, self._src, self._dst
+            # ultimul hop se închide direct pe predecesorii lui X (un nivel de DFS mai puțin)
+            preds: Dict[int, float] = {}
+            for e in self._live(self._in[start], cut):
+                preds[src[e]] = max(preds.get(src[e], 0.0), amount[e])
+            found: List[Tuple[float, List[int]]] = []
+
+            def walk(node: int, path: List[int], flow: float) -> None:
+                for e in self._branches(node, cut):
+                    nxt, f = dst[e], min(flow, amount[e])
+                    if nxt == start or nxt in path:
+                        continue
+                    if nxt in preds:
+                        found.append((min(f, preds[nxt]), path + [nxt, start]))
+                    if len(path) < max_len - 1:
+                        walk(nxt, path + [nxt], f)
+                    if len(found) >= limit * 4:
+                        return
+
+            walk(start, [start], float("inf"))
+            found.sort(key=lambda x: x[0], reverse=True)
+            return [{"path": [self._names[n] for n in p], "amount": round(f, 2)} for f, p in found[:limit]]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            columns = (self._src, self._dst, self._bucket, self._count, self._amount, self._first, self._last)
+            adjacency = sum(a.itemsize * len(a) for a in (*self._out, *self._in))
+            return {
+                "nodes": len(self._names),
+                "edges": len(self._src),
+                "window_sec": self.window_sec,
+                "bucket_sec": self.bucket_sec,
+                "compactions": self.compactions,
+                "array_bytes": sum(a.itemsize * len(a) for a in columns) + adjacency,
+            }
+
+
+def _running_max(values) -> List[float]:
+    out, m = [], float("-inf")
+    for v in values:
+        m = max(m, v)
+        out.append(m)
+    return out
+
+
+def _any_upto(keys: List[float], running_max: List[float], key_max: float, threshold: float) -> bool:
+    """Există un element cu key <= key_max și valoare >= threshold? (keys sortate, running_max pe ele)"""
+    i = bisect_right(keys, key_max)
+    return i > 0 and running_max[i - 1] >= threshold
+
+
+G = TxGraph()
+
+
+def update_graph(src: str, dst: str, amount: float, ts: Optional[float] = None):
+    G.add(src, dst, amount, ts)
 
-def update_graph(src: str, dst: str, amount: float):
-    G.add_node(src)
-    G.add_node(dst)
-    G.add_edge(src, dst, amount=amount)
 
 def mule_risk(iban: str) -> int:
-    fan_in = G.in_degree(iban)
-    fan_out = G.out_degree(iban)
+    d = G.degrees(iban)
+    fan_in, fan_out = d["fan_in"], d["fan_out"]
     if fan_in >= 5 and fan_out >= 5:
         return 85
     if fan_in >= 3 and fan_out >= 1:
         return 60
     return 20
+
+
+def payment_signals(src: str, dst: str, now: Optional[float] = None,
+                    within_sec: float = MULE_GRAPH_HOP_SEC) -> Tuple[int, List[str]]:
+    """
+    (score, reasons) din graf pentru o plată src -> dst, înainte ca plata să intre în graf.
+    Caută doar drumuri scurte (lanțuri de 2 hop-uri, cicluri de cel mult 3) ca să rămână
+    ieftin pe calea de scoring; /mule/graph/{iban} dă analiza completă.
+    """
+    score, reasons = 0, []
+    for role, iban in (("beneficiary", dst), ("payer", src)):
+        pt = G.pass_through(iban, within_sec, now)
+        if pt["amount_out"] >= MULE_GRAPH_PASS_MIN:
+            score += GRAPH_WEIGHTS["pass_through"]
+            reasons.append(f"MuleGraph: {role} forwarded {pt['amount_out']:.0f} RON within "
+                           f"{within_sec / 60:.0f} min (+{GRAPH_WEIGHTS['pass_through']})")
+            break
+    chain = G.chains(dst, hops=2, within_sec=within_sec, now=now, limit=1)
+    if chain:
+        score += GRAPH_WEIGHTS["chain"]
+        reasons.append(f"MuleGraph: layering {' -> '.join(chain[0]['path'])} (+{GRAPH_WEIGHTS['chain']})")
+    cycle = G.cycles(dst, max_len=3, now=now, limit=1)
+    if cycle:
+        score += GRAPH_WEIGHTS["cycle"]
+        reasons.append(f"MuleGraph: cycle {' -> '.join(cycle[0]['path'])} (+{GRAPH_WEIGHTS['cycle']})")
+    return min(score, GRAPH_CAP), reasons
+
+
+def analyze(iban: str, hops: int = 3, within_sec: float = MULE_GRAPH_HOP_SEC) -> Dict:
+    """Toate semnalele de graf pentru un IBAN (endpoint-ul /mule/graph/{iban})."""
+    return {
+        "iban": iban,
+        "window_sec": G.window_sec,
+        "within_sec": within_sec,
+        "mule_risk": mule_risk(iban),
+        **G.degrees(iban),
+        "pass_through": G.pass_through(iban, within_sec),
+        "chains": G.chains(iban, hops, within_sec),
+        "cycles": G.cycles(iban, max_len=hops + 1),
+    }
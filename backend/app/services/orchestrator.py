@@ -0,0 +1,64 @@
+# backend/app/services/orchestrator.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# Bugetul de latență pentru semnale (ms). Ce nu termină în buget e marcat "unavailable".
+SCORING_BUDGET_MS = float(os.getenv("SCORING_BUDGET_MS", "50"))
+SCORING_BATCH_BUDGET_MS = float(os.getenv("SCORING_BATCH_BUDGET_MS", "1000"))
+
+# nume stagiu -> eticheta din `reasons`
+STAGE_LABELS = {
+    "cop": "CoP",
+    "mule": "MuleRadar",
+    "watchlist": "Watchlist",
+    "velocity": "Velocity",
+    "ml": "ML",
+}
+
+# stagii compuse: un singur apel care acoperă mai multe semnale (ex. scriptul Lua de stare)
+STAGE_GROUPS = {
+    "state": ("mule", "watchlist", "velocity"),
+}
+
+
+async def run_stages(stages: Dict[str, Awaitable[Any]], budget_ms: Optional[float] = None
+                     ) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Pornește toate stagiile independente concurent și le colectează până la deadline.
+    Întoarce (results, unavailable):
+      - results: {nume: rezultat} pentru stagiile terminate cu succes în buget
+      - unavailable: stagiile care au depășit bugetul sau au aruncat excepție
+    Stagiile rămase după deadline sunt anulate (decizia nu le mai așteaptă).
+    """
+    budget = SCORING_BUDGET_MS if budget_ms is None else budget_ms
+    tasks = {name: asyncio.ensure_future(aw) for name, aw in stages.items()}
+    if not tasks:
+        return {}, []
+
+    done, pending = await asyncio.wait(tasks.values(), timeout=budget / 1000.0)
+    for t in pending:
+        t.cancel()
+
+    results: Dict[str, Any] = {}
+    unavailable: List[str] = []
+    for name, t in tasks.items():
+        if t not in done:
+            log.warning("stage %s missed the %.0f ms budget", name, budget)
+            unavailable.append(name)
+        elif t.exception() is not None:
+            log.warning("stage %s failed: %r", name, t.exception())
+            unavailable.append(name)
+        else:
+            results[name] = t.result()
+    return results, unavailable
+
+
+def unavailable_reasons(names: List[str]) -> List[str]:
+    expanded = [m for n in names for m in STAGE_GROUPS.get(n, (n,))]
+    return [f"{STAGE_LABELS.get(n, n)}: unavailable" for n in expanded]
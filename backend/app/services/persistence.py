@@ -0,0 +1,97 @@
+# backend/app/services/persistence.py
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models import Transaction
+from app.schemas import PaymentIn
+from app.services.account_cache import account_cache
+
+
+def resolve_accounts(db: Session, src_ibans: Iterable[str], dst_ibans: Iterable[str]) -> Dict[str, int]:
+    """
+    Întoarce {iban: account_id} prin cache-ul de conturi (DB doar pentru ce lipsește).
+    Conturile sursă lipsă sunt create (sub clientul demo); destinațiile doar se caută.
+    """
+    ids = account_cache.ensure_ids(db, src_ibans)
+    ids.update(account_cache.ids_for(db, (iban for iban in dst_ibans if iban not in ids)))
+    return ids
+
+
+def _naive_utc(ts: datetime) -> datetime:
+    # coloana e TIMESTAMP (fără tz); asyncpg refuză datetime-uri cu tzinfo
+    if ts.tzinfo is None:
+        return ts
+    return ts.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def transaction_row(p: PaymentIn, account_ids: Dict[str, int], score: float, action: str,
+                    reasons: List[str]) -> Dict:
+    """Rândul `transactions` pentru o plată scorată (dict pentru insert bulk)."""
+    return {
+        "ts": _naive_utc(p.ts),
+        "src_account_id": account_ids.get(p.src_account_iban),
+        "dst_account_id": account_ids.get(p.dst_account_iban),
+        "dst_iban": p.dst_account_iban,
+        "amount_cents": int(round(p.amount * 100)),
+        "currency": p.currency,
+        "channel": p.channel,
+        "is_first_to_payee": p.is_first_to_payee,
+        "device_fp": p.device_fp,
+        "risk_score": score,
+        "risk_reasons": reasons,
+        "action": action,
+        "description": p.description,
+    }
+
+
+def persist_transactions(db: Session, payments: Sequence[PaymentIn],
+                         decisions: Sequence[Tuple[float, str, List[str]]]) -> None:
+    """
+    Persistă plățile scorate: lookup-ul conturilor pentru tot lotul dintr-o dată,
+    un singur INSERT multi-row în `transactions` și un singur commit.
+    `decisions[i]` = (risk_score, action, reasons) pentru `payments[i]`.
+    """
+    if not payments:
+        return
+    try:
+        account_ids = resolve_accounts(
+            db,
+            (p.src_account_iban for p in payments),
+            (p.dst_account_iban for p in payments),
+        )
+        rows = [transaction_row(p, account_ids, score, action, reasons)
+                for p, (score, action, reasons) in zip(payments, decisions)]
+        db.execute(insert(Transaction), rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        account_cache.discard_created(db)
+        raise
+    db.info.pop("created_ibans", None)
+    db.info.pop("created_demo_customer", None)
+
+
+async def persist_transactions_async(db: AsyncSession, payments: Sequence[PaymentIn],
+                                     decisions: Sequence[Tuple[float, str, List[str]]]) -> None:
+    """Ca persist_transactions, pe o sesiune async (I/O-ul nu blochează event loop-ul)."""
+    await db.run_sync(persist_transactions, payments, decisions)
+
+
+def set_label(txn: Transaction, label: int, source: str) -> None:
+    """
+    Eticheta de antrenare (1 scam, 0 legit) pe o tranzacție existentă.
+    Decizia analistului are prioritate: un quiz ulterior nu o suprascrie.
+    labeled_at se actualizează la fiecare schimbare, deci rândul intră și în
+    următorul antrenament incremental (watermark pe labeled_at, id).
+    """
+    if source == "quiz" and txn.label_source == "analyst":
+        return
+    txn.label = label
+    txn.label_source = source
+    txn.labeled_at = datetime.utcnow()
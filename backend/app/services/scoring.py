@@ -1,4 +1,4 @@
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Optional
 
 # Importăm semnalele specifice scam
 from app.services.text_signals import text_risk
@@ -16,12 +16,17 @@ BASE_WEIGHTS = {
     "watchlist": 30,             # destinatar pe watchlist
 }
 
-def score_payment(features: Dict, cop_ok: bool, on_watchlist: bool) -> Tuple[float, str, List[str], int]:
+def score_payment(features: Dict, cop_ok: bool, on_watchlist: bool,
+                  velocity: Optional[Tuple[int, List[str]]] = None,
+                  graph: Optional[Tuple[int, List[str]]] = None) -> Tuple[float, str, List[str], int]:
     """
     Returnează (risk_score, action, reasons, cooloff_minutes)
     Logică orientată pe SCAM:
       - reguli explicabile + text_risk + velocity (Redis)
       - thresholds: <30 allow, 30-59 warn, >=60 hold
+    `velocity` = (score, reasons) deja calculat (ex. din pipeline-ul batch);
+    dacă lipsește, îl calculăm aici prin record_and_score.
+    `graph` = (score, reasons) din mule_graph.payment_signals (doar cu MULE_GRAPH=1).
     """
     score = 0
     reasons: List[str] = []
@@ -62,11 +67,20 @@ def score_payment(features: Dict, cop_ok: bool, on_watchlist: bool) -> Tuple[flo
     # 6) Velocity (ferestră 1h, Redis) – spike de beneficiari/sume
     src = features.get("src_iban")
     dst = features.get("dst_iban")
-    if src and dst:
+    if velocity is not None:
+        vel_score, vel_reasons = velocity
+    elif src and dst:
         vel_score, vel_reasons = record_and_score(src, dst, amount, is_first)
-        if vel_score:
-            score += vel_score
-            reasons.extend(vel_reasons)
+    else:
+        vel_score, vel_reasons = 0, []
+    if vel_score:
+        score += vel_score
+        reasons.extend(vel_reasons)
+
+    # 7) Graful de tranzacții (pass-through / layering / cicluri)
+    if graph is not None and graph[0]:
+        score += graph[0]
+        reasons.extend(graph[1])
 
     # Mapping la acțiuni
     action = "allow"
@@ -79,3 +93,36 @@ def score_payment(features: Dict, cop_ok: bool, on_watchlist: bool) -> Tuple[flo
         cooloff = 15
 
     return float(score), action, reasons, cooloff
+
+
+def decide(features: Dict, *, cop_ok: bool, cop_msg: str, mule_r: int, watchlisted: bool,
+           ml_p: Optional[float], velocity: Optional[Tuple[int, List[str]]] = None,
+           graph: Optional[Tuple[int, List[str]]] = None) -> Tuple[float, str, List[str], int]:
+    """
+    Combină toate semnalele unei plăți (reguli + CoP + Mule Radar + watchlist + ML)
+    în (risk_score, action, reasons, cooloff_minutes).
+    Folosit atât de /scorePayment cât și de /scorePayments.
+    """
+    on_watchlist = watchlisted or mule_r >= 80
+
+    score, action, reasons, cooloff = score_payment(features, cop_ok, on_watchlist, velocity=velocity, graph=graph)
+    if not cop_ok:
+        reasons.append(f"CoP: {cop_msg}")
+    if mule_r >= 60:
+        reasons.append(f"MuleRadar risk={mule_r}")
+    if on_watchlist and "Beneficiary on watchlist" not in reasons:
+        reasons.append("Beneficiary on watchlist")
+
+    # ML (dacă este model): 60% reguli + 40% p_scam
+    if ml_p is not None:
+        reasons.append(f"ML: p_scam={ml_p:.2f}")
+        rule_norm = min(float(score) / 100.0, 1.0)
+        score = float(100.0 * (0.6 * rule_norm + 0.4 * ml_p))
+        if score >= 60:
+            action, cooloff = "hold", 30
+        elif score >= 30:
+            action, cooloff = "warn", 15
+        else:
+            action, cooloff = "allow", 0
+
+    return score, action, reasons, cooloff
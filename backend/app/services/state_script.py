@@ -0,0 +1,172 @@
+# backend/app/services/state_script.py
+from __future__ import annotations
+
+import hashlib
+import time
+from typing import Dict, List, Sequence
+
+from redis.exceptions import NoScriptError
+
+from app.schemas import PaymentIn
+from app.services import hll, iban_ids, mule, velocity, watchlist
+
+# Un singur round trip Redis per plată: înregistrare mule + statistici pentru
+# destinație, leaderboard-ul mule (destinație și sursă), înregistrare velocity + agregate
+# pentru sursă și SISMEMBER pe watchlist.
+# Scriptul e încărcat o dată (SCRIPT LOAD) și apelat cu EVALSHA.
+#
+# KEYS: 1-4 mule in_sources/in_events/out_dests/out_events(dst)
+#       5-6 mule out_dests/out_events(src)
+#       7-8 velocity buckets/payees(src)
+#       9   watchlist set
+#       10-13 mule hll_keys(dst): in_hll cur/prev, out_hll cur/prev
+#       14-21 mule key_list(src) (20-21 = out_hll cur/prev)  22 mule leaderboard
+#       23-24 iban_ids.keys()  25.. velocity.hll_keys(src) (doar cu hll)
+# ARGV: 1 mule_ts  2 src_iban  3 dst_iban
+#       4 mule_prune_max (now - MULE_KEY_TTL_SEC)  5 mule_since  6 now
+#       7 vel_now  8 amount_cents  9 dst_upper
+#       10 hll (0/1)  11 mule_hll_window_sec  12 mule_recent  13 mule_key_ttl
+#       14 intern (0/1)  15 mule.event_id()  16 iban_ids.gen(now)  17.. velocity.window_args()
+STATE_LUA = hll.HLL_LUA_FN + iban_ids.IBAN_LUA_FN + velocity.VELOCITY_LUA_FN + mule.MULE_LUA_FN + """
+local use_hll, intern = ARGV[10] == '1', ARGV[14] == '1'
+local recent = tonumber(ARGV[12])
+local mule_ts = tonumber(ARGV[1])
+-- membrii din ZSET-uri / HLL-uri: IBAN-uri sau id-uri (IBAN_INTERN); cheile rămân pe IBAN
+local src, dst, in_event, out_event = mule_members(KEYS[23], KEYS[24], ARGV[1], ARGV[2], ARGV[3], intern, ARGV[15], ARGV[16])
+redis.call('ZADD', KEYS[1], mule_ts, src)
+redis.call('ZADD', KEYS[2], mule_ts, in_event)
+redis.call('ZADD', KEYS[5], mule_ts, dst)
+redis.call('ZADD', KEYS[6], mule_ts, out_event)
+for _, i in ipairs({1, 2, 5, 6}) do
+  redis.call('EXPIRE', KEYS[i], ARGV[13])
+end
+
+-- taie doar ce a ieșit din MULE_KEY_TTL_SEC (ca la compactare); ferestrele se numără cu ZCOUNT
+for i = 1, 4 do
+  redis.call('ZREMRANGEBYSCORE', KEYS[i], 0, ARGV[4])
+end
+local fan_in, fan_out
+if use_hll then
+  local now, sec = tonumber(ARGV[6]), tonumber(ARGV[11])
+  hll_add(KEYS[10], KEYS[11], mule_ts, src, now, sec)
+  hll_add(KEYS[20], KEYS[21], mule_ts, dst, now, sec)
+  fan_in = hll_count(KEYS[10], KEYS[11], now, sec)
+  fan_out = hll_count(KEYS[12], KEYS[13], now, sec)
+  -- ZSET-urile de surse/destinații rămân doar pentru "recent"
+  for _, i in ipairs({1, 3, 5}) do
+    redis.call('ZREMRANGEBYRANK', KEYS[i], 0, -(recent + 1))
+  end
+else
+  fan_in = redis.call('ZCOUNT', KEYS[1], ARGV[5], '+inf')
+  fan_out = redis.call('ZCOUNT', KEYS[3], ARGV[5], '+inf')
+end
+local tx_in = redis.call('ZCOUNT', KEYS[2], ARGV[5], ARGV[6])
+local tx_out = redis.call('ZCOUNT', KEYS[4], ARGV[5], ARGV[6])
+local recent_sources = redis.call('ZREVRANGEBYSCORE', KEYS[1], '+inf', ARGV[5], 'LIMIT', 0, recent)
+local recent_dests = redis.call('ZREVRANGEBYSCORE', KEYS[3], '+inf', ARGV[5], 'LIMIT', 0, recent)
+if intern then
+  recent_sources = iban_names(KEYS[24], recent_sources)
+  recent_dests = iban_names(KEYS[24], recent_dests)
+end
+
+-- leaderboard: destinația cu numerele de mai sus, sursa (fan-out nou) recalculată
+mule_rank(KEYS[22], ARGV[3], fan_in, tx_in, fan_out)
+mule_refresh(14, KEYS[22], ARGV[2], tonumber(ARGV[5]), tonumber(ARGV[6]), use_hll, tonumber(ARGV[11]))
+
+local vel = velocity_record(KEYS[7], KEYS[8], tonumber(ARGV[7]), dst, tonumber(ARGV[8]),
+                            velocity_windows(ARGV, 17), use_hll, 25)
+
+local watched = redis.call('SISMEMBER', KEYS[9], ARGV[9])
+
+return {fan_in, tx_in, fan_out, tx_out, recent_sources, recent_dests, vel, watched}
+"""
+STATE_SHA = hashlib.sha1(STATE_LUA.encode()).hexdigest()
+
+
+def _keys(src_iban: str, dst_iban: str, now: float) -> List[str]:
+    dk, sk, vk = mule.keys_for(dst_iban), mule.keys_for(src_iban), velocity.keys_for(src_iban)
+    return [
+        dk["in_sources"], dk["in_events"], dk["out_dests"], dk["out_events"],
+        sk["out_dests"], sk["out_events"],
+        vk["buckets"], vk["payees"],
+        watchlist.SET,
+        *mule.hll_keys(dst_iban, now),
+        *mule.key_list(src_iban, now), mule.LEADERBOARD,
+        *iban_ids.keys(),
+        *velocity.hll_keys(src_iban, int(now)),
+    ]
+
+
+def _args(p: PaymentIn, hours: int, now: float) -> List:
+    # ts-ul plății (un ts din viitor, ex. ceas decalat, e adus la now ca să intre în ZCOUNT since..now)
+    ts = min(mule.to_epoch(p.ts), now)
+    since = now - hours * 3600
+    return [
+        ts, p.src_account_iban, p.dst_account_iban,
+        now - mule.MULE_KEY_TTL_SEC, since, now,
+        int(now), velocity.to_cents(p.amount), p.dst_account_iban.upper(),
+        int(hll.enabled()), mule.HLL_WINDOW_SEC, mule.RECENT, mule.MULE_KEY_TTL_SEC,
+        int(iban_ids.enabled()), mule.event_id(), iban_ids.gen(now),
+        *velocity.window_args(),
+    ]
+
+
+def parse(p: PaymentIn, hours: int, raw: Sequence) -> Dict:
+    fan_in, tx_in, fan_out, tx_out, recent_sources, recent_dests, vel, watched = raw
+    vel_stats = velocity.parse_record(vel)
+    stats = mule.stats_dict(p.dst_account_iban, hours, int(fan_in), int(tx_in), int(fan_out), int(tx_out),
+                            list(recent_sources), list(recent_dests))
+    return {
+        "mule_score": stats["mule_score"],
+        "mule": stats,
+        "velocity": velocity.score_window(vel_stats, p.is_first_to_payee),
+        # agregatele pe ferestre, structurate: {"5m": {"payees", "count", "total"}, "1h": {...}}
+        "velocity_windows": vel_stats,
+        "watchlisted": bool(watched),
+    }
+
+
+async def load(ards) -> str:
+    """SCRIPT LOAD (idempotent); apelat la startup și după NOSCRIPT (ex. restart Redis)."""
+    return await ards.script_load(STATE_LUA)
+
+
+async def record_and_fetch(ards, p: PaymentIn, hours: int = mule.DEFAULT_HOURS) -> Dict:
+    """
+    Starea Redis pentru o plată într-un singur EVALSHA.
+    Întoarce {"mule_score", "mule": stats, "velocity": (score, reasons), "velocity_windows", "watchlisted"}.
+    """
+    now = time.time()
+    keys = _keys(p.src_account_iban, p.dst_account_iban, now)
+    args = _args(p, hours, now)
+    try:
+        raw = await ards.evalsha(STATE_SHA, len(keys), *keys, *args)
+    except NoScriptError:
+        await load(ards)
+        raw = await ards.evalsha(STATE_SHA, len(keys), *keys, *args)
+    return parse(p, hours, raw)
+
+
+async def record_and_fetch_many(ards, payments: Sequence[PaymentIn], hours: int = mule.DEFAULT_HOURS
+                                ) -> List[Dict]:
+    """
+    Ca record_and_fetch, pentru un lot: câte un EVALSHA per plată, toate într-un pipeline
+    (un round trip). Ordinea păstrează semantica secvențială (plata i vede plățile 0..i-1).
+    """
+    if not payments:
+        return []
+    now = time.time()
+    calls = [(_keys(p.src_account_iban, p.dst_account_iban, now), _args(p, hours, now)) for p in payments]
+    for attempt in range(2):
+        pipe = ards.pipeline(transaction=False)
+        for keys, args in calls:
+            pipe.evalsha(STATE_SHA, len(keys), *keys, *args)
+        try:
+            raws = await pipe.execute()
+            break
+        except NoScriptError:
+            # niciun EVALSHA nu a rulat -> reîncărcăm scriptul și repetăm lotul
+            if attempt:
+                raise
+            await load(ards)
+    return [parse(p, hours, raw) for p, raw in zip(payments, raws)]
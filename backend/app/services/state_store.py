@@ -0,0 +1,353 @@
+# backend/app/services/state_store.py
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.schemas import PaymentIn
+from app.services import iban_ids, mule, state_script, velocity, watchlist
+
+# Starea de scoring (mule, velocity, watchlist) stă în spatele unui StateStore:
+#   STATE_BACKEND=redis   (implicit) Redis, scriptul Lua de stare, un round trip per plată/lot
+#   STATE_BACKEND=memory  în proces, fără dependențe (un singur nod / benchmark-uri / teste);
+#                         vezi memory_store.py
+# Serviciile (velocity, mule, watchlist) trec doar prin get() (importat în funcții, ca să
+# nu avem import circular); clienții Redis se creează la primul apel, deci modulele se
+# importă și fără un Redis accesibil.
+STATE_BACKEND = os.getenv("STATE_BACKEND", "redis")
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+MULE_DECAY_CHUNK = int(os.getenv("MULE_DECAY_CHUNK", "200"))  # IBAN-uri per EVALSHA la decay
+
+
+class StateStore:
+    """
+    Operațiile de stare de care au nevoie serviciile. Rezultatele au aceeași formă la
+    toate implementările (ex. record_and_fetch -> dict-ul din state_script.parse).
+    """
+    name = "base"
+
+    # ---- calea de scoring ----
+    async def load(self) -> None:
+        """Pregătire la pornire (ex. SCRIPT LOAD); idempotent."""
+
+    async def close(self) -> None:
+        pass
+
+    async def record_and_fetch(self, p: PaymentIn, hours: int) -> Dict:
+        return (await self.record_and_fetch_many([p], hours))[0]
+
+    async def record_and_fetch_many(self, payments: Sequence[PaymentIn], hours: int) -> List[Dict]:
+        raise NotImplementedError
+
+    # ---- velocity (fără mule/watchlist) ----
+    def velocity_record(self, src_iban: str, dst_iban: str, amount: float, now: int) -> List:
+        """Rezultatul brut velocity_record (câte [payees, count, cents] per fereastră)."""
+        raise NotImplementedError
+
+    async def velocity_record_async(self, src_iban: str, dst_iban: str, amount: float, now: int) -> List:
+        return self.velocity_record(src_iban, dst_iban, amount, now)
+
+    # ---- mule ----
+    def mule_record(self, ts: float, src_iban: str, dst_iban: str) -> None:
+        raise NotImplementedError
+
+    def mule_stats(self, iban: str, hours: int, now: float) -> Dict:
+        raise NotImplementedError
+
+    async def mule_stats_async(self, iban: str, hours: int, now: float) -> Dict:
+        return self.mule_stats(iban, hours, now)
+
+    def mule_stats_many(self, ibans: Sequence[str], hours: int, now: float) -> List[Dict]:
+        """mule_stats pentru fiecare IBAN (aceeași ordine)."""
+        return [self.mule_stats(iban, hours, now) for iban in ibans]
+
+    def mule_ibans(self) -> Iterable[str]:
+        """IBAN-urile care au primit plăți (candidați pentru /mule/top)."""
+        raise NotImplementedError
+
+    def mule_top(self, limit: int) -> List[Tuple[str, float]]:
+        """Primele `limit` (iban, scor) din leaderboard, descrescător."""
+        raise NotImplementedError
+
+    def mule_decay(self, hours: int, now: float, ibans: Optional[Iterable[str]] = None) -> int:
+        """Recalculează scorurile din leaderboard (implicit toți membrii); întoarce câte IBAN-uri."""
+        raise NotImplementedError
+
+    def mule_compact(self, now: float) -> Dict:
+        """
+        Taie datele mule mai vechi decât mule.MULE_KEY_TTL_SEC și IBAN-urile ieșite din
+        dicționarul de id-uri -> {"keys", "removed", "deleted", "ids"}.
+        """
+        raise NotImplementedError
+
+    def mule_usage(self, sample: int) -> Dict:
+        """{familie: {"keys", "members", "bytes"}} pentru cheile mule (bytes=None dacă nu se poate măsura)."""
+        raise NotImplementedError
+
+    # ---- joburi periodice ----
+    def job_lock(self, name: str, ttl_ms: int) -> bool:
+        """
+        True dacă procesul curent rulează jobul `name` în următoarele `ttl_ms` (un singur
+        worker din toți). Implicit True: starea e a procesului, fiecare worker o întreține.
+        """
+        return True
+
+    # ---- watchlist ----
+    def watchlist_add(self, iban: str) -> None:
+        raise NotImplementedError
+
+    def watchlist_remove(self, iban: str) -> None:
+        raise NotImplementedError
+
+    def watchlist_list(self) -> List[str]:
+        raise NotImplementedError
+
+    def watchlist_contains(self, iban: str) -> bool:
+        raise NotImplementedError
+
+    async def watchlist_contains_async(self, iban: str) -> bool:
+        return self.watchlist_contains(iban)
+
+    def stats(self) -> Dict:
+        return {"backend": self.name}
+
+
+class RedisStateStore(StateStore):
+    """Implementarea istorică: ZSET/HASH/HLL în Redis, agregate calculate în Lua."""
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL):
+        self.url = url
+        self._sync = None
+        self._velocity_script = None
+        self._velocity_script_async = None
+        self._mule_record_script = None
+        self._mule_decay_script = None
+        self._mule_compact_script = None
+
+    @property
+    def sync(self):
+        if self._sync is None:
+            import redis
+            self._sync = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._sync
+
+    @property
+    def aio(self):
+        # clientul async partajat de worker (închis de deps.close_async la shutdown)
+        from app.deps import get_async_redis
+        return get_async_redis()
+
+    async def load(self) -> None:
+        await state_script.load(self.aio)
+
+    async def record_and_fetch(self, p: PaymentIn, hours: int) -> Dict:
+        return await state_script.record_and_fetch(self.aio, p, hours)
+
+    async def record_and_fetch_many(self, payments: Sequence[PaymentIn], hours: int) -> List[Dict]:
+        return await state_script.record_and_fetch_many(self.aio, payments, hours)
+
+    def velocity_record(self, src_iban: str, dst_iban: str, amount: float, now: int) -> List:
+        if self._velocity_script is None:
+            self._velocity_script = self.sync.register_script(velocity.VELOCITY_LUA)
+        keys, args = velocity.script_args(src_iban, dst_iban, amount, now)
+        return self._velocity_script(keys=keys, args=args)
+
+    async def velocity_record_async(self, src_iban: str, dst_iban: str, amount: float, now: int) -> List:
+        if self._velocity_script_async is None:
+            self._velocity_script_async = self.aio.register_script(velocity.VELOCITY_LUA)
+        keys, args = velocity.script_args(src_iban, dst_iban, amount, now)
+        return await self._velocity_script_async(keys=keys, args=args)
+
+    def mule_record(self, ts: float, src_iban: str, dst_iban: str) -> None:
+        if self._mule_record_script is None:
+            self._mule_record_script = self.sync.register_script(mule.MULE_RECORD_LUA)
+        keys, args = mule.record_script_args(ts, src_iban, dst_iban, time.time())
+        self._mule_record_script(keys=keys, args=args)
+
+    def mule_stats(self, iban: str, hours: int, now: float) -> Dict:
+        return self.mule_stats_many([iban], hours, now)[0]
+
+    async def mule_stats_async(self, iban: str, hours: int, now: float) -> Dict:
+        pipe = self.aio.pipeline(transaction=False)
+        mule.queue_stats(pipe, iban, hours, now)
+        stats = [mule.parse_stats(iban, hours, iter(await pipe.execute()), now)]
+        return _with_names(stats, await iban_ids.names_async(self.aio, _recent(stats)))[0]
+
+    def mule_stats_many(self, ibans: Sequence[str], hours: int, now: float) -> List[Dict]:
+        # toate IBAN-urile într-un singur pipeline (un round trip)
+        pipe = self.sync.pipeline(transaction=False)
+        for iban in ibans:
+            mule.queue_stats(pipe, iban, hours, now)
+        results = iter(pipe.execute())
+        stats = [mule.parse_stats(iban, hours, results, now) for iban in ibans]
+        return _with_names(stats, iban_ids.names(self.sync, _recent(stats)))
+
+    def mule_ibans(self) -> Iterable[str]:
+        seen = set()
+        for k in self.sync.scan_iter(match=f"{mule.PREFIX}:in_sources:*", count=200):
+            iban = k.split(":")[-1]
+            if iban not in seen:
+                seen.add(iban)
+                yield iban
+
+    def mule_top(self, limit: int) -> List[Tuple[str, float]]:
+        return self.sync.zrevrange(mule.LEADERBOARD, 0, limit - 1, withscores=True)
+
+    def mule_decay(self, hours: int, now: float, ibans: Optional[Iterable[str]] = None) -> int:
+        if self._mule_decay_script is None:
+            self._mule_decay_script = self.sync.register_script(mule.MULE_DECAY_LUA)
+        if ibans is None:
+            ibans = self.sync.zrange(mule.LEADERBOARD, 0, -1)
+        done, chunk = 0, []
+        for iban in ibans:
+            chunk.append(iban)
+            if len(chunk) >= MULE_DECAY_CHUNK:
+                done += self._decay_chunk(chunk, hours, now)
+                chunk = []
+        if chunk:
+            done += self._decay_chunk(chunk, hours, now)
+        return done
+
+    def _decay_chunk(self, ibans: List[str], hours: int, now: float) -> int:
+        keys, args = mule.decay_script_args(ibans, hours, now)
+        return int(self._mule_decay_script(keys=keys, args=args))
+
+    def mule_compact(self, now: float) -> Dict:
+        if self._mule_compact_script is None:
+            self._mule_compact_script = self.sync.register_script(mule.MULE_COMPACT_LUA)
+        args = [now - mule.MULE_KEY_TTL_SEC, mule.MULE_KEY_TTL_SEC]
+        out = {"keys": 0, "removed": 0, "deleted": 0}
+
+        def flush(chunk: List[str]) -> None:
+            removed, deleted = self._mule_compact_script(keys=chunk, args=args)
+            out["keys"] += len(chunk)
+            out["removed"] += int(removed)
+            out["deleted"] += int(deleted)
+
+        for family in mule.ZSET_FAMILIES:
+            chunk: List[str] = []
+            for k in self.sync.scan_iter(match=f"{mule.PREFIX}:{family}:*", count=1000):
+                chunk.append(k)
+                if len(chunk) >= MULE_DECAY_CHUNK:
+                    flush(chunk)
+                    chunk = []
+            if chunk:
+                flush(chunk)
+        # dicționarul de id-uri: un id poate apărea cel mult cât trăiește cea mai lungă structură
+        # (ZSET mule cu TTL, payees velocity, generația precedentă a unui HLL = 2 x fereastra)
+        keep = max(mule.MULE_KEY_TTL_SEC, 2 * mule.HLL_WINDOW_SEC, 2 * velocity.WINDOW_SEC)
+        out["ids"] = iban_ids.sweep(self.sync, now, keep)
+        return out
+
+    def mule_usage(self, sample: int) -> Dict:
+        """
+        SCAN complet pentru numărul de chei; membrii și memoria (MEMORY USAGE) se măsoară pe
+        primele `sample` chei din fiecare familie și se extrapolează. `no_ttl` = chei din
+        eșantion fără expirare (le prinde compactarea).
+        """
+        out: Dict[str, Dict] = {}
+        for family in (*mule.ZSET_FAMILIES, *mule.HLL_FAMILIES):
+            n, sampled = 0, []
+            for k in self.sync.scan_iter(match=f"{mule.PREFIX}:{family}:*", count=1000):
+                n += 1
+                if len(sampled) < sample:
+                    sampled.append(k)
+            zset = family in mule.ZSET_FAMILIES
+            pipe = self.sync.pipeline(transaction=False)
+            for k in sampled:
+                pipe.memory_usage(k, samples=0)
+                pipe.ttl(k)
+                if zset:
+                    pipe.zcard(k)
+            res = pipe.execute(raise_on_error=False)
+            step = 3 if zset else 2
+            mem = [r for r in res[0::step] if isinstance(r, int)]
+            members = res[2::3] if zset else []
+            out[family] = {
+                "keys": n,
+                "sampled": len(sampled),
+                "members": round(sum(members) * n / len(sampled)) if members else None,
+                "bytes": round(sum(mem) * n / len(mem)) if mem else None,
+                "no_ttl": sum(1 for t in res[1::step] if t == -1),
+            }
+        pipe = self.sync.pipeline(transaction=False)
+        for k in (mule.LEADERBOARD, iban_ids.IDS, iban_ids.NAMES):
+            pipe.exists(k)
+            pipe.memory_usage(k, samples=0)
+        pipe.zcard(mule.LEADERBOARD)
+        pipe.hlen(iban_ids.NAMES)
+        res = pipe.execute(raise_on_error=False)
+        mem = [m if isinstance(m, int) else None for m in res[1:6:2]]
+        out["leaderboard"] = {"keys": res[0], "members": res[6], "bytes": mem[0]}
+        out["iban_ids"] = {"keys": res[2] + res[4], "members": res[7],
+                           "bytes": sum(mem[1:]) if None not in mem[1:] else None}
+        return out
+
+    def job_lock(self, name: str, ttl_ms: int) -> bool:
+        # SET NX PX: primul worker din interval ia jobul; lock-ul nu se eliberează, expiră singur,
+        # deci jobul rulează cel mult o dată per interval în toți workerii / toate replicile
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        return bool(self.sync.set(f"{mule.PREFIX}:lock:{name}", owner, nx=True, px=ttl_ms))
+
+    def watchlist_add(self, iban: str) -> None:
+        self.sync.sadd(watchlist.SET, iban.upper())
+
+    def watchlist_remove(self, iban: str) -> None:
+        self.sync.srem(watchlist.SET, iban.upper())
+
+    def watchlist_list(self) -> List[str]:
+        return sorted(self.sync.smembers(watchlist.SET))
+
+    def watchlist_contains(self, iban: str) -> bool:
+        return bool(self.sync.sismember(watchlist.SET, iban.upper()))
+
+    async def watchlist_contains_async(self, iban: str) -> bool:
+        return bool(await self.aio.sismember(watchlist.SET, iban.upper()))
+
+
+def _recent(stats: List[Dict]) -> List[str]:
+    return [m for s in stats for m in (*s["recent_sources"], *s["recent_dests"])]
+
+
+def _with_names(stats: List[Dict], names: List[str]) -> List[Dict]:
+    """Pune IBAN-urile (iban_ids.names pe _recent(stats)) înapoi în recent_sources / recent_dests."""
+    it = iter(names)
+    for s in stats:
+        s["recent_sources"] = [next(it) for _ in s["recent_sources"]]
+        s["recent_dests"] = [next(it) for _ in s["recent_dests"]]
+    return stats
+
+
+_store: Optional[StateStore] = None
+_store_lock = threading.Lock()
+
+
+def create(backend: str = STATE_BACKEND) -> StateStore:
+    if backend == "memory":
+        from app.services.memory_store import MemoryStateStore
+        return MemoryStateStore()
+    if backend == "redis":
+        return RedisStateStore()
+    raise ValueError(f"unknown STATE_BACKEND {backend!r} (expected redis|memory)")
+
+
+def get() -> StateStore:
+    """Store-ul procesului (creat la primul apel, după STATE_BACKEND)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create()
+    return _store
+
+
+def set_store(store: StateStore) -> None:
+    """Înlocuiește store-ul procesului (benchmark-uri / rulări locale)."""
+    global _store
+    with _store_lock:
+        _store = store
+
@@ -1,5 +1,20 @@
 # -*- coding: utf-8 -*-
-from typing import Tuple, List
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Tuple, List
+
+from app.services.desc_memo import make_memo, memo_key
+from app.services.keyword_matcher import KeywordMatcher
+
+log = logging.getLogger(__name__)
+
+# Listele pot veni dintr-un fișier JSON {"keyphrases": {term: w}, "keywords": {term: w}};
+# fără fișier se folosesc cele de mai jos. Fișierul e re-citit când i se schimbă mtime.
+TEXT_SIGNALS_PATH = os.getenv("TEXT_SIGNALS_PATH")
+TEXT_SIGNALS_CHECK_SEC = float(os.getenv("TEXT_SIGNALS_CHECK_SEC", "5"))
 
 # Cuvinte-cheie des întâlnite în scam (investment / romance / urgent / refund etc.)
 KEYWORDS = {
@@ -18,6 +33,74 @@ KEYPHRASES = {
     "urgent transfer": 9,
 }
 
+def build_matcher(keyphrases: Dict[str, int], keywords: Dict[str, int]) -> KeywordMatcher:
+    # ordinea intrărilor = ordinea motivelor: întâi frazele, apoi cuvintele (ca înainte)
+    return KeywordMatcher(list(keyphrases.items()) + list(keywords.items()))
+
+_matcher = build_matcher(KEYPHRASES, KEYWORDS)
+_state = {"version": 1, "path": None, "mtime_ns": None, "loaded_at": time.time()}
+_reload_lock = threading.Lock()
+_last_check = 0.0
+_bad_mtime_ns = None  # fișier invalid: nu-l mai reîncercăm până nu se schimbă iar
+# descriere -> (matcher, score, reasons); golit la reload, iar intrările calculate cu
+# alt automat (un text_risk care a prins reload-ul la mijloc) sunt ignorate
+_memo = make_memo()
+
+def load_lists(path: str) -> Tuple[Dict[str, int], Dict[str, int]]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    # descrierea e comparată cu lower(); un termen cu majuscule nu s-ar potrivi niciodată
+    def clean(d: Dict) -> Dict[str, int]:
+        return {str(term).lower(): int(w) for term, w in (d or {}).items()}
+    return clean(data.get("keyphrases")), clean(data.get("keywords"))
+
+def reload(path: str | None = None) -> Dict:
+    """
+    Recompilează automatul din `path` (implicit TEXT_SIGNALS_PATH; fără fișier, listele
+    din modul) și îl publică dintr-o singură atribuire; text_risk în curs folosește
+    automatul vechi până termină.
+    """
+    global _matcher
+    path = path or TEXT_SIGNALS_PATH
+    with _reload_lock:
+        if path:
+            mtime_ns = os.stat(path).st_mtime_ns
+            matcher = build_matcher(*load_lists(path))
+        else:
+            mtime_ns = None
+            matcher = build_matcher(KEYPHRASES, KEYWORDS)
+        _matcher = matcher
+        if _memo is not None:
+            _memo.clear()
+        _state.update(version=_state["version"] + 1, path=path, mtime_ns=mtime_ns, loaded_at=time.time())
+    return info()
+
+def maybe_reload() -> None:
+    """Cel mult un os.stat la TEXT_SIGNALS_CHECK_SEC; reîncarcă dacă fișierul s-a schimbat."""
+    global _last_check, _bad_mtime_ns
+    if not TEXT_SIGNALS_PATH:
+        return
+    now = time.monotonic()
+    if now - _last_check < TEXT_SIGNALS_CHECK_SEC:
+        return
+    _last_check = now
+    mtime_ns = None
+    try:
+        mtime_ns = os.stat(TEXT_SIGNALS_PATH).st_mtime_ns
+        if mtime_ns != _state["mtime_ns"] and mtime_ns != _bad_mtime_ns:
+            reload(TEXT_SIGNALS_PATH)
+    except Exception:
+        _bad_mtime_ns = mtime_ns
+        log.exception("text signals reload from %s failed; keeping current lists", TEXT_SIGNALS_PATH)
+
+def version() -> int:
+    return _state["version"]
+
+def info() -> Dict:
+    m = _matcher
+    return {**_state, "terms": len(m), "states": m.states,
+            "memo": _memo.stats() if _memo is not None else None}
+
 def text_risk(description: str | None) -> Tuple[int, List[str]]:
     """
     Întoarce (extra_score, reasons) pe baza textului.
@@ -25,18 +108,23 @@ def text_risk(description: str | None) -> Tuple[int, List[str]]:
     """
     if not description:
         return 0, []
+    maybe_reload()
+    matcher = _matcher
+    key = memo_key(description) if _memo is not None else None
+    if key is not None:
+        hit = _memo.get(key)
+        if hit is not None and hit[0] is matcher:
+            return hit[1], list(hit[2])
     desc = description.lower()
     score = 0
     reasons: List[str] = []
 
-    for ph, w in KEYPHRASES.items():
-        if ph in desc:
-            score += w
-            reasons.append(f"Keyword: '{ph}'")
-
-    for kw, w in KEYWORDS.items():
-        if kw in desc:
-            score += w
-            reasons.append(f"Keyword: '{kw}'")
+    for idx in matcher.find(desc):
+        term, w = matcher.entries[idx]
+        score += w
+        reasons.append(f"Keyword: '{term}'")
 
-    return min(score, 30), reasons
+    score = min(score, 30)
+    if key is not None:
+        _memo.put(key, (matcher, score, tuple(reasons)))
+    return score, reasons
@@ -1,71 +1,249 @@
 import os, time
+from dataclasses import dataclass
 from typing import Tuple, List, Dict
-import redis
 
-# Conectare Redis
-REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
-r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+from app.services import hll, iban_ids
 
-WINDOW_SEC = 3600  # 1h
+# Ferestrele de velocity (ex. "5m,1h,24h,7d"), toate calculate din aceeași stare per cont
+# și în același apel de script. Agregatele (parse_record) intră în reguli (score_window) și se
+# întorc structurat în răspunsul de scoring (velocity_windows); modelul ML nu le primește,
+# pentru că rulează în paralel cu stagiul de stare și e antrenat pe rânduri fără istoric.
+VELOCITY_WINDOWS = os.getenv("VELOCITY_WINDOWS", "5m,1h,24h,7d")
+# Sumele și numărul de plăți stau pe bucket-uri fixe. Bucket-ul unei ferestre e
+# max(VELOCITY_BUCKET_SEC, fereastră / VELOCITY_WINDOW_BUCKETS), deci fiecare fereastră
+# ține cel mult ~VELOCITY_WINDOW_BUCKETS bucket-uri, iar ferestrele cu același bucket
+# (ex. 5m și 1h) împart aceleași câmpuri.
+VELOCITY_BUCKET_SEC = int(os.getenv("VELOCITY_BUCKET_SEC", "60"))
+VELOCITY_WINDOW_BUCKETS = int(os.getenv("VELOCITY_WINDOW_BUCKETS", "60"))
 
 # Praguri pentru demo (ajustează în .env dacă vrei)
 MAX_NEW_PAYEES_1H = int(os.getenv("MAX_NEW_PAYEES_1H", "3"))
 MAX_TOTAL_1H = float(os.getenv("MAX_TOTAL_1H", "50000"))  # RON
 FIRST_TO_PAYEE_PENALTY = int(os.getenv("FIRST_TO_PAYEE_PENALTY", "10"))
 
+# pragurile implicite (beneficiari distincți, total RON) per fereastră; suprascrise cu
+# VELOCITY_MAX_PAYEES_<NUME> / VELOCITY_MAX_TOTAL_<NUME> (ex. VELOCITY_MAX_TOTAL_24H)
+DEFAULT_THRESHOLDS = {
+    "5m": (2, 20000.0),
+    "1h": (MAX_NEW_PAYEES_1H, MAX_TOTAL_1H),
+    "24h": (6, 100000.0),
+    "7d": (12, 250000.0),
+}
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+@dataclass(frozen=True)
+class Window:
+    name: str
+    sec: int
+    bucket_sec: int
+    max_payees: int
+    max_total: float
+
+
+def _duration(spec: str) -> int:
+    if spec[-1:] in _UNITS:
+        return int(spec[:-1]) * _UNITS[spec[-1]]
+    return int(spec)
+
+
+def _window(name: str) -> Window:
+    sec = _duration(name)
+    payees, total = DEFAULT_THRESHOLDS.get(name, (MAX_NEW_PAYEES_1H * sec // 3600 or 1, MAX_TOTAL_1H * sec / 3600))
+    env = name.upper()
+    return Window(
+        name=name,
+        sec=sec,
+        bucket_sec=max(VELOCITY_BUCKET_SEC, sec // max(1, VELOCITY_WINDOW_BUCKETS)),
+        max_payees=int(os.getenv(f"VELOCITY_MAX_PAYEES_{env}", str(payees))),
+        max_total=float(os.getenv(f"VELOCITY_MAX_TOTAL_{env}", str(total))),
+    )
+
+
+WINDOWS: List[Window] = [_window(w.strip()) for w in VELOCITY_WINDOWS.split(",") if w.strip()]
+WINDOW_SEC = max(w.sec for w in WINDOWS)  # cea mai lungă fereastră (cât ținem starea)
+
 def _now() -> int:
     return int(time.time())
 
-def _keys(src_iban: str) -> Dict[str, str]:
+def keys_for(src_iban: str) -> Dict[str, str]:
     base = f"vel:{src_iban}"
     return {
-        "payees": f"{base}:payees",       # ZSET: dst_iban cu score=timestamp
-        "amounts": f"{base}:amounts",     # ZSET: amount cu score=timestamp
-        "meta": f"{base}:meta",           # HASH: counters etc.
+        "buckets": f"{base}:buckets",     # HASH: "<bucket_sec>:<bucket>:n" = nr. plăți, ":s" = sumă în bani
+        "payees": f"{base}:payees",       # ZSET: dst_iban (sau id-ul lui, IBAN_INTERN=1) cu score=ultima plată
+        "payees_hll": f"{base}:payees_hll",  # prefix HLL-uri rolling per fereastră (DISTINCT_COUNT_MODE=hll)
     }
 
-def record_and_score(src_iban: str, dst_iban: str, amount: float, is_first_to_payee: bool) -> Tuple[int, List[str]]:
+# Funcții Lua folosite atât de VELOCITY_LUA cât și de scriptul de stare (state_script).
+# velocity_record înregistrează plata în bucket-ul curent al fiecărei rezoluții, șterge
+# bucket-urile ieșite din toate ferestrele și agregă pe server; pentru fiecare fereastră
+# întoarce {beneficiari distincți, nr. plăți, total în bani}.
+# Sumele unei ferestre acoperă mereu cel puțin fereastra (cel mult un bucket în plus);
+# beneficiarii sunt exacți (ZSET cu ultima plată per beneficiar, tăiat la fereastra maximă)
+# sau, cu hll=true, aproximați din câte două HLL-uri per fereastră (KEYS[hk..], câte o pereche
+# cur/prev per fereastră în ordinea ferestrelor, vezi hll.py și hll_keys).
+# Necesită hll.HLL_LUA_FN definit înainte.
+VELOCITY_LUA_FN = """
+local function velocity_windows(argv, first)
+  local ws = {}
+  for i = 1, tonumber(argv[first]) do
+    local j = first + 2 * (i - 1)
+    ws[i] = {tonumber(argv[j + 1]), tonumber(argv[j + 2]), nil}
+  end
+  return ws
+end
+
+local function velocity_record(kb, kp, now, dst, cents, windows, hll, hk)
+  local keep, out, max_sec, ttl = {}, {}, 0, 0
+  for i, w in ipairs(windows) do
+    local res = w[2]
+    w[3] = math.floor((now - w[1]) / res)
+    if keep[res] == nil or w[3] < keep[res] then keep[res] = w[3] end
+    max_sec = math.max(max_sec, w[1])
+    ttl = math.max(ttl, w[1] + res)
+    out[i] = {0, 0, 0}
+  end
+  for res, _ in pairs(keep) do
+    local prefix = res .. ':' .. math.floor(now / res) .. ':'
+    redis.call('HINCRBY', kb, prefix .. 'n', 1)
+    redis.call('HINCRBY', kb, prefix .. 's', cents)
+  end
+
+  local stale = {}
+  local flat = redis.call('HGETALL', kb)
+  for i = 1, #flat, 2 do
+    local res, b, kind = string.match(flat[i], '^(%d+):(%d+):(%a)$')
+    res, b = tonumber(res or ''), tonumber(b or '')
+    if res == nil or keep[res] == nil or b < keep[res] then
+      stale[#stale + 1] = flat[i]
+    else
+      local slot = (kind == 'n') and 2 or 3
+      local v = tonumber(flat[i + 1])
+      for j, w in ipairs(windows) do
+        if w[2] == res and b >= w[3] then
+          out[j][slot] = out[j][slot] + v
+        end
+      end
+    end
+  end
+  if #stale > 0 then
+    redis.call('HDEL', kb, unpack(stale))
+  end
+  redis.call('EXPIRE', kb, ttl)
+
+  if hll then
+    for j, w in ipairs(windows) do
+      local cur, prev = KEYS[hk + 2 * (j - 1)], KEYS[hk + 2 * (j - 1) + 1]
+      hll_add(cur, prev, now, dst, now, w[1])
+      out[j][1] = hll_count(cur, prev, now, w[1])
+    end
+    return out
+  end
+  redis.call('ZADD', kp, now, dst)
+  redis.call('ZREMRANGEBYSCORE', kp, 0, '(' .. (now - max_sec))
+  for j, w in ipairs(windows) do
+    out[j][1] = redis.call('ZCOUNT', kp, now - w[1], '+inf')
+  end
+  redis.call('EXPIRE', kp, ttl)
+  return out
+end
+"""
+
+# KEYS: 1 buckets  2 payees  3-4 iban_ids.keys()  5.. hll_keys() (doar cu hll)
+# ARGV: 1 now  2 dst_iban  3 amount_cents  4 hll (0/1)  5 intern (0/1)  6 iban_ids.gen(now)
+#       7.. window_args()
+VELOCITY_LUA = hll.HLL_LUA_FN + iban_ids.IBAN_LUA_FN + VELOCITY_LUA_FN + """
+local dst = ARGV[2]
+if ARGV[5] == '1' then
+  dst = iban_id(KEYS[3], KEYS[4], dst, ARGV[6])
+end
+return velocity_record(KEYS[1], KEYS[2], tonumber(ARGV[1]), dst, tonumber(ARGV[3]),
+                       velocity_windows(ARGV, 7), ARGV[4] == '1', 5)
+"""
+
+def window_args() -> List[int]:
+    """[n, sec_1, bucket_sec_1, ...] -> velocity_windows în Lua."""
+    out = [len(WINDOWS)]
+    for w in WINDOWS:
+        out += [w.sec, w.bucket_sec]
+    return out
+
+def hll_keys(src_iban: str, now: int) -> List[str]:
+    """Perechile cur/prev de HLL-uri ale beneficiarilor, în ordinea WINDOWS (gol fără hll)."""
+    if not hll.enabled():
+        return []
+    prefix = keys_for(src_iban)["payees_hll"]
+    return [k for w in WINDOWS for k in hll.window_keys(prefix, w.sec, now)]
+
+def to_cents(amount: float) -> int:
+    return int(round(float(amount) * 100))
+
+def script_args(src_iban: str, dst_iban: str, amount: float, now: int) -> Tuple[List[str], List]:
+    k = keys_for(src_iban)
+    return ([k["buckets"], k["payees"], *iban_ids.keys(), *hll_keys(src_iban, now)],
+            [now, dst_iban, to_cents(amount), int(hll.enabled()), int(iban_ids.enabled()), iban_ids.gen(now),
+             *window_args()])
+
+def parse_record(raw) -> Dict[str, Dict]:
+    """Rezultatul velocity_record -> {fereastră: {"payees", "count", "total"}}."""
+    return {
+        w.name: {"payees": int(payees), "count": int(count), "total": int(cents) / 100.0}
+        for w, (payees, count, cents) in zip(WINDOWS, raw)
+    }
+
+def score_window(stats: Dict[str, Dict], is_first_to_payee: bool) -> Tuple[int, List[str]]:
     """
-    Înregistrează tranzacția curentă în ferestra de 1h și calculează un extra-score + reasons.
+    Reguli pe fiecare fereastră cu pragurile ei. Un spike trece de obicei prin mai multe
+    ferestre (5m, 1h, 24h), așa că per semnal păstrăm doar fereastra cu bump-ul cel mai mare.
     """
-    now = _now()
-    k = _keys(src_iban)
-
-    pipe = r.pipeline()
-    # Curățăm tot ce e mai vechi de 1h
-    min_ts = now - WINDOW_SEC
-    pipe.zremrangebyscore(k["payees"], 0, min_ts)
-    pipe.zremrangebyscore(k["amounts"], 0, min_ts)
-
-    # Înregistrăm această tranzacție
-    pipe.zadd(k["payees"], {dst_iban: now})
-    pipe.zadd(k["amounts"], {str(amount): now})
-    pipe.execute()
-
-    # Citim starea curentă în fereastră
-    uniq_payees = r.zcount(k["payees"], min_ts, now)        # nr. destinații unice
-    amounts = [float(a) for a, _ in r.zrangebyscore(k["amounts"], min_ts, now, withscores=True)]
-    total_amount = sum(amounts)
-
-    score = 0
-    reasons: List[str] = []
-
-    # Mulți beneficiari noi într-o oră => risc
-    if uniq_payees > MAX_NEW_PAYEES_1H:
-        bump = 10 + 5 * (uniq_payees - MAX_NEW_PAYEES_1H)
-        score += bump
-        reasons.append(f"Velocity: {uniq_payees} new payees in 1h (+{bump})")
-
-    # Sume totale mari într-o oră => risc
-    if total_amount > MAX_TOTAL_1H:
-        over = total_amount - MAX_TOTAL_1H
-        bump = 10 + min(int(over / 5000), 10)  # max +20
-        score += bump
-        reasons.append(f"Velocity: {total_amount:.0f} RON in 1h (+{bump})")
+    best: Dict[str, Tuple[int, str]] = {}
+    spike = False
+
+    for w in WINDOWS:
+        agg = stats.get(w.name)
+        if agg is None:
+            continue
+        uniq_payees, total_amount = agg["payees"], agg["total"]
+
+        # Mulți beneficiari noi în fereastră => risc
+        if uniq_payees > w.max_payees:
+            bump = 10 + 5 * (uniq_payees - w.max_payees)
+            if bump > best.get("payees", (0, ""))[0]:
+                best["payees"] = (bump, f"Velocity: {uniq_payees} new payees in {w.name} (+{bump})")
+
+        # Sume totale mari în fereastră => risc
+        if total_amount > w.max_total:
+            over = total_amount - w.max_total
+            bump = 10 + min(int(over / (w.max_total / 10)), 10)  # max +20
+            if bump > best.get("total", (0, ""))[0]:
+                best["total"] = (bump, f"Velocity: {total_amount:.0f} RON in {w.name} (+{bump})")
+
+        if uniq_payees > w.max_payees or total_amount > w.max_total * 0.7:
+            spike = True
+
+    score = sum(best[k][0] for k in ("payees", "total") if k in best)
+    reasons = [best[k][1] for k in ("payees", "total") if k in best]
 
     # Prima plată către beneficiar într-un context de spike
-    if is_first_to_payee and (uniq_payees > MAX_NEW_PAYEES_1H or total_amount > MAX_TOTAL_1H * 0.7):
+    if is_first_to_payee and spike:
         score += FIRST_TO_PAYEE_PENALTY
         reasons.append(f"Velocity: first-to-payee context (+{FIRST_TO_PAYEE_PENALTY})")
 
     return min(score, 35), reasons  # plafonăm la 35
+
+def record_and_score(src_iban: str, dst_iban: str, amount: float, is_first_to_payee: bool) -> Tuple[int, List[str]]:
+    """
+    Înregistrează tranzacția curentă în toate ferestrele și calculează un extra-score + reasons.
+    Scrierea și agregarea se fac într-un singur apel la state store (în Redis, un EVALSHA).
+    """
+    from app.services import state_store
+    raw = state_store.get().velocity_record(src_iban, dst_iban, amount, _now())
+    return score_window(parse_record(raw), is_first_to_payee)
+
+async def record_and_score_async(src_iban: str, dst_iban: str, amount: float, is_first_to_payee: bool
+                                 ) -> Tuple[int, List[str]]:
+    """Ca record_and_score, pe calea async a store-ului (nu blochează event loop-ul)."""
+    from app.services import state_store
+    raw = await state_store.get().velocity_record_async(src_iban, dst_iban, amount, _now())
+    return score_window(parse_record(raw), is_first_to_payee)
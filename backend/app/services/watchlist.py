@@ -1,19 +1,23 @@
-import os
-import redis
 from typing import List
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
-r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+# Setul de IBAN-uri urmărite; stocarea e a state store-ului (STATE_BACKEND)
 SET = "watchlist:ibans"
 
+def _store():
+    from app.services import state_store
+    return state_store.get()
+
 def add_iban(iban: str) -> None:
-    r.sadd(SET, iban.upper())
+    _store().watchlist_add(iban)
 
 def remove_iban(iban: str) -> None:
-    r.srem(SET, iban.upper())
+    _store().watchlist_remove(iban)
 
 def list_ibans() -> List[str]:
-    return sorted(r.smembers(SET))
+    return _store().watchlist_list()
 
 def is_watchlisted(iban: str) -> bool:
-    return r.sismember(SET, iban.upper())
+    return _store().watchlist_contains(iban)
+
+async def is_watchlisted_async(iban: str) -> bool:
+    return await _store().watchlist_contains_async(iban)
@@ -0,0 +1,132 @@
+# backend/app/services/write_behind.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.schemas import PaymentIn
+from app.services.persistence import persist_transactions_async
+
+log = logging.getLogger(__name__)
+
+# Write-behind (opțional): decizia nu mai așteaptă commit-ul în Postgres.
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0").lower() in {"1", "true", "yes"}
+WB_BATCH_SIZE = int(os.getenv("WB_BATCH_SIZE", "500"))     # rânduri / INSERT
+WB_FLUSH_MS = float(os.getenv("WB_FLUSH_MS", "200"))       # flush cel târziu după atât
+WB_QUEUE_MAX = int(os.getenv("WB_QUEUE_MAX", "10000"))     # peste -> backpressure pe request
+WB_MAX_RETRIES = int(os.getenv("WB_MAX_RETRIES", "3"))
+
+Decision = Tuple[float, str, List[str]]
+
+_STOP = object()  # sentinel pentru drenarea la shutdown
+
+
+class WriteBehind:
+    """
+    Coadă mărginită în proces + flusher de fundal pentru rândurile `transactions`.
+      - submit(): pune plata scorată în coadă; dacă e plină, așteaptă (backpressure)
+      - flusher: scoate până la batch_size rânduri sau cât vine în flush_ms și le scrie
+        cu un singur INSERT multi-row (lookup conturi + insert + commit, ca în persistence)
+      - stop(): nu mai acceptă rânduri noi și golește coada înainte de a ieși
+    """
+
+    def __init__(self, session_factory, *, batch_size: int = WB_BATCH_SIZE, flush_ms: float = WB_FLUSH_MS,
+                 maxsize: int = WB_QUEUE_MAX, max_retries: int = WB_MAX_RETRIES):
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.maxsize = maxsize
+        self.max_retries = max_retries
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._counters = {"enqueued": 0, "written": 0, "batches": 0, "dropped": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._task = asyncio.create_task(self._run(), name="write-behind-flusher")
+
+    async def submit(self, payment: PaymentIn, decision: Decision) -> None:
+        await self.submit_many([payment], [decision])
+
+    async def submit_many(self, payments: Sequence[PaymentIn], decisions: Sequence[Decision]) -> None:
+        if not self.running:
+            raise RuntimeError("write-behind flusher is not running")
+        for item in zip(payments, decisions):
+            await self._queue.put(item)  # blochează doar când coada e plină
+            self._counters["enqueued"] += 1
+
+    async def stop(self) -> None:
+        """Drenare garantată: tot ce e deja în coadă ajunge în DB înainte de return."""
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "maxsize": self.maxsize,
+            "batch_size": self.batch_size,
+            "flush_ms": self.flush_ms,
+            **self._counters,
+        }
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.flush_ms / 1000.0
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # după sentinel nu mai vin rânduri noi; scriem ce a mai rămas
+        rest = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                rest.append(item)
+        for i in range(0, len(rest), self.batch_size):
+            await self._flush(rest[i:i + self.batch_size])
+
+    async def _flush(self, batch: List[Tuple[PaymentIn, Decision]]) -> None:
+        payments = [p for p, _ in batch]
+        decisions = [d for _, d in batch]
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                async with self._session_factory() as db:
+                    await persist_transactions_async(db, payments, decisions)
+                self._counters["written"] += len(batch)
+                self._counters["batches"] += 1
+                return
+            except Exception:
+                self._counters["errors"] += 1
+                log.exception("write-behind flush failed (attempt %d/%d, %d rows)",
+                              attempt, self.max_retries, len(batch))
+                await asyncio.sleep(0.1 * attempt)
+        self._counters["dropped"] += len(batch)
+        log.error("write-behind dropped %d transaction rows after %d attempts", len(batch), self.max_retries)
@@ -0,0 +1,9 @@
+-- Etichete pentru antrenarea ML din `transactions` (idempotent, rulează și pe baze existente)
+-- initdb îl rulează doar pe un volum pgdata gol; pe bazele existente îl aplică API-ul la pornire (app.deps.migrate)
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS description TEXT;
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS label SMALLINT;              -- 1 scam, 0 legit, NULL = neetichetat
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS label_source VARCHAR(16);    -- analyst | quiz
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS labeled_at TIMESTAMP;
+
+-- antrenarea citește în ordinea (labeled_at, id), de la ultimul watermark încolo
+CREATE INDEX IF NOT EXISTS idx_txn_labeled ON transactions(labeled_at, id) WHERE label IS NOT NULL;
@@ -0,0 +1,52 @@
+import os
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+
+from app.services import state_store
+from app.services.memory_store import MemoryStateStore
+
+
+class FakeRedisStateStore(state_store.RedisStateStore):
+    """RedisStateStore pe un server fakeredis (Lua prin lupa), clienți sync și async pe aceleași date."""
+
+    def __init__(self):
+        super().__init__()
+        server = fakeredis.FakeServer()
+        self._sync = fakeredis.FakeRedis(server=server, decode_responses=True)
+        self._aio = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+
+    @property
+    def aio(self):
+        return self._aio
+
+
+def make_store(backend: str) -> state_store.StateStore:
+    if backend == "memory":
+        return MemoryStateStore(shards=4)
+    return FakeRedisStateStore()
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request):
+    s = make_store(request.param)
+    prev = state_store._store
+    state_store.set_store(s)  # mule.* / watchlist.* citesc store-ul procesului
+    yield s
+    state_store.set_store(prev)
+
+
+@pytest.fixture
+def ml_artifacts(tmp_path, monkeypatch):
+    """Artefactele ML (versiuni, CURRENT, seturi) într-un director temporar, fără model încărcat."""
+    from app.ml import model
+    art = str(tmp_path / "artifacts")
+    for name, rel in (("ART_DIR", ""), ("MODEL_PATH", "model.pkl"), ("VECT_PATH", "vectorizer.pkl"),
+                      ("META_PATH", "meta.json"), ("VERSIONS_DIR", "versions"), ("CURRENT_PATH", "CURRENT"),
+                      ("DATASETS_DIR", "datasets")):
+        monkeypatch.setattr(model, name, os.path.join(art, rel) if rel else art)
+    os.makedirs(art)
+    monkeypatch.setattr(model, "ml_state", model.MLState(clf=None, vect=None, meta={}))
+    monkeypatch.setattr(model, "_seen_current", None)
+    return model
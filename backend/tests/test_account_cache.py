@@ -0,0 +1,72 @@
+import pytest
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import Session
+
+from app.models import Account, Base
+from app.services import account_cache as ac
+from app.services.account_cache import AccountCache
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Account), [{"id": i, "iban": f"RO{i}ACC"} for i in range(1, 6)])
+    selects = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cur, stmt, *a: selects.append(stmt) if stmt.lstrip().upper().startswith("SELECT") else None)
+    with Session(engine) as s:
+        s.info["selects"] = selects
+        yield s
+
+
+def test_hits_skip_the_db(db):
+    cache = AccountCache(maxsize=10)
+    assert cache.ids_for(db, ["RO1ACC", "RO2ACC", "RO1ACC"]) == {"RO1ACC": 1, "RO2ACC": 2}
+    assert len(db.info["selects"]) == 1
+    assert cache.ids_for(db, ["RO2ACC", "RO1ACC"]) == {"RO1ACC": 1, "RO2ACC": 2}
+    assert cache.ibans_for(db, [1, 2, None]) == {1: "RO1ACC", 2: "RO2ACC"}
+    assert len(db.info["selects"]) == 1
+
+
+def test_negative_cache_ttl(db, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(ac.time, "monotonic", lambda: clock[0])
+    cache = AccountCache(maxsize=10, neg_ttl_sec=60)
+    assert cache.ids_for(db, ["RO9EXT"]) == {}
+    clock[0] += 30
+    assert cache.ids_for(db, ["RO9EXT"]) == {}
+    assert len(db.info["selects"]) == 1  # încă în cache-ul negativ
+
+    db.execute(insert(Account).values(id=9, iban="RO9EXT"))
+    clock[0] += 31  # TTL expirat -> re-verificat în DB
+    assert cache.ids_for(db, ["RO9EXT"]) == {"RO9EXT": 9}
+    assert len(db.info["selects"]) == 2
+    assert cache.stats()["negative"]["size"] == 0  # găsit -> scos din cache-ul negativ
+
+
+def test_lru_eviction_and_forget(db):
+    cache = AccountCache(maxsize=2)
+    cache.ids_for(db, ["RO1ACC", "RO2ACC"])
+    cache.ids_for(db, ["RO1ACC"])  # RO1 devine cel mai recent folosit
+    cache.ids_for(db, ["RO3ACC"])  # scoate RO2
+    n = len(db.info["selects"])
+    assert cache.ids_for(db, ["RO1ACC", "RO3ACC"]) == {"RO1ACC": 1, "RO3ACC": 3}
+    assert len(db.info["selects"]) == n
+    assert cache.ids_for(db, ["RO2ACC"]) == {"RO2ACC": 2}
+    assert len(db.info["selects"]) == n + 1
+    assert cache.stats()["by_iban"]["evictions"] >= 1
+
+    db.info["created_ibans"] = ["RO2ACC"]
+    cache.discard_created(db)
+    cache.ids_for(db, ["RO2ACC"])
+    assert len(db.info["selects"]) == n + 2
+
+
+def test_warm_loads_newest(db):
+    cache = AccountCache(maxsize=3)
+    assert cache.warm(db) == 3
+    n = len(db.info["selects"])
+    assert cache.ids_for(db, ["RO3ACC", "RO4ACC", "RO5ACC"]) == {"RO3ACC": 3, "RO4ACC": 4, "RO5ACC": 5}
+    assert len(db.info["selects"]) == n
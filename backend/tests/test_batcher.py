@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from sklearn.linear_model import LogisticRegression
+
+from app.ml.batcher import MicroBatcher
+from app.ml.compiled import CompiledScorer, probe_rows
+from app.ml.features import prepare_xy
+from app.ml.synthetic import generate_samples
+
+
+@pytest.fixture(scope="module")
+def scorer():
+    rows, labels, _ = generate_samples(n=1500, seed=42)
+    X, y, vect = prepare_xy(rows, labels)
+    return CompiledScorer.from_sklearn(LogisticRegression(max_iter=200).fit(X, y), vect)
+
+
+@pytest.fixture(scope="module")
+def rows():
+    rows, _, _ = generate_samples(n=200, seed=321)
+    return rows + probe_rows()
+
+
+async def _drive(predict, rows, concurrency):
+    out = [None] * len(rows)
+    it = iter(enumerate(rows))
+
+    async def client():
+        for i, row in it:
+            out[i] = await predict(row)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return out
+
+
+@pytest.mark.parametrize("window_ms,max_rows", [(2.0, 8), (5.0, 64), (0, 64)])
+def test_same_scores_as_direct(scorer, rows, window_ms, max_rows):
+    batcher = MicroBatcher(scorer.predict_proba_many, scorer.predict_proba, window_ms=window_ms, max_rows=max_rows)
+    got = asyncio.run(_drive(batcher.predict, rows, concurrency=16))
+    assert got == pytest.approx([scorer.predict_proba(r) for r in rows], abs=1e-12)
+
+    st = batcher.stats()
+    if window_ms:
+        assert st["batch_size"]["count"] > 0 and 1 < st["batch_size"]["max"] <= max_rows
+        assert sum(st["batch_size"]["buckets"].values()) == st["batch_size"]["count"]
+    else:
+        assert st["batch_size"]["count"] == 0  # fără batching: un thread per cerere
+    assert st["pending"] == 0 and st["inflight_batches"] == 0 and st["errors"] == 0
+
+
+def test_model_not_loaded(rows):
+    batcher = MicroBatcher(lambda rs: None, lambda r: None)
+    assert asyncio.run(_drive(batcher.predict, rows[:20], concurrency=4)) == [None] * 20
+
+
+def test_error_reaches_every_caller(rows):
+    def boom(rs):
+        raise RuntimeError("model failed")
+
+    batcher = MicroBatcher(boom, boom, window_ms=2.0)
+
+    async def run():
+        return await asyncio.gather(*(batcher.predict(r) for r in rows[:10]), return_exceptions=True)
+
+    out = asyncio.run(run())
+    assert all(isinstance(e, RuntimeError) for e in out)
+    assert batcher.stats()["errors"] >= 1
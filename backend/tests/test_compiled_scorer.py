@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+
+from app.ml.compiled import CompiledScorer, max_abs_diff, probe_rows
+from app.ml.features import prepare_xy
+from app.ml.synthetic import generate_samples
+
+TOL = 1e-6  # |p_sklearn - p_compiled| acceptat (ponderi float32 în X, float64 în scorer)
+
+
+@pytest.fixture(scope="module", params=[("tfidf", "raw"), ("tfidf", "log1p"), ("hashing", "raw")],
+                ids=lambda p: "-".join(p))
+def model(request):
+    mode, amount_transform = request.param
+    rows, labels, _ = generate_samples(n=1500, seed=42)
+    X, y, vect = prepare_xy(rows, labels, mode=mode, amount_transform=amount_transform)
+    clf = LogisticRegression(max_iter=200).fit(X, y)
+    return clf, vect, CompiledScorer.from_sklearn(clf, vect, amount_transform)
+
+
+def _rows():
+    rows, _, _ = generate_samples(n=300, seed=123)
+    return rows + probe_rows()
+
+
+def test_matches_sklearn(model):
+    clf, vect, scorer = model
+    assert max_abs_diff(scorer, clf, vect, _rows()) <= TOL
+
+
+def test_predict_many_matches_predict_one(model):
+    _, _, scorer = model
+    rows = _rows()
+    rows += rows[:20]  # descrieri repetate în același batch (calea de dedup / memo)
+    many = scorer.predict_proba_many(rows)
+    assert np.allclose(many, [scorer.predict_proba(r) for r in rows], rtol=0, atol=1e-12)
+    assert scorer.predict_proba_many(rows) == many  # a doua trecere vine din memo
+    assert scorer.predict_proba_many([]) == []
+
+
+def test_save_load_roundtrip(model, tmp_path):
+    clf, vect, scorer = model
+    scorer.save(str(tmp_path))
+    for mmap in (True, False):
+        loaded = CompiledScorer.load(str(tmp_path), mmap=mmap)
+        assert max_abs_diff(loaded, clf, vect, probe_rows()) <= TOL
@@ -0,0 +1,67 @@
+import time
+
+import fakeredis
+import pytest
+
+from app.services import hll
+
+SEC = 3600
+# adaugă ARGV[4..] cu ts=ARGV[3] și întoarce estimarea pe fereastră, ca scripturile mule/velocity
+SCRIPT = hll.HLL_LUA_FN + """
+local now, sec = tonumber(ARGV[1]), tonumber(ARGV[2])
+for i = 4, #ARGV do
+  hll_add(KEYS[1], KEYS[2], tonumber(ARGV[3]), ARGV[i], now, sec)
+end
+return hll_count(KEYS[1], KEYS[2], now, sec)
+"""
+
+
+@pytest.fixture
+def add():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    script = r.register_script(SCRIPT)
+
+    def add(now, members=(), ts=None):
+        keys = hll.window_keys("t:hll", SEC, now)
+        return script(keys=keys, args=[now, SEC, now if ts is None else ts, *members])
+
+    add.redis = r
+    return add
+
+
+def test_generation_swap(add):
+    # generațiile reale (EXPIREAT e absolut): g0 = generația curentă
+    base = int(time.time()) // SEC * SEC
+    g0_keys = hll.window_keys("t:hll", SEC, base)
+    assert add(base + 600, [f"a{i}" for i in range(10)]) == 10
+
+    # generația următoare: cheile își schimbă rolul, g0 devine "prev"
+    now = base + SEC + 900
+    cur, prev = hll.window_keys("t:hll", SEC, now)
+    assert (cur, prev) == (g0_keys[1], g0_keys[0])
+    # 4 noi + 10 din g0 ponderate cu partea rămasă în fereastră (0.75)
+    assert add(now, ["b0", "b1", "b2", "b3"]) == 4 + 8
+    r = add.redis
+    assert hll.estimate(r.pfcount(cur), r.pfcount(cur, prev), now, SEC) == 12
+
+    # ts din g0 -> în prev; ts mai vechi de o generație -> ignorat
+    add(now, ["late"], ts=base + 100)
+    add(now, ["stale"], ts=base - 100)
+    assert (r.pfcount(prev), r.pfcount(cur)) == (11, 4)
+
+    # la sfârșitul generației contează aproape doar cea curentă
+    assert add(base + 2 * SEC - 1) == 4
+
+    # fiecare generație expiră la sfârșitul celei următoare, deci e goală când paritatea revine
+    for key, expire_at in ((prev, base + 2 * SEC), (cur, base + 3 * SEC)):
+        assert abs(r.ttl(key) - (expire_at - time.time())) <= 2
+
+
+def test_estimate_matches_lua(add):
+    base = int(time.time()) // SEC * SEC
+    add(base + 10, [f"x{i}" for i in range(50)])
+    for offset in (0, 1, 900, 1800, 3599):
+        now = base + SEC + offset
+        lua = add(now, [f"y{offset}"])
+        cur, prev = hll.window_keys("t:hll", SEC, now)
+        assert lua == hll.estimate(add.redis.pfcount(cur), add.redis.pfcount(cur, prev), now, SEC)
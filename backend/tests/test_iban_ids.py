@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from app.services import iban_ids, mule, state_store, velocity
+
+from tests.conftest import make_store
+
+KEEP = max(mule.MULE_KEY_TTL_SEC, 2 * mule.HLL_WINDOW_SEC, 2 * velocity.WINDOW_SEC)
+
+
+@pytest.fixture
+def rds(monkeypatch):
+    monkeypatch.setattr(iban_ids, "IBAN_INTERN", True)
+    monkeypatch.setattr(iban_ids, "_names", iban_ids.LRUCache(100))
+    s = make_store("redis")
+    prev = state_store._store
+    state_store.set_store(s)
+    yield s.sync
+    state_store.set_store(prev)
+
+
+def test_compaction_reclaims_ids(rds):
+    store = state_store.get()
+    now = time.time()
+    store.mule_record(now - 60, "RO1SRC", "RO1DST")
+    store.mule_record(now - 30, "RO2SRC", "RO1DST")
+    assert rds.hgetall(iban_ids.NAMES) == {"1": "RO1SRC", "2": "RO1DST", "3": "RO2SRC"}
+    assert rds.zrange(mule._k_in_sources("RO1DST"), 0, -1) == ["1", "3"]
+    assert store.mule_stats("RO1DST", 24, now)["recent_sources"] == ["RO2SRC", "RO1SRC"]
+    assert store.mule_compact(now)["ids"] == 0
+
+    later = now + KEEP + 2 * iban_ids.IBAN_ID_GEN_SEC
+    rds.hset(iban_ids.IDS, mapping={"RO9LIVE": f"9:{iban_ids.gen(later)}", "RO8LEGACY": "8"})
+    rds.hset(iban_ids.NAMES, mapping={"9": "RO9LIVE", "8": "RO8LEGACY"})
+    out = store.mule_compact(later)
+    assert out["ids"] == 3 and list(store.mule_ibans()) == []
+    # văzut recent -> rămâne; fără generație -> primește generația curentă, nu e șters
+    assert rds.hgetall(iban_ids.NAMES) == {"9": "RO9LIVE", "8": "RO8LEGACY"}
+    assert rds.hget(iban_ids.IDS, "RO8LEGACY") == f"8:{iban_ids.gen(later)}"
+
+    # id-urile șterse nu se refolosesc: un IBAN revenit primește unul nou
+    store.mule_record(time.time(), "RO1SRC", "RO3DST")
+    assert rds.hget(iban_ids.IDS, "RO1SRC").split(":")[0] not in {"1", "2", "3"}
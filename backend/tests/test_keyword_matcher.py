@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from app.ml.compiled import probe_rows
+from app.ml.synthetic import generate_samples
+from app.services import text_signals
+from app.services.keyword_matcher import KeywordMatcher
+from app.services.text_signals import KEYPHRASES, KEYWORDS
+
+
+def naive_text_risk(description):
+    # implementarea dinainte de KeywordMatcher: întâi frazele, apoi cuvintele, `term in desc`
+    if not description:
+        return 0, []
+    desc = description.lower()
+    score, reasons = 0, []
+    for terms in (KEYPHRASES, KEYWORDS):
+        for term, w in terms.items():
+            if term in desc:
+                score += w
+                reasons.append(f"Keyword: '{term}'")
+    return min(score, 30), reasons
+
+
+DESCRIPTIONS = [
+    None, "", "x", "Rent March", "URGENT transfer", "urgent transfer urgent transfer",
+    "Investment opportunity: crypto exchange, fast profit!", "tax refund tax", "nftnft bitcoinbroker",
+    "lovely romance giveaway gift", "Quick LOAN for donation", "invest investment investments",
+]
+
+
+@pytest.fixture(autouse=True)
+def default_lists(monkeypatch):
+    monkeypatch.setattr(text_signals, "TEXT_SIGNALS_PATH", None)
+    text_signals.reload()
+    yield
+    text_signals.reload()
+
+
+def test_text_risk_matches_loop():
+    rows, _, _ = generate_samples(n=300, seed=99)
+    descs = DESCRIPTIONS + [r["description"] for r in rows + probe_rows()]
+    for d in descs:
+        assert text_signals.text_risk(d) == naive_text_risk(d), d
+    for d in descs:  # a doua oară din memo
+        assert text_signals.text_risk(d) == naive_text_risk(d), d
+
+
+def test_matcher_matches_substring_loop():
+    rnd = random.Random(7)
+    alphabet = "abcăș "
+    entries = [("", 1), ("ab", 2), ("ab", 3), ("b", 4), ("abc", 5), ("bca", 6), ("ăș", 7), ("c a", 8)]
+    entries += [("".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 6))), rnd.randint(1, 9))
+                for _ in range(200)]
+    matcher = KeywordMatcher(entries)
+    assert len(matcher) == len(entries)
+    for _ in range(500):
+        text = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 40)))
+        assert matcher.find(text) == [i for i, (term, _) in enumerate(entries) if term in text], text
@@ -0,0 +1,104 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, insert
+
+from app.ml import synthetic
+from app.ml.synthetic import generate_samples
+from app.models import Base, Transaction
+
+DESCS = {1: "urgent investitie crypto profit garantat", 0: "chirie luna curenta"}
+
+
+def _engine():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def _label(engine, ids, labeled_at):
+    rows = [{"id": i, "ts": labeled_at, "amount_cents": (900000 if i % 2 else 10000), "currency": "RON",
+             "channel": "web", "is_first_to_payee": bool(i % 2), "description": DESCS[i % 2],
+             "label": i % 2, "label_source": "analyst", "labeled_at": labeled_at} for i in ids]
+    with engine.begin() as conn:
+        conn.execute(insert(Transaction), rows)
+
+
+def test_train_from_db_watermark(ml_artifacts):
+    model = ml_artifacts
+    engine = _engine()
+    t1 = datetime.utcnow() - timedelta(hours=1)
+    _label(engine, range(1, 31), t1)
+    with engine.begin() as conn:  # neetichetat: nu intră în antrenare
+        conn.execute(insert(Transaction), [{"id": 99, "ts": t1, "amount_cents": 100, "currency": "RON",
+                                            "channel": "web"}])
+
+    first = model.train_from_db(chunk_rows=10, engine=engine)
+    assert (first["rows"], first["chunks"]) == (30, 3)
+    assert first["watermark"] == {"labeled_at": t1.isoformat(), "id": 30}
+    assert model.ml_state.loaded and model.predict_proba_one({"amount": 100, "description": "chirie"}) is not None
+
+    # același labeled_at cu id mai mare (după watermark) + rânduri etichetate mai târziu
+    _label(engine, range(31, 36), t1)
+    t2 = t1 + timedelta(minutes=10)
+    _label(engine, range(36, 41), t2)
+    cont = model.train_from_db(continue_current=True, chunk_rows=4, engine=engine)
+    assert (cont["rows"], cont["total_rows"], cont["continued_from"]) == (10, 40, first["version"])
+    assert cont["watermark"] == {"labeled_at": t2.isoformat(), "id": 40}
+    assert cont["auc"] is not None  # prequential: scorat de modelul anterior înainte de fit
+
+    again = model.train_from_db(continue_current=True, engine=engine)
+    assert again["skipped"] and again["watermark"] == cont["watermark"]
+
+
+def test_continue_requires_transactions_model(ml_artifacts):
+    model = ml_artifacts
+    model.train_and_save(n=600)
+    with pytest.raises(ValueError):
+        model.train_from_db(continue_current=True, engine=_engine())
+
+
+def test_shards_stream(tmp_path, monkeypatch):
+    path = str(tmp_path / "ds")
+    synthetic.write_dataset(path, n=250, shard_rows=100)
+    assert synthetic.dataset_rows(path) == 250
+    assert [len(c["label"]) for c in synthetic.iter_chunks(path, 40)] == [40, 40, 20, 40, 40, 20, 40, 10]
+
+    reads = []
+    real = synthetic._read_shard
+    monkeypatch.setattr(synthetic, "_read_shard", lambda p: reads.append(p) or real(p))
+    cols = synthetic.load_columns(path, limit=150)
+    assert len(cols["label"]) == 150 and len(reads) == 2
+    full = synthetic.load_columns(path)
+    np.testing.assert_array_equal(full["description"][:150], cols["description"])
+
+
+def test_parquet_without_pyarrow(monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    monkeypatch.setitem(sys.modules, "pyarrow.parquet", None)
+    with pytest.raises(RuntimeError, match="pyarrow"):
+        synthetic._read_shard("part-00000.parquet")
+
+
+def test_train_and_save_chunked(ml_artifacts, monkeypatch):
+    model = ml_artifacts
+    monkeypatch.setattr(model, "ML_TRAIN_FULL_MAX_ROWS", 1000)
+    monkeypatch.setattr(model, "ML_TRAIN_CHUNK_ROWS", 400)
+
+    small = model.train_and_save(n=1000)
+    assert "learner" not in small and small["auc"] > 0.9
+
+    big = model.train_and_save(n=2000)
+    assert (big["learner"], big["n"], big["chunks"], big["eval_rows"]) == ("sgd", 2000, 5, 1600)
+    assert big["auc"] > 0.9 and model.ml_state.version == big["version"]
+
+    synthetic.write_dataset(os.path.join(model.DATASETS_DIR, "ds"), n=1500, shard_rows=1000)
+    ds = model.train_and_save(dataset="ds")
+    assert (ds["learner"], ds["n"], ds["chunks"], ds["dataset"]) == ("sgd", 1500, 5, "ds")  # shard-uri 1000 + 500
+
+    rows, labels, _ = generate_samples(n=200, seed=5)
+    p = np.array(model.predict_proba_many(rows))
+    assert ((p >= 0.5) == np.array(labels, dtype=bool)).mean() > 0.9
@@ -0,0 +1,89 @@
+import pytest
+
+from app.services import mule_graph
+from app.services.mule_graph import TxGraph
+
+T0 = 1_700_000_000.0
+
+
+@pytest.fixture
+def g():
+    return TxGraph(window_sec=86400, bucket_sec=300)
+
+
+def test_pass_through_within_hop(g):
+    g.add("RO1A", "RO1MULE", 5000, T0)
+    g.add("RO1MULE", "RO1OUT", 4800, T0 + 600)
+    g.add("RO2A", "RO1MULE", 700, T0 + 7200)  # fără ieșire după ea
+    pt = g.pass_through("RO1MULE", within_sec=3600, now=T0 + 8000)
+    assert (pt["amount_in"], pt["amount_out"]) == (5000, 4800)
+    assert (pt["sources"], pt["dests"]) == (["RO1A"], ["RO1OUT"])
+    # ieșirea vine după mai mult decât within_sec
+    assert g.pass_through("RO1MULE", within_sec=300, now=T0 + 8000)["amount_out"] == 0
+    # ieșire înaintea intrării: nu e pass-through
+    g.add("RO3MULE", "RO3OUT", 1000, T0)
+    g.add("RO3A", "RO3MULE", 1000, T0 + 600)
+    assert g.pass_through("RO3MULE", within_sec=3600, now=T0 + 8000)["amount_out"] == 0
+
+
+def test_chains_respect_hop_time(g):
+    g.add("RO1X", "RO1A", 9000, T0)
+    g.add("RO1A", "RO1B", 8500, T0 + 900)
+    g.add("RO1B", "RO1C", 8000, T0 + 1800)
+    g.add("RO1A", "RO1LATE", 8000, T0 + 4 * 3600)
+    chains = g.chains("RO1X", hops=3, within_sec=3600, now=T0 + 5 * 3600)
+    assert chains[0] == {"path": ["RO1X", "RO1A", "RO1B", "RO1C"], "amount": 8000, "span_sec": 1800}
+    paths = [c["path"] for c in chains]
+    assert ["RO1X", "RO1A", "RO1B"] in paths
+    assert ["RO1X", "RO1A", "RO1LATE"] not in paths
+    assert g.chains("RO1X", hops=2, within_sec=3600, now=T0 + 5 * 3600) == [
+        {"path": ["RO1X", "RO1A", "RO1B"], "amount": 8500, "span_sec": 900}]
+
+
+def test_cycles(g):
+    g.add("RO1X", "RO1A", 1000, T0)
+    g.add("RO1A", "RO1B", 900, T0 + 60)
+    g.add("RO1B", "RO1X", 800, T0 + 120)
+    g.add("RO1X", "RO1C", 50, T0)
+    g.add("RO1C", "RO1X", 40, T0 + 60)
+    cycles = g.cycles("RO1X", max_len=4, now=T0 + 600)
+    assert cycles == [
+        {"path": ["RO1X", "RO1A", "RO1B", "RO1X"], "amount": 800},
+        {"path": ["RO1X", "RO1C", "RO1X"], "amount": 40},
+    ]
+    assert g.cycles("RO1X", max_len=2, now=T0 + 600) == [{"path": ["RO1X", "RO1C", "RO1X"], "amount": 40}]
+
+
+def test_window_expiry_and_compaction(g):
+    g.add("RO1OLD", "RO1DST", 100, T0)
+    g.add("RO1NEW", "RO1DST", 200, T0 + 86400)
+    later = T0 + 86400 + 600
+    d = g.degrees("RO1DST", now=later)
+    assert (d["fan_in"], d["tx_in"], d["amount_in"]) == (1, 1, 200)
+
+    g._compact(later)
+    assert g.stats()["nodes"] == 2 and g.stats()["edges"] == 1 and g.compactions == 1
+    assert g.degrees("RO1DST", now=later)["amount_in"] == 200
+    assert g.degrees("RO1OLD", now=later)["fan_out"] == 0
+
+
+def test_same_bucket_payments_share_an_edge(g):
+    for i in range(3):
+        g.add("RO1SRC", "RO1DST", 100, T0 + i)
+    g.add("RO1SRC", "RO1DST", 100, T0 + 600)
+    assert g.stats()["edges"] == 2
+    d = g.degrees("RO1DST", now=T0 + 700)
+    assert (d["fan_in"], d["tx_in"], d["amount_in"]) == (1, 4, 400)
+
+
+def test_payment_signals(g, monkeypatch):
+    monkeypatch.setattr(mule_graph, "G", g)
+    assert mule_graph.payment_signals("RO1SRC", "RO1MULE", now=T0) == (0, [])
+
+    g.add("RO1A", "RO1MULE", 5000, T0)
+    g.add("RO1MULE", "RO1B", 4900, T0 + 300)
+    g.add("RO1B", "RO1C", 4800, T0 + 600)
+    g.add("RO1B", "RO1MULE", 100, T0 + 900)
+    score, reasons = mule_graph.payment_signals("RO1SRC", "RO1MULE", now=T0 + 1200)
+    assert score == mule_graph.GRAPH_CAP
+    assert [r.split(" ")[1] for r in reasons] == ["beneficiary", "layering", "cycle"]
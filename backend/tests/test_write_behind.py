@@ -0,0 +1,94 @@
+import asyncio
+import contextlib
+
+import pytest
+
+from app.services import write_behind
+from app.services.write_behind import WriteBehind
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """persist_transactions_async înlocuit: fiecare flush reușit adaugă lotul (plăți, decizii)."""
+    batches, fail = [], {"times": 0}
+
+    async def persist(db, payments, decisions):
+        if fail["times"]:
+            fail["times"] -= 1
+            raise RuntimeError("db down")
+        batches.append((list(payments), list(decisions)))
+
+    monkeypatch.setattr(write_behind, "persist_transactions_async", persist)
+    return batches, fail
+
+
+@contextlib.asynccontextmanager
+async def _session():
+    yield None
+
+
+def _decision(i):
+    return (float(i), "allow", [])
+
+
+def test_stop_drains_in_order(written):
+    batches, _ = written
+
+    async def run():
+        wb = WriteBehind(_session, batch_size=100, flush_ms=60_000, maxsize=10_000)
+        await wb.start()
+        await wb.submit_many(list(range(250)), [_decision(i) for i in range(250)])
+        await wb.submit(250, _decision(250))
+        await wb.stop()
+        return wb
+
+    wb = asyncio.run(run())
+    assert [p for ps, _ in batches for p in ps] == list(range(251))
+    assert [d[0] for _, ds in batches for d in ds] == [float(i) for i in range(251)]
+    assert all(len(ps) <= 100 for ps, _ in batches)
+    st = wb.stats()
+    assert (st["enqueued"], st["written"], st["dropped"], st["enabled"]) == (251, 251, 0, False)
+
+
+def test_flush_after_window_without_stop(written):
+    batches, _ = written
+
+    async def run():
+        wb = WriteBehind(_session, batch_size=100, flush_ms=10, maxsize=100)
+        await wb.start()
+        await wb.submit_many([1, 2, 3], [_decision(i) for i in (1, 2, 3)])
+        for _ in range(100):
+            if batches:
+                break
+            await asyncio.sleep(0.01)
+        flushed = list(batches)
+        await wb.stop()
+        return flushed
+
+    assert [ps for ps, _ in asyncio.run(run())] == [[1, 2, 3]]
+
+
+def test_retry_then_drop(written):
+    batches, fail = written
+
+    async def run():
+        wb = WriteBehind(_session, batch_size=10, flush_ms=60_000, max_retries=3)
+        await wb.start()
+        fail["times"] = 2  # primul lot reușește la a treia încercare
+        await wb.submit_many([1, 2], [_decision(1), _decision(2)])
+        await wb.stop()
+        await wb.start()
+        fail["times"] = 3  # al doilea lot epuizează încercările
+        await wb.submit(3, _decision(3))
+        await wb.stop()
+        return wb.stats()
+
+    st = asyncio.run(run())
+    assert [ps for ps, _ in batches] == [[1, 2]]
+    assert (st["written"], st["errors"], st["dropped"]) == (2, 5, 1)
+
+
+def test_submit_requires_running_flusher():
+    wb = WriteBehind(_session)
+    with pytest.raises(RuntimeError):
+        asyncio.run(wb.submit(1, _decision(1)))